@@ -0,0 +1,94 @@
+#!/usr/bin/python3.9
+
+##########################################################################
+#  _  _   _   _   ___ _____    ____        _       _   _
+# | || | | \ | | |_ _|_   _|  / ___|  ___ | |_   _| |_(_) ___  _ __  ___
+# | || |_|  \| |  | |  | |____\___ \ / _ \| | | | | __| |/ _ \| '_ \/ __|
+# |__   _| |\  |  | |  | |_____|__) | (_) | | |_| | |_| | (_) | | | \__ \
+#    |_| |_| \_| |___| |_|    |____/ \___/|_|\__,_|\__|_|\___/|_| |_|___/
+#
+##########################################################################
+#
+# Name:         backup-restore.py
+# Company:      4N IT-Solutions GmbH
+#
+# Description:  Verify and restore incremental backups
+#
+# Requirements: Python version must be 3.8 or newer (i.e. Python 3.9 on Rocky Linux)
+#               The following non-default Python modules are required:
+#               nnnn_toolkit
+#
+# Known issues: -
+#
+##########################################################################
+
+# python doc
+"""
+Verify and restore incremental backups created by backup_daily / backup_last_few (incremental=True) : the
+files of a backup are checked against the size and SHA-256 checksum in its manifest.
+
+Usage:
+backup-restore.py -b <backup directory> [-r <target directory>] [-n] [-d]
+
+   -b <directory>:      Backup directory to verify / restore, e.g. /opt/qip/current/dhcp.bak/last_few/1
+
+   -r <directory>:      Restore the backup to the directory (created if it does not exist), existing files are
+                        overwritten. Without "-r" the backup is only verified.
+
+   -n:                  Do not verify the backup before restoring it
+
+   -d:                  Enable debugging output
+
+Exit code is 0 if the backup is intact / has been restored, 1 if the verification found problems, 2 on errors.
+"""
+
+# required modules
+import os
+import argparse
+# required for binary build
+from sys import exit
+
+# 4N modules
+import nnnn_toolkit as toolkit
+
+# exit codes
+exit_code_verify = 1
+exit_code_error = 2
+
+# initialize logging
+logger = toolkit.Logger(console_logging = True)
+logger.set_level("INFO")
+
+arg_parser = argparse.ArgumentParser(description='4N Backup Verify / Restore', allow_abbrev=False, add_help=True)
+arg_parser.add_argument('-b', '--backup-dir', required=True, help="Backup directory to verify / restore")
+arg_parser.add_argument('-r', '--restore-dir', help="Directory to restore the backup to")
+arg_parser.add_argument('-n', '--no-verify', action='store_true', help="Do not verify the backup before restoring it")
+arg_parser.add_argument('-d', '--debug', action='store_true', help="Enable debugging")
+args = arg_parser.parse_args()
+
+if args.debug:
+   logger.set_level("DEBUG")
+
+if not os.path.isdir(args.backup_dir):
+   logger.error("Backup directory {} does not exist".format(args.backup_dir))
+   exit(exit_code_error)
+
+# verify
+if not args.restore_dir or not args.no_verify:
+   diff_messages = toolkit.verify_backup(args.backup_dir)
+   for message in diff_messages:
+      logger.error(message)
+   if diff_messages:
+      logger.error("Backup {} is not intact ({} problems)".format(args.backup_dir, len(diff_messages)))
+      exit(exit_code_verify)
+   logger.info("Backup {} is intact ({} files)".format(args.backup_dir, len(toolkit.read_backup_manifest(args.backup_dir))))
+
+# restore, the backup has been verified above
+if args.restore_dir:
+   error = toolkit.restore_backup(args.backup_dir, args.restore_dir, verify=False)
+   if error:
+      logger.error("Restoring {} to {} failed with error code {}".format(args.backup_dir, args.restore_dir, error))
+      exit(exit_code_error)
+   logger.info("Backup {} restored to {}".format(args.backup_dir, args.restore_dir))
+
+exit(0)
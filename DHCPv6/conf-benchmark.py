@@ -0,0 +1,589 @@
+#!/usr/bin/python3.9
+
+##########################################################################
+#  _  _   _   _   ___ _____    ____        _       _   _
+# | || | | \ | | |_ _|_   _|  / ___|  ___ | |_   _| |_(_) ___  _ __  ___
+# | || |_|  \| |  | |  | |____\___ \ / _ \| | | | | __| |/ _ \| '_ \/ __|
+# |__   _| |\  |  | |  | |_____|__) | (_) | | |_| | |_| | (_) | | | \__ \
+#    |_| |_| \_| |___| |_|    |____/ \___/|_|\__,_|\__|_|\___/|_| |_|___/
+#
+##########################################################################
+#
+# Name:         conf-benchmark.py
+# Company:      4N IT-Solutions GmbH
+#
+# Description:  Round-trip and performance benchmark for the dhcpd.conf and named.conf parsers and
+#               the MAC / DUID normalization
+#
+# Requirements: Python version must be 3.8 or newer (i.e. Python 3.9 on Rocky Linux)
+#               The following non-default Python modules are required:
+#               nnnn_toolkit
+#
+# Known issues: named.conf is written in the normalized format of named-checkconf -p, the
+#               stand-in named-checkconf / named-checkzone just pass the files through
+#
+##########################################################################
+
+# python doc
+"""
+Round-trip and performance benchmark for DhcpdConf and NamedConf. Synthetic configurations are generated
+for each scale, parsed, dumped and compared. MACs are normalized to HardwareKey and formatted again.
+Checks and timings / peak memory are reported as JSON.
+
+Runs without QIP : stand-in scripts for named-checkconf and named-checkzone are created in the work
+directory unless a directory with the real tools is specified.
+
+Usage:
+conf-benchmark.py [-s <scale>] [-6] [--subnets <n>] [--ranges <n>] [--fixed-addresses <n>] [--client-classes <n>]
+                  [--shared-networks <n>] [--views <n>] [--zones <n>] [--acls <n>] [--records <n>] [--addresses <n>]
+                  [-r <repeat>] [-o <results file>] [-b <baseline file>] [-t <tolerance>] [-B <bin dir>] [-k] [-d]
+
+   -s <scale>:          Scale(s) to run, can be specified multiple times : small (default), medium, large
+
+   -6:                  Also run DHCPv6 configurations
+
+   --<parameter> <n>:   Overwrite the parameter of the selected scale(s), parameters are per configuration
+                        (subnets, shared networks, views, ACLs), per subnet (ranges, fixed addresses),
+                        per range (client classes), per view (zones), per zone (records) or the number
+                        of MACs to normalize (addresses)
+
+   -r <repeat>:         Number of timed runs per measurement, the best run is reported, defaults to 3
+
+   -o <results file>:   Write the results to the file instead of STDOUT
+
+   -b <baseline file>:  Compare timings to the results of a previous run
+
+   -t <tolerance>:      Relative slowdown compared to the baseline that is reported as regression, defaults to 0.25
+
+   -B <bin dir>:        Directory with named-checkconf / named-checkzone to use instead of the stand-ins
+
+   -k:                  Keep the work directory with the generated configurations
+
+   -d:                  Enable debugging output
+
+Exit codes: 0 all checks passed, 1 timing regression(s) compared to the baseline, 2 failed check(s)
+"""
+
+# required modules
+import os
+import sys
+import copy
+import json
+import time
+import re
+import shutil
+import socket
+import platform
+import argparse
+import tempfile
+import ipaddress
+import tracemalloc
+# required for binary build
+from sys import exit
+
+# 4N modules
+import nnnn_toolkit as toolkit
+
+# exit codes
+exit_code_warning = 1
+exit_code_error = 2
+
+# configuration sizes
+scales = {
+   "small" :  { "subnets" : 50, "ranges" : 2, "fixed_addresses" : 10, "client_classes" : 1, "shared_networks" : 5,
+                "views" : 2, "zones" : 20, "acls" : 5, "records" : 20, "addresses" : 100000 },
+   "medium" : { "subnets" : 500, "ranges" : 2, "fixed_addresses" : 50, "client_classes" : 2, "shared_networks" : 50,
+                "views" : 4, "zones" : 200, "acls" : 20, "records" : 50, "addresses" : 1000000 },
+   "large" :  { "subnets" : 2000, "ranges" : 4, "fixed_addresses" : 100, "client_classes" : 2, "shared_networks" : 200,
+                "views" : 8, "zones" : 1000, "acls" : 50, "records" : 100, "addresses" : 5000000 },
+}
+
+# MAC normalization of dhcp-probe.py before HardwareKey, measured for comparison
+legacy_mac_regex = re.compile("^([0-9a-fA-F]{2})([:\\-]?)([0-9a-fA-F]{2})([:\\-]?)([0-9a-fA-F]{2})([:\\-]?)([0-9a-fA-F]{2})([:\\-]?)([0-9a-fA-F]{2})([:\\-]?)([0-9a-fA-F]{2})$")
+
+# stand-ins for the BIND tools, named.conf and zone files are generated in normalized format
+stand_in_check_conf = """#!{python}
+# stand-in for named-checkconf -p
+import sys
+args = sys.argv[1:]
+with open(args[args.index("-p") + 1]) as fh:
+   sys.stdout.write(fh.read())
+"""
+stand_in_check_zone = """#!{python}
+# stand-in for named-checkzone -o
+import sys, shutil
+args = sys.argv[1:]
+shutil.copyfile(args[-1], args[args.index("-o") + 1])
+"""
+
+# initialize logging
+logger = toolkit.Logger(console_logging = True)
+logger.set_level("INFO")
+
+##
+## generators
+##
+
+def subnet_prefix(i, v6=False):
+   """
+   The prefix of the i-th synthetic subnet : /22 in 10.0.0.0/8 or /64 in fdec::/16.
+   """
+   if v6:
+      return ipaddress.IPv6Network("fdec:{:x}:{:x}::/64".format(i >> 16, i & 0xffff))
+   return ipaddress.IPv4Network((0x0a000000 + (i << 10), 22))
+
+def generate_dhcpd_conf(subnets, ranges, fixed_addresses, client_classes, shared_networks=0, v6=False):
+   """
+   Generate a dhcpd.conf in VitalQIP syntax. Every subnet has `ranges` dynamic ranges and `fixed_addresses`
+   fixed addresses, every range has `client_classes` user classes. The first 2 * `shared_networks` subnets
+   are grouped into shared networks of two subnets (DHCPv4 only).
+
+   Returns
+   -------
+   str
+      The dhcpd.conf contents.
+   """
+
+   if subnets > 16384 or fixed_addresses > 510 or not 0 < ranges <= 254 or shared_networks * 2 > subnets:
+      raise ValueError("generate_dhcpd_conf: parameters exceed the synthetic address plan")
+   lines = []
+   if v6:
+      lines.append("v6-server-identifier dhcp6.example.com;\n")
+   else:
+      lines.append("server-identifier dhcp.example.com;\n")
+
+   for i in range(subnets):
+      indent = "   "
+      prefix = subnet_prefix(i, v6)
+      if v6:
+         lines.append("{}v6-subnet {}/{} {{\n".format(indent, prefix.network_address, prefix.prefixlen))
+      else:
+         if i < shared_networks * 2 and i % 2 == 0:
+            lines.append("# Name: Shared Network {}\n".format(i // 2))
+            lines.append("   shared-network {} {{\n".format(str(prefix.network_address).replace(".", "_").join(["_", ""])))
+         if i < shared_networks * 2:
+            indent = "      "
+         lines.append("{}subnet {} netmask {} {{\n".format(indent, prefix.network_address, prefix.netmask))
+         lines.append("{}   option routers {};\n".format(indent, prefix.network_address + 1))
+
+      # dynamic ranges
+      base = prefix.network_address
+      chunk = 508 // ranges
+      for j in range(ranges):
+         start = base + 2 + j * chunk
+         if v6:
+            lines.append("{}   v6-dynamic-dhcp range {} {} {{\n".format(indent, start, start + chunk - 1))
+            lines.append("{}      option dhcp6.name-servers {};\n".format(indent, base + 1))
+         else:
+            lines.append("{}   dynamic-dhcp range {} {} {{\n".format(indent, start, start + chunk - 1))
+            lines.append("{}      option domain-name-servers {};\n".format(indent, base + 1))
+         lines.append("{}      policy lease-time 3600;\n".format(indent))
+         for k in range(client_classes):
+            lines.append('{}      user-class "uc{}" {{\n'.format(indent, k))
+            lines.append('{}         option domain-name "uc{}.example.com";\n'.format(indent, k))
+            lines.append("{}      }}\n".format(indent))
+         lines.append("{}   }}\n".format(indent))
+
+      # fixed addresses
+      for k in range(fixed_addresses):
+         mac = "00-4e-{:02x}-{:02x}-{:02x}-{:02x}".format(i >> 8, i & 0xff, k >> 8, k & 0xff)
+         if v6 and k % 2:
+            lines.append("{}   v6-manual-dhcp duid 00-01-00-01-{} {} {{\n".format(indent, mac, base + 512 + k))
+         elif v6:
+            lines.append("{}   v6-manual-dhcp-mac {} {} {{\n".format(indent, mac, base + 512 + k))
+         else:
+            lines.append("{}   manual-dhcp {} {} {{\n".format(indent, mac, base + 512 + k))
+         lines.append("{}   }}\n".format(indent))
+
+      lines.append("{}}}\n".format(indent))
+      if i < shared_networks * 2 and i % 2 == 1:
+         lines.append("   }\n")
+
+   return "".join(lines)
+
+def generate_named_conf(named_conf_dir, views, zones, acls, records):
+   """
+   Generate named.conf in the normalized format of named-checkconf -p plus one zone file per zone.
+   Every view has `zones` primary zones with `records` A records each, every other zone allows dynamic
+   updates. ACL n references ACL n-1, the views match the last ACL.
+
+   Returns
+   -------
+   str
+      The path to the generated named.conf.
+   """
+
+   lines = []
+   lines.append("options {\n")
+   lines.append('\tdirectory "{}";\n'.format(named_conf_dir))
+   lines.append("\tallow-query {\n\t\t\"any\";\n\t};\n")
+   lines.append("};\n")
+   for n in range(acls):
+      lines.append('acl "acl{}" {{\n'.format(n))
+      lines.append("\t10.{}.0.0/16;\n".format(n % 256))
+      if n > 0:
+         lines.append('\t"acl{}";\n'.format(n - 1))
+      lines.append("};\n")
+
+   for v in range(max(views, 1)):
+      indent = ""
+      if views:
+         lines.append('view "view{}" {{\n'.format(v))
+         lines.append("\tmatch-clients {\n")
+         lines.append('\t\t"acl{}";\n'.format(acls - 1) if acls else "\t\t\"any\";\n")
+         lines.append("\t};\n")
+         indent = "\t"
+      for z in range(zones):
+         zone_name = "z{}.example.com".format(z)
+         zone_file = "view{}-{}.db".format(v, zone_name)
+         lines.append('{}zone "{}" {{\n'.format(indent, zone_name))
+         lines.append("{}\ttype master;\n".format(indent))
+         lines.append('{}\tfile "{}";\n'.format(indent, zone_file))
+         lines.append("{}\tallow-update {{\n".format(indent))
+         lines.append('{}\t\t{};\n'.format(indent, '"acl0"' if z % 2 and acls else '"none"'))
+         lines.append("{}\t}};\n".format(indent))
+         lines.append("{}}};\n".format(indent))
+
+         # zone file in named-checkzone -o format
+         with open(os.path.join(named_conf_dir, zone_file), "w") as fh:
+            fh.write("{}.\t3600\tIN\tSOA\tns.{}. hostmaster.{}. 1 3600 600 86400 3600\n".format(zone_name, zone_name, zone_name))
+            fh.write("{}.\t3600\tIN\tNS\tns.{}.\n".format(zone_name, zone_name))
+            for r in range(records):
+               fh.write("host{}.{}.\t3600\tIN\tA\t10.{}.{}.{}\n".format(r, zone_name, v % 256, r >> 8 & 0xff, r & 0xff))
+      if views:
+         lines.append("};\n")
+
+   named_conf_path = os.path.join(named_conf_dir, "named.conf")
+   with open(named_conf_path, "w") as fh:
+      fh.writelines(lines)
+   return named_conf_path
+
+def install_stand_ins(bin_dir):
+   """
+   Create the stand-in named-checkconf and named-checkzone in `bin_dir`.
+   """
+   for tool, script in (("named-checkconf", stand_in_check_conf), ("named-checkzone", stand_in_check_zone)):
+      tool_path = os.path.join(bin_dir, tool)
+      with open(tool_path, "w") as fh:
+         fh.write(script.format(python=sys.executable))
+      os.chmod(tool_path, 0o755)
+
+##
+## measurements
+##
+
+def measure(function, repeat):
+   """
+   Run `function` once with tracemalloc for the peak memory and `repeat` times for the timing.
+
+   Returns
+   -------
+   (result, measurement)
+      The return value of the last run and a dict with the best run in seconds and the peak memory in KiB.
+   """
+   tracemalloc.start()
+   try:
+      result = function()
+      (current, peak) = tracemalloc.get_traced_memory()
+   finally:
+      tracemalloc.stop()
+   best = None
+   for i in range(repeat):
+      start = time.perf_counter()
+      result = function()
+      elapsed = time.perf_counter() - start
+      if best is None or elapsed < best:
+         best = elapsed
+   return (result, { "seconds" : round(best, 6), "peak_kib" : peak // 1024 })
+
+def comparable(conf):
+   # configuration without the bits that depend on the file location
+   conf = copy.deepcopy(conf)
+   conf.pop("file_name", None)
+   conf.pop("has_changed", None)
+   return conf
+
+def run_dhcpd(work_dir, name, parameters, v6, repeat):
+   """
+   Generate, parse, dump and diff a dhcpd.conf.
+
+   Checks
+   ------
+   counters : the parsed counters match the generator parameters
+   validate : DhcpdConf.validate does not report any findings
+   round-trip : parsing the dump yields the same configuration
+   dump-stable : dumping the re-parsed configuration yields the same text
+   diff-equal : diff between the original and the re-parsed configuration is empty
+   diff-change : diff detects a removed fixed address
+   subnet-lookup : the batch lookup of the fixed address IPs finds the subnet of every fixed address
+   batch : a bulk edit adding one fixed address per subnet is committed and dumped correctly
+   """
+   conf_dir = os.path.join(work_dir, name)
+   dump_dir = os.path.join(conf_dir, "dump")
+   os.makedirs(dump_dir)
+   p = parameters
+   text = generate_dhcpd_conf(p["subnets"], p["ranges"], p["fixed_addresses"], p["client_classes"], 0 if v6 else p["shared_networks"], v6)
+   with open(os.path.join(conf_dir, "dhcpd.conf"), "w") as fh:
+      fh.write(text)
+
+   result = { "name" : name, "parameters" : dict(parameters, v6=v6), "lines" : text.count("\n"), "bytes" : len(text), "measurements" : {}, "checks" : {} }
+   measurements = result["measurements"]
+   checks = result["checks"]
+
+   (dhcpd_conf, measurements["parse"]) = measure(lambda: toolkit.DhcpdConf(conf_dir, pcy_file_name=None), repeat)
+   (dump, measurements["dump"]) = measure(dhcpd_conf.dump, repeat)
+   if dhcpd_conf.dump_to_file(dump_dir, force=True):
+      raise OSError("Failed to dump dhcpd.conf to {}".format(dump_dir))
+   dumped_conf = toolkit.DhcpdConf(dump_dir, pcy_file_name=None)
+   (diff, measurements["diff"]) = measure(lambda: dhcpd_conf.diff(dumped_conf), repeat)
+   (findings, measurements["validate"]) = measure(dhcpd_conf.validate, repeat)
+
+   counters = dhcpd_conf.get_config()["counters"]
+   if v6:
+      expected = { "subnets" : p["subnets"], "v6-dynamic-dhcp" : p["subnets"] * p["ranges"],
+                   "v6-manual-dhcp-mac" : p["subnets"] * ((p["fixed_addresses"] + 1) // 2),
+                   "v6-manual-dhcp" : p["subnets"] * (p["fixed_addresses"] // 2) }
+   else:
+      expected = { "subnets" : p["subnets"], "dynamic-dhcp" : p["subnets"] * p["ranges"],
+                   "manual-dhcp" : p["subnets"] * p["fixed_addresses"] }
+   expected = { key : value for (key, value) in expected.items() if value }
+   if p["shared_networks"] and not v6:
+      expected["shared-networks"] = p["shared_networks"]
+   checks["counters"] = all(counters.get(key) == value for (key, value) in expected.items())
+   checks["validate"] = not findings
+   checks["round-trip"] = comparable(dhcpd_conf.get_config()) == comparable(dumped_conf.get_config()) and dhcpd_conf.is_v6() == dumped_conf.is_v6()
+   checks["dump-stable"] = dump == dumped_conf.dump()
+   checks["diff-equal"] = not diff
+   if p["fixed_addresses"]:
+      subnet = dumped_conf.get_subnets()[-1]
+      subnet["ranges"].pop()
+      checks["diff-change"] = len(dhcpd_conf.diff(dumped_conf)) > 0
+
+   fixed_addresses = [ (range_config["ip"], subnet) for subnet in dhcpd_conf.get_subnets() for range_config in dhcpd_conf.get_ranges(subnet) if "ip" in range_config ]
+   ips = [ ip for (ip, subnet) in fixed_addresses ]
+   (found, measurements["subnet-lookup"]) = measure(lambda: dhcpd_conf.find_subnets(ips, 6 if v6 else 4), repeat)
+   checks["subnet-lookup"] = len(found) == len(fixed_addresses) and all(subnet_config is subnet for (subnet_config, (ip, subnet)) in zip(found, fixed_addresses))
+
+   # bulk edit : staged and rolled back for the measurement, committed once for the check
+   def stage_batch():
+      batch = dhcpd_conf.begin_batch()
+      for i in range(p["subnets"]):
+         batch.add_fixed_address(str(subnet_prefix(i, v6).network_address + 1022), "00-4f-{:02x}-{:02x}-00-00".format(i >> 8, i & 0xff))
+      return batch
+   (batch, measurements["batch"]) = measure(lambda: stage_batch().rollback(), repeat)
+   fixed_type = "v6-manual-dhcp-mac" if v6 else "manual-dhcp"
+   fixed_count = dhcpd_conf.get_config()["counters"].get(fixed_type, 0)
+   edits = stage_batch().commit()
+   batch_dir = os.path.join(conf_dir, "batch")
+   os.makedirs(batch_dir)
+   if dhcpd_conf.dump_to_file(batch_dir):
+      raise OSError("Failed to dump dhcpd.conf to {}".format(batch_dir))
+   batch_conf = toolkit.DhcpdConf(batch_dir, pcy_file_name=None)
+   checks["batch"] = (edits == p["subnets"] and batch_conf.get_config()["counters"].get(fixed_type) == fixed_count + edits
+                      and comparable(dhcpd_conf.get_config()) == comparable(batch_conf.get_config()))
+
+   for message in diff:
+      logger.debug("{} : {}".format(name, message))
+   for finding in findings:
+      logger.debug("{} : line {} {}".format(name, finding["line"], finding["message"]))
+   return result
+
+def run_named(work_dir, name, parameters, bin_dirs, repeat):
+   """
+   Generate and parse a named.conf, evaluate ACLs and read the zones.
+
+   Checks
+   ------
+   counters : the parsed counters match the generator parameters
+   acls : the ACL chain evaluates to one address-list element per ACL
+   dynamic : every other zone is detected as dynamic
+   records : the records read from every zone match the zone file
+   """
+   conf_dir = os.path.join(work_dir, name)
+   os.makedirs(conf_dir)
+   p = parameters
+   named_conf_path = generate_named_conf(conf_dir, p["views"], p["zones"], p["acls"], p["records"])
+
+   result = { "name" : name, "parameters" : dict(parameters), "lines" : 0, "bytes" : os.path.getsize(named_conf_path), "measurements" : {}, "checks" : {} }
+   measurements = result["measurements"]
+   checks = result["checks"]
+
+   (named_conf, measurements["parse"]) = measure(lambda: toolkit.NamedConf(conf_dir, bin_dirs=bin_dirs), repeat)
+   result["lines"] = named_conf.get_config_raw().count("\n")
+   view_names = [ "view{}".format(v) for v in range(p["views"]) ] or [ "__NO_VIEW__" ]
+
+   def read_records():
+      records = 0
+      for view_name in view_names:
+         for zone in named_conf.get_zones(view_name):
+            for owner in named_conf.get_records(view_name, zone["zone_name"]).values():
+               for record_type in owner.values():
+                  records += len(record_type["rdata"])
+      return records
+   (records, measurements["records"]) = measure(read_records, repeat)
+
+   counters = named_conf.get_config()["counters"]
+   checks["counters"] = counters["views"] == p["views"] and counters["zones"] == p["zones"] * max(p["views"], 1) and counters["acls"] == p["acls"]
+   if p["acls"]:
+      checks["acls"] = len(named_conf.evaluate_acl("acl{}".format(p["acls"] - 1))) == p["acls"]
+   dynamic = [ named_conf.is_dynamic(view_names[0], zone["zone_name"]) for zone in named_conf.get_zones(view_names[0]) ]
+   checks["dynamic"] = dynamic.count(True) == (p["zones"] // 2 if p["acls"] else 0)
+   checks["records"] = records == (p["records"] + 2) * p["zones"] * len(view_names)
+   return result
+
+def run_keys(name, parameters, repeat):
+   """
+   Normalize MACs in dhcpd.conf format to HardwareKey and format them again.
+
+   Checks
+   ------
+   round-trip : formatting the keys yields the original MACs, cached and uncached keys are the same
+   formats : MACs separated by ":", "." or not separated at all yield the same keys
+   unique : distinct MACs yield distinct keys
+   legacy : the keys formatted with ":" match the normalization of the legacy regex
+   """
+   count = parameters["addresses"]
+   macs = [ "00-4e-{:02x}-{:02x}-{:02x}-{:02x}".format(i >> 24 & 0xff, i >> 16 & 0xff, i >> 8 & 0xff, i & 0xff) for i in range(count) ]
+
+   result = { "name" : name, "parameters" : dict(parameters), "measurements" : {}, "checks" : {} }
+   measurements = result["measurements"]
+   checks = result["checks"]
+
+   parse_key = toolkit.HardwareKey.parse
+   (keys, measurements["parse"]) = measure(lambda: [ parse_key(mac, cache=False) for mac in macs ], repeat)
+   (cached_keys, measurements["parse-cached"]) = measure(lambda: [ parse_key(mac) for mac in macs[:toolkit.HardwareKey.cache_size] ], repeat)
+   (formatted, measurements["format"]) = measure(lambda: [ key.format(":") for key in keys ], repeat)
+   (unique, measurements["set"]) = measure(lambda: set(keys), repeat)
+   (legacy, measurements["legacy-regex"]) = measure(lambda: [ legacy_mac_regex.sub(r"\1:\3:\5:\7:\9:\11", mac) for mac in macs ], repeat)
+
+   sample = macs[:10000]
+   sample_keys = keys[:10000]
+   checks["round-trip"] = [ key.format("-") for key in keys ] == macs and cached_keys == keys[:len(cached_keys)]
+   variants = [ [ mac.replace("-", ":") for mac in sample ], [ mac.replace("-", "") for mac in sample ],
+                [ "{}{}.{}{}.{}{}".format(*mac.split("-")) for mac in sample ] ]
+   checks["formats"] = all([ parse_key(mac) for mac in variant ] == sample_keys for variant in variants)
+   checks["unique"] = len(unique) == count
+   checks["legacy"] = formatted == legacy
+   return result
+
+def compare(results, baseline, tolerance):
+   """
+   Compare the timings to a baseline. Returns a list of regressions.
+   """
+   regressions = []
+   baseline_results = { result["name"] : result for result in baseline.get("results", []) }
+   for result in results:
+      if result["name"] not in baseline_results:
+         continue
+      baseline_result = baseline_results[result["name"]]
+      if baseline_result["parameters"] != result["parameters"]:
+         logger.warning("Parameters of {} differ from the baseline, skipping comparison".format(result["name"]))
+         continue
+      for (operation, measurement) in result["measurements"].items():
+         reference = baseline_result["measurements"].get(operation)
+         if not reference:
+            continue
+         for metric in ("seconds", "peak_kib"):
+            if reference[metric] and measurement[metric] > reference[metric] * (1 + tolerance):
+               regressions.append({ "name" : result["name"], "operation" : operation, "metric" : metric,
+                                    "baseline" : reference[metric], "value" : measurement[metric],
+                                    "ratio" : round(measurement[metric] / reference[metric], 2) })
+   return regressions
+
+##
+## main
+##
+
+arg_parser = argparse.ArgumentParser(description='4N Configuration Parser Benchmark', allow_abbrev=False, add_help=True)
+arg_parser.add_argument('-s', '--scale', action='append', choices=list(scales), help="Scale(s) to run")
+arg_parser.add_argument('-6', '--v6', action='store_true', help="Also run DHCPv6 configurations")
+for parameter in scales["small"]:
+   arg_parser.add_argument('--' + parameter.replace("_", "-"), type=int, dest=parameter, help="Overwrite {} of the scale(s)".format(parameter.replace("_", " ")))
+arg_parser.add_argument('-r', '--repeat', type=int, default=3, help="Number of timed runs per measurement")
+arg_parser.add_argument('-o', '--output', help="Results file")
+arg_parser.add_argument('-b', '--baseline', help="Results of a previous run to compare to")
+arg_parser.add_argument('-t', '--tolerance', type=float, default=0.25, help="Relative slowdown reported as regression")
+arg_parser.add_argument('-B', '--bin-dir', help="Directory with named-checkconf / named-checkzone")
+arg_parser.add_argument('-k', '--keep', action='store_true', help="Keep the work directory")
+arg_parser.add_argument('-d', '--debug', action='store_true', help="Enable debugging")
+args = arg_parser.parse_args()
+
+if args.debug:
+   logger.set_level("DEBUG")
+
+baseline = None
+if args.baseline:
+   try:
+      with open(args.baseline) as fh:
+         baseline = json.load(fh)
+   except (OSError, ValueError) as error:
+      logger.error("Failed to read baseline {} : {} - {}".format(args.baseline, type(error).__name__, error))
+      exit(exit_code_error)
+
+work_dir = tempfile.mkdtemp(prefix="conf-benchmark.")
+if args.bin_dir:
+   bin_dirs = (args.bin_dir,)
+else:
+   bin_dirs = (os.path.join(work_dir, "bin"),)
+   os.makedirs(bin_dirs[0])
+   install_stand_ins(bin_dirs[0])
+
+results = []
+failed = []
+try:
+   for scale in args.scale or [ "small" ]:
+      parameters = dict(scales[scale])
+      for parameter in parameters:
+         if getattr(args, parameter) is not None:
+            parameters[parameter] = getattr(args, parameter)
+      runs = [ ("dhcpd-v4-" + scale, False) ]
+      if args.v6:
+         runs.append(("dhcpd-v6-" + scale, True))
+      for (name, v6) in runs:
+         logger.info("Running {}".format(name))
+         results.append(run_dhcpd(work_dir, name, { key : parameters[key] for key in ("subnets", "ranges", "fixed_addresses", "client_classes", "shared_networks") }, v6, args.repeat))
+      name = "named-" + scale
+      logger.info("Running {}".format(name))
+      results.append(run_named(work_dir, name, { key : parameters[key] for key in ("views", "zones", "acls", "records") }, bin_dirs, args.repeat))
+      name = "keys-" + scale
+      logger.info("Running {}".format(name))
+      results.append(run_keys(name, { "addresses" : parameters["addresses"] }, args.repeat))
+except (OSError, ValueError, SyntaxError, SystemError) as error:
+   logger.error("Benchmark failed : {} - {}".format(type(error).__name__, error))
+   exit(exit_code_error)
+finally:
+   if args.keep:
+      logger.info("Generated configurations are kept in {}".format(work_dir))
+   else:
+      shutil.rmtree(work_dir, ignore_errors=True)
+
+for result in results:
+   result["passed"] = all(result["checks"].values())
+   for (check, passed) in result["checks"].items():
+      if not passed:
+         logger.error("{} : check {} failed".format(result["name"], check))
+         failed.append("{}/{}".format(result["name"], check))
+
+report = { "timestamp" : int(time.time()), "host" : socket.gethostname(), "python" : platform.python_version(),
+           "repeat" : args.repeat, "results" : results }
+if baseline:
+   report["regressions"] = compare(results, baseline, args.tolerance)
+   for regression in report["regressions"]:
+      logger.warning("{name} : {operation} {metric} {value} vs. {baseline} in baseline ({ratio}x)".format(**regression))
+
+text = json.dumps(report, indent=2)
+if args.output:
+   try:
+      with open(args.output, "w") as fh:
+         fh.write(text + "\n")
+   except OSError as error:
+      logger.error("Failed to write {} : {} - {}".format(args.output, type(error).__name__, error))
+      exit(exit_code_error)
+else:
+   print(text)
+
+if failed:
+   exit(exit_code_error)
+if baseline and report["regressions"]:
+   exit(exit_code_warning)
+exit(0)
@@ -0,0 +1,122 @@
+#!/usr/bin/python3.9
+
+##########################################################################
+#  _  _   _   _   ___ _____    ____        _       _   _
+# | || | | \ | | |_ _|_   _|  / ___|  ___ | |_   _| |_(_) ___  _ __  ___
+# | || |_|  \| |  | |  | |____\___ \ / _ \| | | | | __| |/ _ \| '_ \/ __|
+# |__   _| |\  |  | |  | |_____|__) | (_) | | |_| | |_| | (_) | | | \__ \
+#    |_| |_| \_| |___| |_|    |____/ \___/|_|\__,_|\__|_|\___/|_| |_|___/
+#
+##########################################################################
+#
+# Name:         conf-history.py
+# Company:      4N IT-Solutions GmbH
+#
+# Description:  Snapshots of dhcpd.conf / named.conf and history queries
+#
+# Requirements: Python version must be 3.8 or newer (i.e. Python 3.9 on Rocky Linux)
+#               The following non-default Python modules are required:
+#               nnnn_toolkit
+#
+# Known issues: -
+#
+##########################################################################
+
+# python doc
+"""
+Snapshots of dhcpd.conf / named.conf : each configuration is stored as delta to the previous snapshot,
+the history of an element (fixed address, MAC, subnet, zone, ...) is read from the deltas. Backups (e.g. of
+backup_daily) can be imported by specifying their directories in chronological order.
+
+Usage:
+conf-history.py [-S <store directory>] [-c <dhcpd.conf directory>] [-f <file name>] [-n <named.conf directory>]
+                [-q <key>] [-l] [-k dhcpd|named] [-d]
+
+   -S <directory>:      Directory with the snapshots, defaults to $QIPHOME/history or /opt/qip/current/history
+
+   -c <directory>:      Add a snapshot of dhcpd.conf in the directory, can be specified multiple times (oldest first),
+                        defaults to $QDHCPCONFIG or /opt/qip/current/dhcp if neither -n, -q nor -l is specified
+
+   -f <file name>:      Name of the dhcpd.conf file, e.g. dhcpd.conf.orig, defaults to dhcpd.conf
+
+   -n <directory>:      Add a snapshot of named.conf in the directory, can be specified multiple times (oldest first)
+
+   -q <key>:            Print the history of an element as JSON, e.g. "fixed-address 10.1.0.50", "mac 00:11:22:33:44:55",
+                        "subnet 10.1.0.0/24" or "zone <view> example.com"
+
+   -l:                  Print the list of snapshots as JSON (see -k)
+
+   -k <kind>:           Kind of snapshots to list / query : dhcpd or named, derived from the key for -q
+
+   -d:                  Enable debugging output
+
+The snapshot time is the modification time of dhcpd.conf / named.conf, the directory is stored as label.
+"""
+
+# required modules
+import os
+import json
+import argparse
+# required for binary build
+from sys import exit
+
+# 4N modules
+import nnnn_toolkit as toolkit
+
+# exit codes
+exit_code_error = 2
+
+# initialize logging
+logger = toolkit.Logger(console_logging = True)
+logger.set_level("INFO")
+
+arg_parser = argparse.ArgumentParser(description='4N Configuration History', allow_abbrev=False, add_help=True)
+arg_parser.add_argument('-S', '--store-dir', default=os.path.join(os.environ.get("QIPHOME", "/opt/qip/current"), "history"), help="Directory with the snapshots")
+arg_parser.add_argument('-c', '--conf-dir', action='append', help="Directory with dhcpd.conf to add")
+arg_parser.add_argument('-f', '--file-name', default="dhcpd.conf", help="Name of the dhcpd.conf file")
+arg_parser.add_argument('-n', '--named-conf-dir', action='append', help="Directory with named.conf to add")
+arg_parser.add_argument('-q', '--query', help="Key of the element to print the history of")
+arg_parser.add_argument('-l', '--list', action='store_true', help="List the snapshots")
+arg_parser.add_argument('-k', '--kind', choices=list(toolkit.ConfigSnapshots.kinds), help="Kind of snapshots")
+arg_parser.add_argument('-d', '--debug', action='store_true', help="Enable debugging")
+args = arg_parser.parse_args()
+
+if args.debug:
+   logger.set_level("DEBUG")
+
+conf_dirs = args.conf_dir or []
+if not conf_dirs and not args.named_conf_dir and not args.query and not args.list:
+   conf_dirs = [ os.environ.get("QDHCPCONFIG", "/opt/qip/current/dhcp") ]
+
+snapshots = toolkit.ConfigSnapshots(args.store_dir)
+
+# add snapshots
+for conf_dir in conf_dirs:
+   try:
+      dhcpd_conf = toolkit.DhcpdConf(conf_dir, file_name=args.file_name, pcy_file_name=None)
+      snapshot = snapshots.add(dhcpd_conf, timestamp=os.path.getmtime(os.path.join(conf_dir, args.file_name)), label=conf_dir)
+   except (OSError, SyntaxError) as error:
+      logger.error("Failed to add snapshot of {} in {} : {} - {}".format(args.file_name, conf_dir, type(error).__name__, error))
+      exit(exit_code_error)
+   logger.info("dhcpd.conf in {} is snapshot {}".format(conf_dir, snapshot))
+
+for named_conf_dir in args.named_conf_dir or []:
+   try:
+      named_conf = toolkit.NamedConf(named_conf_dir)
+      snapshot = snapshots.add(named_conf, timestamp=os.path.getmtime(os.path.join(named_conf_dir, "named.conf")), label=named_conf_dir)
+   except (OSError, SyntaxError, SystemError) as error:
+      logger.error("Failed to add snapshot of named.conf in {} : {} - {}".format(named_conf_dir, type(error).__name__, error))
+      exit(exit_code_error)
+   logger.info("named.conf in {} is snapshot {}".format(named_conf_dir, snapshot))
+
+# queries
+try:
+   if args.list:
+      print(json.dumps(snapshots.get_snapshots(args.kind or "dhcpd"), indent=3))
+   if args.query:
+      print(json.dumps(snapshots.history(args.query, kind=args.kind), indent=3))
+except (OSError, ValueError) as error:
+   logger.error("Failed to read snapshots in {} : {} - {}".format(args.store_dir, type(error).__name__, error))
+   exit(exit_code_error)
+
+exit(0)
@@ -38,7 +38,7 @@
 DHCP Probe to check DHCP responses from specific / all servers. Sends a DHCP package and displays the received response(s).
 
 Usage:
-dhcp-probe.py [-t <test>] [-m <MAC Address>] [-H <hostname>] [-b] [-v <vendor class>] [-u <user class>] [-f <fqdn>] [-F <fqdn flags>] [-c <client ID>|-C <hex client ID>] [-o <opcode=string value>] [-O <opcode=hex value>] [-p <parameter request list>] [-r <requested IP>] [-s <server IP>] [-R <relay IP>] [-a <accepted server IP>] [-A] [-P] [-i <interface name>] [-d]
+dhcp-probe.py [-t <test>] [-m <MAC Address>] [-H <hostname>] [-b] [-v <vendor class>] [-u <user class>] [-f <fqdn>] [-F <fqdn flags>] [-c <client ID>|-C <hex client ID>] [-o <opcode=string value>] [-O <opcode=hex value>] [-p <parameter request list>] [-r <requested IP>] [-s <server IP>|-S <server IP>] [-R <relay IP>] [-a <accepted server IP>] [-A] [-P] [-i <interface name>] [-n <clients>] [-l <rate>] [-X] [-D] [-w <seconds>] [-L] [-V] [-d]
 
    -t <test>:     determine the type of DHCP test that will be done, valid values are
                   discover-only (default): only send DISCOVER (broadcast) to see which DHCP Servers respond
@@ -47,6 +47,11 @@ dhcp-probe.py [-t <test>] [-m <MAC Address>] [-H <hostname>] [-b] [-v <vendor cl
                   release-only: only send RELEASE (unicast), requires "-r <requested IP>" and "-s <server>"
                   dora: go through DISCOVER/OFFER/REQUEST/ACK cycle (uses broadcasts)
                   full-cycle: go through DISCOVER/OFFER/REQUEST/ACK (broadcast), REQUEST (unicast), RELEASE (unicast) cycle
+                  load-test: simulate many clients going through DISCOVER/OFFER/REQUEST/ACK/RELEASE cycles, displays
+                             throughput and latency percentiles per message type, see "-n", "-l" and "-X"
+                  rogue-detect: send DISCOVER (broadcast) on every local interface (or "-i <interface name>" only),
+                                list all DHCP Servers responding within "-w <seconds>" and flag servers not accepted
+                                with "-a <accepted server IP>" as error, see "-L" for passive detection
 
    -m <MAC Address>:    MAC Address to use in format abcdef123456 (separators :, - or . are allowed), defaults to 4e:4e:4e:4e:00:00
 
@@ -82,7 +87,11 @@ dhcp-probe.py [-t <test>] [-m <MAC Address>] [-H <hostname>] [-b] [-v <vendor cl
 
    -s <server IP>:      Specify DHCP Server IP address to use for unicasts.
 
-   -R <relay IP>:       IP Address of the DHCP Relay to use as giaddr value (unicast), requires "-s <server IP>"
+   -S <server IP>:      Probe multiple DHCP Servers concurrently (discover-only). Can be repeated multiple times or be a
+                        comma separated list. A DHCPDISCOVER is unicasted to each server, results are displayed as they
+                        arrive. Each server is retried "dhcp_attempts" times with a timeout of "dhcp_timeout" each.
+
+   -R <relay IP>:       IP Address of the DHCP Relay to use as giaddr value (unicast), requires "-s <server IP>" or "-S <server IP>"
 
    -a <accepted server IP>: Specify a DHCP Server IP to accept a response from. Can be repeated multiple times. If 
                         other servers do respond their response will be ignored and will not be displayed. 
@@ -97,6 +106,30 @@ dhcp-probe.py [-t <test>] [-m <MAC Address>] [-H <hostname>] [-b] [-v <vendor cl
 
    -M:                  Automatically probe the local DHCP service.
 
+   -D:                  Daemon mode: probe the local DHCP service continuously every "probe_interval" seconds (implies -M).
+                        Uses DISCOVER/OFFER, for "-t dora" and "-t full-cycle" REQUEST/ACK/RELEASE as well. Results are
+                        written to "status_file" and are optionally served as JSON on the Unix socket "status_socket".
+                        Configuration and dhcpd.conf are only re-read if they change (or on SIGHUP).
+                        Response time histograms (p50/p95/p99), timeouts and NAKs per server and message type are kept in
+                        "stats_file" across restarts and are optionally written to "prometheus_file" in Prometheus text format.
+
+   -n <clients>:        Number of clients to simulate for "-t load-test", defaults to 1000. The MAC addresses used are
+                        "-m <MAC Address>" incremented by one for each client.
+
+   -l <rate>:           Number of DORA cycles to start per second for "-t load-test", defaults to 100.
+
+   -X:                  Start a fake DHCP Server on 127.0.0.1 (or "-s <server IP>") for "-t load-test", allows to test
+                        the load test without a real DHCP Server. Cannot be used with "-R <relay IP>".
+
+   -w <seconds>:        Time to listen for DHCP Server responses for "-t rogue-detect", defaults to 10 seconds.
+
+   -L:                  Passive mode for "-t rogue-detect": do not send DISCOVER, capture DHCP Server responses to any
+                        client on all interfaces (or "-i <interface name>" only) with a raw socket instead (requires root).
+
+   -V:                  Validate dhcpd.conf (e.g. before a push) instead of probing: reports overlapping subnets / ranges,
+                        ranges / fixed addresses outside their subnet, duplicate fixed IPs and MACs and orphaned client
+                        classes with line numbers. Exits with error code = 2 on errors and error code = 1 on warnings.
+
    -d:                  Enable debugging output. Specify multile times to get more details (max 3 times).
 """
 
@@ -105,11 +138,13 @@ import json
 import re
 import os
 import argparse
-#import time
+import time
 import socket
+import asyncio
+import struct
+import signal
 import ipaddress
 import random
-import psutil
 # required for binary build
 from sys import exit
 
@@ -123,13 +158,41 @@ exit_code_warning = 1
 exit_code_error = 2
 
 # helpers
-def setup_socket(ip_and_port, if_name, receive_timeout):
-   dhcp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+# not defined by the socket module (Linux value)
+SO_TIMESTAMPNS = getattr(socket, "SO_TIMESTAMPNS", 35)
+
+class TimestampingSocket(socket.socket):
+   """
+   UDP socket that keeps the kernel receive timestamp (SO_TIMESTAMPNS) of the last packet
+   received with `recvfrom` in `timestamp`, falls back to the current time if not available.
+   """
+   timestamp = None
+
+   def recvfrom(self, bufsize, flags=0):
+      (data, ancdata, msg_flags, sender) = self.recvmsg(bufsize, socket.CMSG_SPACE(16), flags)
+      self.timestamp = None
+      for (level, cmsg_type, cmsg_data) in ancdata:
+         if level == socket.SOL_SOCKET and cmsg_type == SO_TIMESTAMPNS and len(cmsg_data) >= 16:
+            (seconds, nanoseconds) = struct.unpack_from("@qq", cmsg_data)
+            self.timestamp = seconds + nanoseconds / 1000000000
+      if self.timestamp is None:
+         self.timestamp = time.time()
+      return (data, sender)
+
+def setup_socket(ip_and_port, if_name, receive_timeout, reuse_address=False):
+   dhcp_socket = TimestampingSocket(socket.AF_INET, socket.SOCK_DGRAM)
    dhcp_socket.settimeout(receive_timeout)
+
+   try:
+      dhcp_socket.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+   except OSError as e:
+      logger.debug("Kernel timestamps not available, using time of reception : {}".format(e))
    
    try:
-      if args.interface:
-         dhcp_socket.setsockopt(socket.SOL_SOCKET, 25, bytes(args.interface, 'ascii'))
+      if if_name:
+         dhcp_socket.setsockopt(socket.SOL_SOCKET, 25, bytes(if_name, 'ascii'))
+      if reuse_address:
+         dhcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
    except OSError as e:
       logger.error("Setting up socket on interface '{}' failed : {}".format(if_name, e))
       exit(exit_code_error)
@@ -165,16 +228,52 @@ def send_query(dhcp_socket, dhcp_packet, dhcp_server):
 
 def receive_response(dhcp_socket):
    try:
-      (response, sender) = dhcp_socket.recvfrom(receive_package_size)
-   except Exception as e:
-      if type(e).__name__ != "timeout":
-         logger.error("Error while waiting for DHCP Server response: {} - {}".format(type(e).__name__,e))
-         exit(exit_code_error)
+      (size, sender) = dhcp_socket.recvfrom_into(receive_buffer)
+   except socket.timeout:
       return None
-   dhcp_response = dhcppython.packet.DHCPPacket.from_bytes(response)
+   except Exception as e:
+      logger.error("Error while waiting for DHCP Server response: {} - {}".format(type(e).__name__,e))
+      exit(exit_code_error)
+   dhcp_response = DhcpResponse(bytes(receive_view[:size]))
    return dhcp_response
 
+class DhcpResponse():
+   """
+   A received DHCP packet that is decoded lazily. xid, message type and server id are read
+   directly from the received data, the complete packet is only decoded when accessing other fields.
+   """
+   __slots__ = ("data", "decoded_packet")
+
+   def __init__(self, data):
+      self.data = data
+      self.decoded_packet = None
+
+   @property
+   def xid(self):
+      return struct.unpack_from("!I", self.data, 4)[0]
+
+   @property
+   def yiaddr(self):
+      return ipaddress.IPv4Address(self.data[16:20])
+
+   @property
+   def packet(self):
+      if not self.decoded_packet:
+         self.decoded_packet = dhcppython.packet.DHCPPacket.from_bytes(self.data)
+      return self.decoded_packet
+
+   def __getattr__(self, name):
+      # any other field requires decoding the packet
+      return getattr(self.packet, name)
+
+   def __str__(self):
+      return str(self.packet)
+
 def print_dhcp_packet(dhcp_packet):
+   if not debug:
+      return
+   if isinstance(dhcp_packet, DhcpResponse):
+      dhcp_packet = dhcp_packet.packet
    header = {
       "hops": dhcp_packet.hops,
       "secs": dhcp_packet.secs,
@@ -182,7 +281,7 @@ def print_dhcp_packet(dhcp_packet):
       "ciAddr": dhcp_packet.ciaddr,
       "yiAddr": dhcp_packet.yiaddr,
       "siAddr": dhcp_packet.siaddr,
-      "giAddr": dhcp_packet.siaddr,
+      "giAddr": dhcp_packet.giaddr,
       "chAddr": dhcp_packet.chaddr,
       "sName": dhcp_packet.sname,
       "bootFile": dhcp_packet.file
@@ -194,53 +293,74 @@ def print_dhcp_packet(dhcp_packet):
    for option in dhcp_packet.options:
       logger.debug("  {}".format(option.value))
 
-def dhcp_type(dhcp_packet):
-   message_type_value = dhcp_packet.options.by_code(53)
-   value_to_type = {
-      b"\x01": "DHCPDISCOVER",
-      b"\x02": "DHCPOFFER",
-      b"\x03": "DHCPREQUEST",
-      b"\x04": "DHCPDECLINE",
-      b"\x05": "DHCPACK",
-      b"\x06": "DHCPNAK",
-      b"\x07": "DHCPRELEASE",
-      b"\x08": "DHCPINFORM"
-   }
-   return value_to_type[message_type_value.data]
+def dhcp_option(packet, code):
+   """
+   Get the raw value of an option from an encoded DHCP packet or `None` if not present.
+   """
+   position = DhcpTemplate.options_offset
+   while position < len(packet) - 1:
+      option_code = packet[position]
+      if option_code == 255:
+         break
+      if option_code == 0:
+         position += 1
+         continue
+      length = packet[position + 1]
+      if option_code == code:
+         return packet[position + 2:position + 2 + length]
+      position += 2 + length
+   return None
+
+dhcp_message_types = {
+   1: "DHCPDISCOVER",
+   2: "DHCPOFFER",
+   3: "DHCPREQUEST",
+   4: "DHCPDECLINE",
+   5: "DHCPACK",
+   6: "DHCPNAK",
+   7: "DHCPRELEASE",
+   8: "DHCPINFORM"
+}
 
-def dhcp_server_id(dhcp_packet):
-   server_id_value = dhcp_packet.options.by_code(54)
-   ip_address = ipaddress.IPv4Address(server_id_value.data)
+def dhcp_type(dhcp_response):
+   message_type_value = dhcp_option(dhcp_response.data, 53)
+   return dhcp_message_types[message_type_value[0]]
+
+def dhcp_server_id(dhcp_response):
+   server_id_value = dhcp_option(dhcp_response.data, 54)
+   if server_id_value is None:
+      return None
+   ip_address = ipaddress.IPv4Address(server_id_value)
    return ip_address
 
 def add_ip(if_name, ip):
-   cmd = "ip address add {}/32 dev {}".format(ip, if_name)
    logger.debug("Adding IP {} to interface {}".format(ip, if_name))
-   (error, stdout, stderr) = toolkit.run_command(cmd)
-   if error:
-      raise OSError("Failed to add IP {} to {} using '{}' : {}".format(ip, if_name, cmd, stderr))
+   try:
+      with toolkit.Netlink() as netlink:
+         netlink.add_address(if_name, ip, 32)
+   except OSError as e:
+      raise OSError("Failed to add IP {} to {} : {}".format(ip, if_name, e))
    return ip
 
 def delete_ip(if_name, ip):
-   cmd = "ip address delete {}/32 dev {}".format(ip, if_name)
    logger.debug("Removing IP {} from interface {}".format(ip, if_name))
-   (error, stdout, stderr) = toolkit.run_command(cmd)
-   if error:
-      raise OSError("Failed to delete IP {} from {} using '{}' : {}".format(ip, if_name, cmd, stderr))
+   try:
+      with toolkit.Netlink() as netlink:
+         netlink.delete_address(if_name, ip, 32)
+   except OSError as e:
+      raise OSError("Failed to delete IP {} from {} : {}".format(ip, if_name, e))
 
 def get_ipv4_networks():
    localnets = {}
-   network_config = psutil.net_if_addrs()
-   for interface in network_config:
-      for snic in network_config[interface]:
-         if snic.family != socket.AF_INET:
-            continue
-         if snic.address == "127.0.0.1":
+   with toolkit.Netlink() as netlink:
+      addresses = netlink.get_addresses(socket.AF_INET)
+   for interface in addresses:
+      for address in addresses[interface]:
+         if str(address.ip) == "127.0.0.1":
             continue
-         network = ipaddress.IPv4Network("{}/{}".format(snic.address,snic.netmask), strict=False)
          if interface not in localnets:
             localnets[interface] = []
-         localnets[interface].append(network)
+         localnets[interface].append(address.network)
    return localnets
 
 def check_accepted_server(ip, accepted_servers):
@@ -252,32 +372,939 @@ def check_accepted_server(ip, accepted_servers):
    else:
       return True
 
-# defaults for configuration file settings
-config = {
+class DhcpTransaction():
+   """
+   A DHCP request waiting for responses, see `DhcpProtocol.transact`.
+   """
+   def __init__(self, xid, server, expected_types, collect=False):
+      self.xid = xid
+      self.server = server
+      self.expected_types = expected_types
+      self.collect = collect
+      self.attempt = 0
+      self.sent = None
+      self.responses = []
+      self.done = asyncio.Event()
+
+   def add_response(self, data, sender, received):
+      try:
+         dhcp_response = DhcpResponse(data)
+         message_type = dhcp_type(dhcp_response)
+         # misconfigured / rogue servers might not send a server identifier
+         server_id = dhcp_server_id(dhcp_response) or ipaddress.IPv4Address(sender[0])
+      except Exception as e:
+         logger.warn("Ignoring malformed response from {}: {} - {}".format(sender, type(e).__name__, e))
+         return
+      if message_type not in self.expected_types:
+         logger.debug("Ignoring response ({}) from {} for xid {}".format(message_type, server_id, self.xid))
+         return
+      self.responses.append({
+         "packet": dhcp_response,
+         "sender": sender,
+         "message_type": message_type,
+         "server_id": server_id,
+         "attempt": self.attempt,
+         "latency": received - self.sent
+      })
+      # a single response completes the transaction unless collecting responses from multiple servers
+      if not self.collect:
+         self.done.set()
+
+class DhcpProtocol(asyncio.DatagramProtocol):
+   """
+   Multiplexes many outstanding DHCP transactions on a single socket, responses are matched by xid.
+
+   If the socket is a `TimestampingSocket` latencies are based on the kernel receive timestamps,
+   completed transactions are recorded in `statistics` (`ProbeStatistics`) if given.
+   """
+   def __init__(self, dhcp_socket=None, statistics=None):
+      self.socket = dhcp_socket
+      self.statistics = statistics
+      self.transport = None
+      self.transactions = {}
+
+   def connection_made(self, transport):
+      self.transport = transport
+
+   def datagram_received(self, data, sender):
+      # xid is located at offset 4 of any BOOTP packet
+      if len(data) < 8:
+         return
+      (xid,) = struct.unpack_from("!I", data, 4)
+      transaction = self.transactions.get(xid)
+      if not transaction:
+         logger.debug("Ignoring response from {} for unknown xid {}".format(sender, xid))
+         return
+      received = getattr(self.socket, "timestamp", None) or time.time()
+      transaction.add_response(data, sender, received)
+
+   def error_received(self, error):
+      logger.warn("Error while waiting for DHCP Server responses: {} - {}".format(type(error).__name__, error))
+
+   def new_xid(self):
+      xid = random.getrandbits(32)
+      while xid in self.transactions:
+         xid = random.getrandbits(32)
+      return xid
+
+   async def transact(self, packet, server, expected_types, timeout, attempts, collect=False):
+      """
+      Send a DHCP packet and wait for the response(s), re-sending it if no response is received.
+
+      Parameters
+      ----------
+      packet : bytes
+         The packet to send, the xid is read from the packet.
+      server : tuple
+         IP and port to send the packet to.
+      expected_types : set
+         The DHCP message types that are accepted as response, e.g. {"DHCPACK", "DHCPNAK"}.
+      timeout : float
+         Time to wait for a response per attempt.
+      attempts : int
+         Number of times the packet is sent at most.
+      collect : boolean, optional
+         Collect responses from multiple servers until the timeout expires (broadcasts).
+
+      Returns
+      -------
+      DhcpTransaction
+         The transaction, `responses` is empty if no response has been received.
+      """
+      (xid,) = struct.unpack_from("!I", packet, 4)
+      transaction = DhcpTransaction(xid, server, expected_types, collect)
+      self.transactions[xid] = transaction
+      try:
+         for attempt in range(1, attempts + 1):
+            transaction.attempt = attempt
+            transaction.sent = time.time()
+            self.transport.sendto(packet, server)
+            try:
+               await asyncio.wait_for(transaction.done.wait(), timeout)
+            except asyncio.TimeoutError:
+               pass
+            if transaction.responses:
+               break
+            logger.debug("No response from {} for xid {} (attempt {} of {})".format(server[0], xid, attempt, attempts))
+      finally:
+         del self.transactions[xid]
+      if self.statistics is not None:
+         self.statistics.record(transaction, dhcp_message_types.get(dhcp_option(packet, 53)[0]))
+      return transaction
+
+class ProbeStatistics():
+   """
+   Response time histograms (`toolkit.LatencyHistogram`) and request, response, timeout and NAK
+   counters per server and message type sent. Timeouts are accounted to the server the request was
+   sent to, responses to the server identifier of the response.
+   """
+   quantiles = (50, 95, 99)
+
+   def __init__(self):
+      self.servers = {}
+
+   def entry(self, server, message_type):
+      server_stats = self.servers.setdefault(str(server), {})
+      if message_type not in server_stats:
+         server_stats[message_type] = { "requests": 0, "responses": 0, "timeouts": 0, "naks": 0, "latency": toolkit.LatencyHistogram() }
+      return server_stats[message_type]
+
+   def record(self, transaction, message_type):
+      if not transaction.responses:
+         message_stats = self.entry(transaction.server[0], message_type)
+         message_stats["requests"] += 1
+         message_stats["timeouts"] += 1
+         return
+      for response in transaction.responses:
+         message_stats = self.entry(response["server_id"], message_type)
+         message_stats["requests"] += 1
+         message_stats["responses"] += 1
+         message_stats["latency"].record(response["latency"])
+         if response["message_type"] == "DHCPNAK":
+            message_stats["naks"] += 1
+
+   def to_dict(self):
+      """
+      Get counters, percentiles (in seconds) and the histograms per server and message type.
+      """
+      result = {}
+      for (server, server_stats) in sorted(self.servers.items()):
+         result[server] = {}
+         for (message_type, message_stats) in sorted(server_stats.items()):
+            histogram = message_stats["latency"]
+            latency = { "p{}".format(quantile): histogram.percentile(quantile) for quantile in self.quantiles }
+            latency["max"] = histogram.max
+            latency["histogram"] = histogram.to_dict()
+            result[server][message_type] = dict(message_stats, latency=latency)
+      return result
+
+   def load(self, file_name):
+      """
+      Add the statistics saved to `file_name` by `save`, a missing file is ignored.
+      """
+      try:
+         with open(file_name) as stats_fh:
+            servers = json.load(stats_fh)["servers"]
+      except FileNotFoundError:
+         return
+      for (server, server_stats) in servers.items():
+         for (message_type, saved_stats) in server_stats.items():
+            message_stats = self.entry(server, message_type)
+            for counter in ("requests", "responses", "timeouts", "naks"):
+               message_stats[counter] += saved_stats[counter]
+            message_stats["latency"].merge(toolkit.LatencyHistogram.from_dict(saved_stats["latency"]["histogram"]))
+
+   def save(self, file_name):
+      # replace file so readers never see a partially written file
+      with open(file_name + ".tmp", "w") as stats_fh:
+         stats_fh.write(toolkit.to_json({ "updated": time.strftime("%Y-%m-%d %H:%M:%S"), "servers": self.to_dict() }))
+      os.replace(file_name + ".tmp", file_name)
+
+   def to_prometheus(self):
+      """
+      Get the statistics in Prometheus text exposition format.
+      """
+      metrics = {
+         "dhcp_probe_response_seconds": ("summary", "Response time of DHCP servers", []),
+         "dhcp_probe_requests_total": ("counter", "DHCP requests sent (not counting retries)", []),
+         "dhcp_probe_timeouts_total": ("counter", "DHCP requests without response", []),
+         "dhcp_probe_naks_total": ("counter", "DHCP requests answered with DHCPNAK", [])
+      }
+      for (server, server_stats) in sorted(self.servers.items()):
+         for (message_type, message_stats) in sorted(server_stats.items()):
+            labels = 'server="{}",type="{}"'.format(server, message_type)
+            histogram = message_stats["latency"]
+            lines = metrics["dhcp_probe_response_seconds"][2]
+            for quantile in self.quantiles:
+               value = histogram.percentile(quantile)
+               lines.append('dhcp_probe_response_seconds{{{},quantile="{}"}} {}'.format(labels, quantile / 100, "NaN" if value is None else value))
+            lines.append("dhcp_probe_response_seconds_sum{{{}}} {}".format(labels, histogram.sum))
+            lines.append("dhcp_probe_response_seconds_count{{{}}} {}".format(labels, histogram.count))
+            for counter in ("requests", "timeouts", "naks"):
+               metrics["dhcp_probe_{}_total".format(counter)][2].append("dhcp_probe_{}_total{{{}}} {}".format(counter, labels, message_stats[counter]))
+      text = ""
+      for (name, (metric_type, description, lines)) in metrics.items():
+         text += "# HELP {} {}\n# TYPE {} {}\n".format(name, description, name, metric_type)
+         text += "".join(line + "\n" for line in lines)
+      return text
+
+   def export(self):
+      """
+      Write the statistics to the configured stats / Prometheus files (if configured).
+      """
+      file_name = config["stats_file"]
+      try:
+         if file_name:
+            self.save(file_name)
+         file_name = config["prometheus_file"]
+         if file_name:
+            with open(file_name + ".tmp", "w") as prometheus_fh:
+               prometheus_fh.write(self.to_prometheus())
+            os.replace(file_name + ".tmp", file_name)
+      except OSError as error:
+         logger.error("Failed to write statistics to {} : {} - {}".format(file_name, type(error).__name__, error))
+
+   def log_report(self):
+      for (server, server_stats) in sorted(self.servers.items()):
+         for (message_type, message_stats) in sorted(server_stats.items()):
+            line = "{} {:<12} : requests {}, responses {}, timeouts {}, NAKs {}".format(server, message_type, message_stats["requests"], message_stats["responses"], message_stats["timeouts"], message_stats["naks"])
+            histogram = message_stats["latency"]
+            if histogram.count:
+               line += ", latency (ms) p50 {:.2f} p95 {:.2f} p99 {:.2f} max {:.2f}".format(histogram.percentile(50) * 1000, histogram.percentile(95) * 1000, histogram.percentile(99) * 1000, histogram.max * 1000)
+            logger.info(line)
+
+async def probe_servers(dhcp_socket, servers, dhcp_discover, timeout, attempts, statistics=None):
+   """
+   Send a DHCPDISCOVER to all servers concurrently and report the results as they arrive,
+   responses / timeouts are recorded in `statistics` if given.
+
+   Returns
+   -------
+   int
+      The number of servers that did not respond.
+   """
+   loop = asyncio.get_running_loop()
+   (transport, protocol) = await loop.create_datagram_endpoint(lambda: DhcpProtocol(dhcp_socket, statistics), sock=dhcp_socket)
+   template = DhcpTemplate(dhcp_discover)
+   mac = template.template[DhcpTemplate.chaddr_offset:DhcpTemplate.chaddr_offset + 6]
+
+   async def probe_server(server):
+      xid = protocol.new_xid()
+      packet = template.build(xid, mac)
+      logger.debug("Sending DHCPDISCOVER to {} (xid {})".format(server, xid))
+      return await protocol.transact(packet, server, {"DHCPOFFER"}, timeout, attempts)
+
+   error_cnt = 0
+   try:
+      for next_result in asyncio.as_completed([ probe_server((str(server), 67)) for server in servers ]):
+         transaction = await next_result
+         server = transaction.server[0]
+         if not transaction.responses:
+            logger.error("Did not receive any response from {}".format(server))
+            error_cnt += 1
+            continue
+         for response in transaction.responses:
+            if not check_accepted_server(response["server_id"], accepted_servers):
+               logger.warn("Ignoring response ({}) from {}".format(response["message_type"], response["server_id"]))
+               continue
+            logger.info("Received DHCPOFFER for IP {} from {} ({:.1f} ms, attempt {})".format(response["packet"].yiaddr, server, response["latency"] * 1000, response["attempt"]))
+            print_dhcp_packet(response["packet"])
+   finally:
+      transport.close()
+   return error_cnt
+
+ETH_P_IP = 0x0800
+
+def parse_dhcp_reply(ip_packet):
+   """
+   Get the source IP and the DHCP packet of an IPv4 packet if it is a DHCP server response
+   (BOOTREPLY from UDP port 67), `None` otherwise.
+   """
+   if len(ip_packet) < 20 or ip_packet[0] >> 4 != 4 or ip_packet[9] != 17:
+      return None
+   header_length = (ip_packet[0] & 0x0f) * 4
+   if len(ip_packet) < header_length + 8 + DhcpTemplate.options_offset:
+      return None
+   (source_port, destination_port) = struct.unpack_from("!HH", ip_packet, header_length)
+   dhcp_packet = ip_packet[header_length + 8:]
+   if source_port != 67 or destination_port not in (67, 68) or dhcp_packet[0] != 2:
+      return None
+   return (ipaddress.IPv4Address(ip_packet[12:16]), dhcp_packet)
+
+async def detect_servers(interfaces, dhcp_discover, window, passive=False):
+   """
+   Find all DHCP Servers on the local segments : send a DHCPDISCOVER (broadcast) on each interface and
+   collect the responses of all servers for `window` seconds. In passive mode no DHCPDISCOVER is sent,
+   instead all DHCP server responses seen on the interfaces (or all interfaces if empty) are captured
+   with a raw socket (requires root).
+
+   Returns
+   -------
+   dict
+      Per server ID (or source IP if the server did not send an ID) : interfaces, message types,
+      source IPs / MACs and the number of responses seen.
+   """
+   loop = asyncio.get_running_loop()
+   servers = {}
+
+   def add_server(server_id, if_name, message_type, source, mac=None):
+      server = servers.setdefault(str(server_id), { "interfaces": set(), "message_types": set(), "sources": set(), "macs": set(), "responses": 0 })
+      server["interfaces"].add(if_name)
+      server["message_types"].add(message_type)
+      server["sources"].add(str(source))
+      if mac:
+         server["macs"].add(mac.hex(":"))
+      server["responses"] += 1
+
+   if passive:
+      capture_socket = socket.socket(socket.AF_PACKET, socket.SOCK_DGRAM, socket.htons(ETH_P_IP))
+      capture_socket.setblocking(False)
+      if len(interfaces) == 1:
+         capture_socket.bind((interfaces[0], ETH_P_IP))
+
+      def capture():
+         while True:
+            try:
+               (ip_packet, (if_name, protocol, packet_type, hardware_type, mac)) = capture_socket.recvfrom(65535)
+            except BlockingIOError:
+               return
+            if interfaces and if_name not in interfaces:
+               continue
+            reply = parse_dhcp_reply(ip_packet)
+            if not reply:
+               continue
+            (source, dhcp_packet) = reply
+            try:
+               dhcp_response = DhcpResponse(dhcp_packet)
+               message_type = dhcp_type(dhcp_response)
+               server_id = dhcp_server_id(dhcp_response) or source
+            except Exception as e:
+               logger.debug("Ignoring malformed DHCP packet from {} on {}: {} - {}".format(source, if_name, type(e).__name__, e))
+               continue
+            logger.debug("Captured {} from {} ({}) on {}".format(message_type, server_id, mac.hex(":"), if_name))
+            add_server(server_id, if_name, message_type, source, mac)
+
+      loop.add_reader(capture_socket.fileno(), capture)
+      try:
+         await asyncio.sleep(window)
+      finally:
+         loop.remove_reader(capture_socket.fileno())
+         capture_socket.close()
+      return servers
+
+   template = DhcpTemplate(dhcp_discover)
+   mac = template.template[DhcpTemplate.chaddr_offset:DhcpTemplate.chaddr_offset + 6]
+
+   async def discover(if_name):
+      dhcp_socket = setup_socket(("0.0.0.0", 68), if_name, None, reuse_address=True)
+      (transport, protocol) = await loop.create_datagram_endpoint(lambda: DhcpProtocol(dhcp_socket), sock=dhcp_socket)
+      try:
+         xid = protocol.new_xid()
+         logger.debug("Sending DHCPDISCOVER on {} (xid {})".format(if_name, xid))
+         transaction = await protocol.transact(template.build(xid, mac), ("255.255.255.255", 67), {"DHCPOFFER", "DHCPACK", "DHCPNAK"}, window, 1, collect=True)
+      finally:
+         transport.close()
+      for response in transaction.responses:
+         logger.debug("Received {} from {} on {}".format(response["message_type"], response["server_id"], if_name))
+         add_server(response["server_id"], if_name, response["message_type"], response["sender"][0])
+
+   await asyncio.gather(*[ discover(if_name) for if_name in interfaces ])
+   return servers
+
+def report_servers(servers, accepted_servers):
+   """
+   Log all DHCP Servers found by `detect_servers` and flag servers not in `accepted_servers`.
+
+   Returns
+   -------
+   int
+      The number of unexpected servers.
+   """
+   unexpected = 0
+   for (server_id, server) in sorted(servers.items()):
+      details = "on {} ({} responses: {}, source {}{})".format(", ".join(sorted(server["interfaces"])), server["responses"], ", ".join(sorted(server["message_types"])), ", ".join(sorted(server["sources"])), ", MAC " + ", ".join(sorted(server["macs"])) if server["macs"] else "")
+      if check_accepted_server(ipaddress.IPv4Address(server_id), accepted_servers):
+         logger.info("Found DHCP Server {} {}".format(server_id, details))
+      else:
+         logger.error("Found unexpected DHCP Server {} {}".format(server_id, details))
+         unexpected += 1
+   for accepted_server in accepted_servers:
+      if str(accepted_server) not in servers:
+         logger.warn("Accepted DHCP Server {} did not respond".format(accepted_server))
+   return unexpected
+
+class DhcpTemplate():
+   """
+   Pre-encoded DHCP packet, only xid, MAC and addresses are patched in for each client.
+   Options that need to be patched must be present in the template with a value of the correct length.
+   """
+   xid_offset = 4
+   ciaddr_offset = 12
+   chaddr_offset = 28
+   options_offset = 240
+
+   def __init__(self, dhcp_packet):
+      self.template = bytes(dhcp_packet.asbytes)
+      # offsets of option values
+      self.option_offsets = {}
+      position = self.options_offset
+      while position < len(self.template) and self.template[position] != 255:
+         if self.template[position] == 0:
+            position += 1
+            continue
+         self.option_offsets[self.template[position]] = position + 2
+         position += 2 + self.template[position + 1]
+
+   def build(self, xid, mac, ciaddr=None, options=None):
+      """
+      Build a packet from the template.
+
+      Parameters
+      ----------
+      xid : int
+         The transaction ID.
+      mac : bytes
+         The client's MAC address (6 bytes).
+      ciaddr : int, optional
+         The client IP address.
+      options : dict, optional
+         Option values (bytes) to patch in by option code.
+
+      Returns
+      -------
+      bytearray
+         A copy of the template with the values patched in at their fixed offsets.
+      """
+      packet = bytearray(self.template)
+      struct.pack_into("!I", packet, self.xid_offset, xid)
+      struct.pack_into("6s", packet, self.chaddr_offset, mac)
+      if ciaddr:
+         struct.pack_into("!I", packet, self.ciaddr_offset, ciaddr)
+      if options:
+         for code in options:
+            struct.pack_into("{}s".format(len(options[code])), packet, self.option_offsets[code], options[code])
+      return packet
+
+class FakeDhcpServer(asyncio.DatagramProtocol):
+   """
+   Minimal DHCP Server to test the load test : offers and acknowledges addresses from 10.0.0.0/8
+   and replies directly to the sender of a request.
+   """
+   message_types = { 1: 2, 3: 5 }   # DHCPDISCOVER -> DHCPOFFER, DHCPREQUEST -> DHCPACK
+
+   def __init__(self, server_ip):
+      self.server_id = ipaddress.IPv4Address(server_ip).packed
+      self.leases = {}
+      self.next_ip = int(ipaddress.IPv4Address("10.0.0.1"))
+
+   def connection_made(self, transport):
+      self.transport = transport
+
+   def datagram_received(self, data, sender):
+      message_type = dhcp_option(data, 53)
+      if not message_type:
+         return
+      mac = bytes(data[28:34])
+      # DHCPRELEASE
+      if message_type[0] == 7:
+         self.leases.pop(mac, None)
+         return
+      if message_type[0] not in self.message_types:
+         return
+      if mac not in self.leases:
+         self.leases[mac] = self.next_ip.to_bytes(4, "big")
+         self.next_ip += 1
+      response = bytearray(data[:240])
+      response[0] = 2   # BOOTREPLY
+      response[16:20] = self.leases[mac]
+      response += bytes([53, 1, self.message_types[message_type[0]], 54, 4]) + self.server_id
+      response += bytes([51, 4]) + (3600).to_bytes(4, "big") + bytes([255])
+      self.transport.sendto(response, sender)
+
+async def load_test(dhcp_socket, dhcp_server, templates, base_mac, clients, rate, timeout, attempts, fake_server=False, statistics=None):
+   """
+   Run DHCPDISCOVER/OFFER/REQUEST/ACK/RELEASE cycles for many clients, starting `rate` cycles per second.
+   Responses / timeouts per server are recorded in `statistics` if given.
+
+   Returns
+   -------
+   dict
+      Statistics per message type sent (number sent, responses, timeouts, NAKs, latency histogram) and
+      overall results.
+   """
+   loop = asyncio.get_running_loop()
+   if fake_server:
+      (server_transport, server) = await loop.create_datagram_endpoint(lambda: FakeDhcpServer(dhcp_server[0]), local_addr=dhcp_server)
+   (transport, protocol) = await loop.create_datagram_endpoint(lambda: DhcpProtocol(dhcp_socket, statistics), sock=dhcp_socket)
+
+   stats = {}
+   for message_type in ("DHCPDISCOVER", "DHCPREQUEST", "DHCPRELEASE"):
+      stats[message_type] = { "sent": 0, "responses": 0, "timeouts": 0, "naks": 0, "latency": toolkit.LatencyHistogram() }
+
+   def count(message_type, transaction):
+      stats[message_type]["sent"] += transaction.attempt
+      if not transaction.responses:
+         stats[message_type]["timeouts"] += 1
+         return None
+      response = transaction.responses[0]
+      stats[message_type]["responses"] += 1
+      stats[message_type]["latency"].record(response["latency"])
+      if response["message_type"] == "DHCPNAK":
+         stats[message_type]["naks"] += 1
+         return None
+      return response
+
+   async def run_client(index):
+      mac = (base_mac + index).to_bytes(6, "big")
+
+      # DISCOVER / OFFER
+      xid = protocol.new_xid()
+      packet = templates["DHCPDISCOVER"].build(xid, mac)
+      offer = count("DHCPDISCOVER", await protocol.transact(packet, dhcp_server, {"DHCPOFFER"}, timeout, attempts))
+      if not offer:
+         return False
+      server_id = dhcp_option(offer["packet"].data, 54)
+
+      # REQUEST / ACK
+      packet = templates["DHCPREQUEST"].build(xid, mac, options={ 50: offer["packet"].data[16:20], 54: server_id })
+      ack = count("DHCPREQUEST", await protocol.transact(packet, dhcp_server, {"DHCPACK", "DHCPNAK"}, timeout, attempts))
+      if not ack:
+         return False
+
+      # RELEASE (no response)
+      packet = templates["DHCPRELEASE"].build(protocol.new_xid(), mac, ciaddr=struct.unpack_from("!I", ack["packet"].data, 16)[0], options={ 54: server_id })
+      protocol.transport.sendto(packet, (str(offer["server_id"]), 67))
+      stats["DHCPRELEASE"]["sent"] += 1
+      return True
+
+   # start clients at the requested rate
+   tasks = []
+   start = time.monotonic()
+   try:
+      for index in range(clients):
+         delay = start + index / rate - time.monotonic()
+         if delay > 0:
+            await asyncio.sleep(delay)
+         tasks.append(asyncio.create_task(run_client(index)))
+      results = await asyncio.gather(*tasks)
+   finally:
+      transport.close()
+      if fake_server:
+         server_transport.close()
+
+   stats["elapsed"] = time.monotonic() - start
+   stats["completed"] = results.count(True)
+   stats["failed"] = results.count(False)
+   return stats
+
+def print_load_test_results(stats, clients):
+   logger.info("Completed {} of {} DORA cycles in {:.2f} seconds ({:.1f} leases per second)".format(stats["completed"], clients, stats["elapsed"], stats["completed"] / stats["elapsed"]))
+   for message_type in ("DHCPDISCOVER", "DHCPREQUEST", "DHCPRELEASE"):
+      message_stats = stats[message_type]
+      line = "{:<12} : sent {}, responses {}, timeouts {}, NAKs {}".format(message_type, message_stats["sent"], message_stats["responses"], message_stats["timeouts"], message_stats["naks"])
+      histogram = message_stats["latency"]
+      if histogram.count:
+         line += ", latency (ms) p50 {:.2f} p95 {:.2f} p99 {:.2f} max {:.2f}".format(histogram.percentile(50) * 1000, histogram.percentile(95) * 1000, histogram.percentile(99) * 1000, histogram.max * 1000)
+      logger.info(line)
+
+def build_templates(mac_address, relay_ip, options):
+   """
+   Pre-build DHCPDISCOVER, DHCPREQUEST and DHCPRELEASE packets, see `DhcpTemplate`.
+   """
+   templates = {}
+   template_options = dhcppython.options.OptionList(list(options))
+   templates["DHCPDISCOVER"] = DhcpTemplate(dhcppython.packet.DHCPPacket.Discover(mac_addr = mac_address, use_broadcast = args.broadcast, relay = relay_ip, option_list = template_options))
+   template_options = dhcppython.options.OptionList(list(options))
+   template_options.append(dhcppython.options.options.short_value_to_object(50, "0.0.0.0"))
+   template_options.append(dhcppython.options.options.short_value_to_object(54, "0.0.0.0"))
+   templates["DHCPREQUEST"] = DhcpTemplate(dhcppython.packet.DHCPPacket.Request(mac_addr = mac_address, use_broadcast = args.broadcast, relay = relay_ip, tx_id = 0, seconds = 0, option_list = template_options))
+   template_options = dhcppython.options.OptionList(list(options))
+   template_options.insert(0, dhcppython.options.options.short_value_to_object(53, "DHCPRELEASE"))
+   template_options.append(dhcppython.options.options.short_value_to_object(54, "0.0.0.0"))
+   templates["DHCPRELEASE"] = DhcpTemplate(dhcppython.packet.DHCPPacket(op="BOOTREQUEST", htype="ETHERNET", hlen=6, hops=0, xid=0, secs=0, flags=0, ciaddr=ipaddress.IPv4Address(0), yiaddr=ipaddress.IPv4Address(0), siaddr=ipaddress.IPv4Address(0), giaddr=ipaddress.IPv4Address(relay_ip or 0), chaddr=mac_address, sname=b'', file=b'', options=template_options))
+   return templates
+
+def build_option_list():
+   """
+   Build the list of options to send based on the command line args.
+   """
+   options = dhcppython.options.OptionList()
+
+   # simple options
+   options.append(dhcppython.options.options.short_value_to_object(12, args.hostname))
+   if args.vendor_class:
+      options.append(dhcppython.options.options.short_value_to_object(60, args.vendor_class))
+   if args.user_class:
+      byte_value = bytes(args.user_class, encoding="utf-8")
+      options.append(dhcppython.options.UnknownOption(77, len(byte_value), byte_value))
+   if args.client_id:
+      options.append(dhcppython.options.options.short_value_to_object(61, args.client_id))
+
+   # other options
+   if args.parameter_request_list:
+      requested_options = ""
+      for option in args.parameter_request_list.split(","):
+         requested_options += "{:02x}".format(int(option))
+      options.append(dhcppython.options.options.short_value_to_object(55, bytes.fromhex(requested_options)))
+
+   # regular options
+   for op_code in option_list:
+      value = option_list[op_code]
+      byte_value = bytes(value, encoding="utf-8")
+      options.append(dhcppython.options.UnknownOption(int(op_code), len(byte_value), byte_value))
+
+   # hex options
+   for op_code in option_list_hex:
+      value = option_list_hex[op_code]
+      byte_value = bytes.fromhex(value)
+      options.append(dhcppython.options.UnknownOption(int(op_code), len(byte_value), byte_value))
+
+   return options
+
+def find_probe_address(dhcpd_conf):
+   """
+   Determine the relay IP and MAC address to use for probing the local DHCP Server. Requires an
+   M-DHCP with MAC 4e:4e:4e:4e:xx:xx in a locally attached subnet and ListenOnLoopback=1.
+
+   Returns
+   -------
+   relay_ip : str
+      The IP address of the M-DHCP, used as giaddr.
+   mac_address : str
+      The MAC address of the M-DHCP.
+
+   Raises
+   ------
+   ValueError
+      If the configuration does not allow to probe the local DHCP Server.
+   """
+   # make sure ListenOnLoopback=1
+   dhcpd_pcy = dhcpd_conf.get_pcy()
+   listen_on_loopback = False
+   for policy in dhcpd_pcy["policies"]:
+      if re.search("ListenOnLoopback", policy["policy_name"], re.IGNORECASE):
+         if policy["policy_value"] == "1":
+            listen_on_loopback = True
+         break
+   if not listen_on_loopback:
+      raise ValueError("Need policy ListenOnLoopback=1 in dhcpd.pcy / Additional Policies")
+
+   # get locally attached IPv4 subnets to check if they exist in the configuration
+   localnets = []
+   interface_nets = get_ipv4_networks()
+   for interface in interface_nets:
+      for localnet in interface_nets[interface]:
+         localnets.append(localnet)
+
+   # determine IP / MAC adddress to use (requires M-DHCP to be configured in local subnet)
+   candidates = []
+   for subnet in dhcpd_conf.get_subnets():
+      for dhcp_range in dhcpd_conf.get_ranges(subnet):
+         if dhcp_range["range_type"] == "manual-dhcp":
+            try:
+               mac = toolkit.HardwareKey.parse(dhcp_range["mac"])
+            except ValueError:
+               continue
+            if mac.is_mac() and mac.startswith(b"\x4e\x4e\x4e\x4e"):
+               candidates.append((dhcp_range["ip"], mac.format(":")))
+   if candidates and localnets:
+      # first M-DHCP address within a local subnet
+      local_index = toolkit.AddressIndex(localnets)
+      for (candidate, position) in zip(candidates, local_index.find_many([ ip for (ip, mac) in candidates ])):
+         if position >= 0:
+            return candidate
+   raise ValueError("Need M-DHCP with MAC 4e:4e:4e:4e:xx:xx in a local subnet: {}".format(localnets))
+
+class ProbeDaemon():
+   """
+   Continuously probe the local DHCP Server, see "-D".
+
+   Configuration, dhcpd.conf, the socket and the temporary relay IP are kept between probes and
+   are only re-read / re-created if they change. Results are written to the status file and are
+   optionally served on a Unix socket.
+   """
+   def __init__(self, options):
+      self.options = options
+      self.dhcpd_conf_mtimes = None
+      self.reload_requested = False
+      self.relay_ip = None
+      self.mac_address = None
+      self.templates = None
+      self.tmp_ip = None
+      self.transport = None
+      self.protocol = None
+      self.statistics = ProbeStatistics()
+      self.status = {
+         "started": time.strftime("%Y-%m-%d %H:%M:%S"),
+         "probes": 0,
+         "failures": 0,
+         "last_success": None,
+         "last_probe": None
+      }
+
+   async def reload(self):
+      """
+      Re-read configuration and dhcpd.conf if changed, re-bind the socket if the relay IP changed.
+      """
+      global config
+      config = load_config()
+
+      mtimes = []
+      for file_name in ("dhcpd.conf", "dhcpd.pcy"):
+         try:
+            mtimes.append(os.stat(os.path.join(config["dhcpd_conf_dir"], file_name)).st_mtime_ns)
+         except FileNotFoundError:
+            mtimes.append(None)
+      if mtimes == self.dhcpd_conf_mtimes and not self.reload_requested:
+         return
+
+      logger.info("Reading dhcpd.conf")
+      dhcpd_conf = toolkit.DhcpdConf(config["dhcpd_conf_dir"])
+      (relay_ip, mac_address) = find_probe_address(dhcpd_conf)
+      logger.debug("Using Relay IP {} and MAC {} for DHCP Probe".format(relay_ip, mac_address))
+      if relay_ip != self.relay_ip:
+         await self.bind(relay_ip)
+      self.mac_address = mac_address
+      self.templates = build_templates(mac_address, relay_ip, self.options)
+      self.dhcpd_conf_mtimes = mtimes
+      self.reload_requested = False
+
+   async def bind(self, relay_ip):
+      self.unbind()
+      self.tmp_ip = add_ip(args.interface, relay_ip)
+      dhcp_socket = setup_socket((relay_ip, 67), args.interface, None)
+      (self.transport, self.protocol) = await asyncio.get_running_loop().create_datagram_endpoint(lambda: DhcpProtocol(dhcp_socket, self.statistics), sock=dhcp_socket)
+      self.relay_ip = relay_ip
+
+   def unbind(self):
+      if self.transport:
+         self.transport.close()
+         self.transport = None
+      if self.tmp_ip:
+         delete_ip(args.interface, self.tmp_ip)
+         self.tmp_ip = None
+      self.relay_ip = None
+
+   async def probe(self):
+      """
+      Run a single probe and return the result.
+      """
+      result = {
+         "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+         "success": False,
+         "server_id": None,
+         "yiaddr": None,
+         "latency": {},
+         "error": None
+      }
+      try:
+         if not toolkit.is_running("dhcpd", pid_file=config["dhcpd_pid_file"]):
+            raise OSError("DHCP Server is not running")
+         await self.reload()
+
+         # DISCOVER / OFFER
+         dhcp_server = (args.server_ip, 67)
+         xid = self.protocol.new_xid()
+         mac = toolkit.HardwareKey.parse(self.mac_address)
+         packet = self.templates["DHCPDISCOVER"].build(xid, mac)
+         transaction = await self.protocol.transact(packet, dhcp_server, {"DHCPOFFER"}, config["dhcp_timeout"], config["dhcp_attempts"])
+         if not transaction.responses:
+            raise TimeoutError("Did not receive a DHCPOFFER")
+         offer = transaction.responses[0]
+         result["server_id"] = str(offer["server_id"])
+         result["yiaddr"] = str(offer["packet"].yiaddr)
+         result["latency"]["DHCPDISCOVER"] = offer["latency"]
+
+         # REQUEST / ACK / RELEASE
+         if args.test in ("dora", "full-cycle"):
+            server_id = dhcp_option(offer["packet"].data, 54)
+            packet = self.templates["DHCPREQUEST"].build(xid, mac, options={ 50: offer["packet"].data[16:20], 54: server_id })
+            transaction = await self.protocol.transact(packet, dhcp_server, {"DHCPACK", "DHCPNAK"}, config["dhcp_timeout"], config["dhcp_attempts"])
+            if not transaction.responses:
+               raise TimeoutError("Did not receive a DHCPACK")
+            ack = transaction.responses[0]
+            result["latency"]["DHCPREQUEST"] = ack["latency"]
+            if ack["message_type"] == "DHCPNAK":
+               raise ValueError("Received DHCPNAK from {}".format(ack["server_id"]))
+            packet = self.templates["DHCPRELEASE"].build(self.protocol.new_xid(), mac, ciaddr=struct.unpack_from("!I", ack["packet"].data, 16)[0], options={ 54: server_id })
+            self.transport.sendto(packet, dhcp_server)
+         result["success"] = True
+      except Exception as error:
+         result["error"] = "{} - {}".format(type(error).__name__, error)
+      return result
+
+   def publish(self, result):
+      self.status["probes"] += 1
+      if result["success"]:
+         self.status["last_success"] = result["time"]
+      else:
+         self.status["failures"] += 1
+      self.status["last_probe"] = result
+
+      # replace status file so readers never see a partially written file
+      status_file = config["status_file"]
+      try:
+         with open(status_file + ".tmp", "w") as status_fh:
+            status_fh.write(toolkit.to_json(self.status))
+         os.replace(status_file + ".tmp", status_file)
+      except OSError as error:
+         logger.error("Failed to write status file {} : {} - {}".format(status_file, type(error).__name__, error))
+
+   async def serve_status(self, reader, writer):
+      writer.write(bytes(toolkit.to_json(self.status) + "\n", encoding="utf-8"))
+      try:
+         await writer.drain()
+      finally:
+         writer.close()
+
+   def request_reload(self):
+      logger.info("Reload requested")
+      self.reload_requested = True
+
+   async def run(self):
+      loop = asyncio.get_running_loop()
+      stop = asyncio.Event()
+      loop.add_signal_handler(signal.SIGTERM, stop.set)
+      loop.add_signal_handler(signal.SIGINT, stop.set)
+      loop.add_signal_handler(signal.SIGHUP, self.request_reload)
+
+      status_server = None
+      status_socket = config["status_socket"]
+      if status_socket:
+         if os.path.exists(status_socket):
+            os.unlink(status_socket)
+         status_server = await asyncio.start_unix_server(self.serve_status, path=status_socket)
+
+      # continue statistics of previous runs
+      if config["stats_file"]:
+         try:
+            self.statistics.load(config["stats_file"])
+         except (OSError, ValueError, KeyError) as error:
+            logger.warn("Failed to read statistics from {}, starting from scratch : {} - {}".format(config["stats_file"], type(error).__name__, error))
+
+      logger.info("DHCP Probe daemon started, probing every {} seconds".format(config["probe_interval"]))
+      try:
+         while not stop.is_set():
+            started = loop.time()
+            result = await self.probe()
+            self.publish(result)
+            self.statistics.export()
+            if result["success"]:
+               latencies = ", ".join("{} {:.1f} ms".format(message_type, latency * 1000) for (message_type, latency) in result["latency"].items())
+               logger.info("Probe succeeded : {} from {} ({})".format(result["yiaddr"], result["server_id"], latencies))
+            else:
+               logger.error("Probe failed : {}".format(result["error"]))
+            try:
+               await asyncio.wait_for(stop.wait(), max(config["probe_interval"] - (loop.time() - started), 0))
+            except asyncio.TimeoutError:
+               pass
+      finally:
+         if status_server:
+            status_server.close()
+            os.unlink(status_socket)
+         self.unbind()
+      logger.info("DHCP Probe daemon stopped")
+
+# configuration file settings and their defaults
+config_schema = {
    # where to check for dhcpd.conf
-   "dhcpd_conf_dir": "/opt/qip/current/dhcp",
+   "dhcpd_conf_dir": { "type": str, "default": "/opt/qip/current/dhcp" },
 
    # path to log file
-   "log_file": "/opt/qip/current/log/dhcp-probe.log",
+   "log_file": { "type": str, "default": "/opt/qip/current/log/dhcp-probe.log" },
 
    # timeout (in seconds)
-   "dhcp_timeout": 3,
+   "dhcp_timeout": { "type": (int, float), "default": 3, "min": 0 },
 
    # number of retries
-   "dhcp_attempts": 3
-}
+   "dhcp_attempts": { "type": int, "default": 3, "min": 1 },
+
+   # PID file of the local DHCP server (optional, speeds up checking if dhcpd is running)
+   "dhcpd_pid_file": { "type": str, "default": None },
 
-# override defaults based on environment
-if "QDHCPCONFIG" in os.environ:
-   config["dhcpd_conf_dir"] = os.environ["QDHCPCONFIG"]
-if "QIPHOME" in os.environ:
-   config["log_file"] = os.path.join(os.environ["QIPHOME"],"log","dhcp-probe.log")
+   # daemon mode : seconds between probes
+   "probe_interval": { "type": (int, float), "default": 60, "min": 1 },
+
+   # daemon mode : file to write the probe results to
+   "status_file": { "type": str, "default": "/opt/qip/current/tmp/dhcp-probe.status.json" },
+
+   # daemon mode : Unix socket to serve the probe results on (optional)
+   "status_socket": { "type": str, "default": None },
+
+   # daemon mode : file to keep response time histograms, timeouts and NAKs per server in (kept across restarts)
+   "stats_file": { "type": str, "default": "/opt/qip/current/tmp/dhcp-probe.stats.json" },
+
+   # daemon mode : file to write the statistics to in Prometheus text format (optional), e.g. for the node exporter textfile collector
+   "prometheus_file": { "type": str, "default": None }
+}
 
-# read config file if present
 script_dir = os.path.dirname(os.path.abspath(__file__))
 config_file = os.path.join(script_dir, "dhcp-probe.conf")
-if os.path.exists(config_file):
-   config, config_json = toolkit.read_config(config_file, config)
+
+def load_config():
+   """
+   Build the configuration from defaults, environment and config file (if present).
+   """
+   config = {}
+
+   # override defaults based on environment
+   if "QDHCPCONFIG" in os.environ:
+      config["dhcpd_conf_dir"] = os.environ["QDHCPCONFIG"]
+   if "QIPHOME" in os.environ:
+      config["log_file"] = os.path.join(os.environ["QIPHOME"],"log","dhcp-probe.log")
+      config["status_file"] = os.path.join(os.environ["QIPHOME"],"tmp","dhcp-probe.status.json")
+      config["stats_file"] = os.path.join(os.environ["QIPHOME"],"tmp","dhcp-probe.stats.json")
+
+   # read config file if present
+   if os.path.exists(config_file):
+      config, config_json = toolkit.read_config(config_file, config)
+   return toolkit.validate_config(config, config_schema)
+
+try:
+   config = load_config()
+except (OSError, ValueError) as error:
+   print("Failed to read configuration {} : {} - {}".format(config_file, type(error).__name__, error))
+   exit(exit_code_error)
 
 # initialize logging
 logger = toolkit.Logger(log_file = config["log_file"], console_logging = True)
@@ -287,7 +1314,7 @@ error_cnt = 0
 debug = 0
 
 arg_parser = argparse.ArgumentParser(description='4N DHCP-Probe', allow_abbrev=False, add_help=True)
-arg_parser.add_argument('-t', '--test', choices=['discover-only', 'request-only', 'release-only', 'dora', 'full-cycle'], default='discover-only', help="Test mode to use")
+arg_parser.add_argument('-t', '--test', choices=['discover-only', 'request-only', 'release-only', 'dora', 'full-cycle', 'load-test', 'rogue-detect'], default='discover-only', help="Test mode to use")
 arg_parser.add_argument('-m', '--mac-address', default='4e:4e:4e:4e:00:00', help="MAC address to use. Format is 11:22:33:aa:bb:cc, 44-55-66-dd-ee-ff or 123456abcdef")
 arg_parser.add_argument('-H', '--hostname', default='4n-dhcp-probe', help="Hostname to use")
 arg_parser.add_argument('-b', '--broadcast', action='store_true', help="Set Broadcast Flag")
@@ -302,12 +1329,20 @@ arg_parser.add_argument('-O', '--option-hex', action='append', help="Additional
 arg_parser.add_argument('-p', '--parameter-request-list', help="Parameter Request List to send (comma separated)")
 arg_parser.add_argument('-r', '--requested-ip-address', help="Requested IP Address to send")
 arg_parser.add_argument('-s', '--server-ip', help="Server IP Address (for unicasts)")
+arg_parser.add_argument('-S', '--sweep-server', action='append', help="Probe these servers concurrently (discover-only)")
 arg_parser.add_argument('-R', '--relay-ip', help="Fake DHCP Relay IP Address (giaddr) (for unicasts)")
 arg_parser.add_argument('-a', '--accepted-server', action='append', help="Use these server's reponses only")
 arg_parser.add_argument('-A', '--accepted-server-only', action='store_true', help="Enforce answers from accepted servers only (WIP)")
 arg_parser.add_argument('-P', '--primary', action='store_true', help="Enforce answers from primary accepted servers only (WIP)")
 arg_parser.add_argument('-i', '--interface', help="Interface to use for sending/receiving packets")
 arg_parser.add_argument('-M', '--monitoring', action='store_true', help="Automatically probe the local DHCP service")
+arg_parser.add_argument('-n', '--clients', type=int, default=1000, help="Number of clients to simulate (load-test)")
+arg_parser.add_argument('-l', '--load-rate', type=float, default=100, help="DORA cycles to start per second (load-test)")
+arg_parser.add_argument('-X', '--fake-server', action='store_true', help="Start a local fake DHCP Server (load-test)")
+arg_parser.add_argument('-D', '--daemon', action='store_true', help="Continuously probe the local DHCP service")
+arg_parser.add_argument('-w', '--listen-window', type=float, default=10, help="Seconds to listen for DHCP Servers (rogue-detect)")
+arg_parser.add_argument('-L', '--passive', action='store_true', help="Capture DHCP Server responses instead of sending DISCOVER (rogue-detect)")
+arg_parser.add_argument('-V', '--validate', action='store_true', help="Validate dhcpd.conf and exit")
 arg_parser.add_argument('-d', '--debug', action='count', help="Enable debugging, can be specified up to two times to increase level of details")
 args = arg_parser.parse_args()
 
@@ -323,11 +1358,15 @@ if args.debug:
       logger.set_level("TRACE")
 
 # format / check command line args
-match = re.search("^([a-fA-F0-9]{2}[:\-]?){5}[a-fA-F0-9]{2}$", args.mac_address)
-if not match:
+try:
+   mac_key = toolkit.HardwareKey.parse(args.mac_address)
+except ValueError:
+   mac_key = None
+if not mac_key or not mac_key.is_mac():
    logger.error("Invalid MAC address '{}', required format is 11:22:33:aa:bb:cc, 44-55-66-dd-ee-ff or 123456abcdef".format(args.mac_address))
    args_error = True
-args.mac_address = re.sub("^([0-9a-fA-F]{2})([:\-]?)([0-9a-fA-F]{2})([:\-]?)([0-9a-fA-F]{2})([:\-]?)([0-9a-fA-F]{2})([:\-]?)([0-9a-fA-F]{2})([:\-]?)([0-9a-fA-F]{2})$", r"\1:\3:\5:\7:\9:\11", args.mac_address)
+else:
+   args.mac_address = mac_key.format(":")
 
 if args.client_id_hex:
    client_id_hex = re.sub(":", "", args.client_id_hex)
@@ -385,6 +1424,16 @@ if args.server_ip:
       logger.error("specified server IP address '{}' is not a valid IPv4 Addresss".format(args.server_ip))
       args_error = True
 
+sweep_servers = []
+if args.sweep_server:
+   for ip_address in ",".join(args.sweep_server).split(","):
+      try:
+         ip = ipaddress.IPv4Address(ip_address.strip())
+         sweep_servers.append(ip)
+      except ipaddress.AddressValueError:
+         logger.error("specified server IP address '{}' is not a valid IPv4 Addresss".format(ip_address))
+         args_error = True
+
 accepted_servers = []
 if args.accepted_server:
    for ip_address in args.accepted_server:
@@ -400,7 +1449,15 @@ if args.client_id and args.client_id_hex:
    logger.error("Parameters -c and -C are mutually exclusive - specify only one of them")
    args_error = True
 
+if args.server_ip and args.sweep_server:
+   logger.error("Parameters -s and -S are mutually exclusive - specify only one of them")
+   args_error = True
+
 # check required options
+if args.sweep_server and args.test != "discover-only":
+   logger.error("Option -S can only be used with test 'discover-only'")
+   args_error = True
+
 if args.test == "request-only":
    if not args.requested_ip_address:
       logger.error("Test 'request-only' requires option '-r <requested IP Address>'")
@@ -420,23 +1477,108 @@ if args.accepted_server_only or args.primary:
       args_error = True
 
 if args.relay_ip:
+   if not args.server_ip and not args.sweep_server:
+      logger.error("Option -R requires option '-s <server IP>' or '-S <server IP>'")
+      args_error = True
+
+if args.test == "load-test":
+   if args.clients < 1 or args.load_rate <= 0:
+      logger.error("Test 'load-test' requires at least one client and a rate greater than 0")
+      args_error = True
+   elif mac_key and mac_key.to_int() + args.clients > 2**48:
+      logger.error("Cannot use {} clients starting with MAC {}".format(args.clients, args.mac_address))
+      args_error = True
+
+if args.fake_server:
+   if args.test != "load-test":
+      logger.error("Option -X can only be used with test 'load-test'")
+      args_error = True
+   if args.relay_ip:
+      logger.error("Option -X cannot be used with option '-R <relay IP>'")
+      args_error = True
    if not args.server_ip:
-      logger.error("Option -R requires option '-s <server IP>'")
+      args.server_ip = "127.0.0.1"
+
+if args.test == "rogue-detect":
+   if args.server_ip or args.sweep_server or args.relay_ip:
+      logger.error("Test 'rogue-detect' cannot be used with options -s, -S and -R")
       args_error = True
+   if args.listen_window <= 0:
+      logger.error("Option -w requires a time greater than 0")
+      args_error = True
+elif args.passive:
+   logger.error("Option -L can only be used with test 'rogue-detect'")
+   args_error = True
 
 if args.monitoring:
    monitoring = True
 
+daemon = False
+if args.daemon:
+   daemon = True
+   monitoring = True
+   if args.test not in ("discover-only", "dora", "full-cycle"):
+      logger.error("Option -D can only be used with tests 'discover-only', 'dora' and 'full-cycle'")
+      args_error = True
+
 # exit on error
 if args_error:
    exit(exit_code_error)
 
 # info on probe config used
-logger.trace("Using configuration:\n" + config_json)
+if debug > 2:
+   logger.trace("Using configuration:\n" + toolkit.to_json(config))
+
+# check dhcpd.conf only
+if args.validate:
+   dhcpd_conf_file = os.path.join(config["dhcpd_conf_dir"], "dhcpd.conf")
+   logger.info("Validating {}".format(dhcpd_conf_file))
+   try:
+      dhcpd_conf = toolkit.DhcpdConf(config["dhcpd_conf_dir"], pcy_file_name=None)
+   except Exception as error:
+      logger.error("Failed to parse dhcpd.conf in {} : {} - {}".format(config["dhcpd_conf_dir"],type(error).__name__,error))
+      exit(exit_code_error)
+   findings = dhcpd_conf.validate()
+   # show the block of each finding when debugging
+   lines = None
+   if debug and findings:
+      lines = toolkit.LineReader(dhcpd_conf_file, errors="replace")
+   for finding in findings:
+      message = "{} line {} : {} ({})".format(dhcpd_conf_file, finding["line"], finding["message"], finding["check"])
+      if finding["severity"] == "error":
+         logger.error(message)
+      else:
+         logger.warning(message)
+      if lines and finding["line"]:
+         (first_line, last_line) = lines.get_block(finding["line"])
+         line_numbers = list(range(first_line, last_line + 1))
+         if len(line_numbers) > 10:
+            line_numbers = sorted({ first_line, finding["line"], last_line })
+         for line_number in line_numbers:
+            logger.debug("{:>7} {}".format(line_number, lines.get_line(line_number)))
+   if lines:
+      lines.close()
+   errors = len([ finding for finding in findings if finding["severity"] == "error" ])
+   logger.info("Validation completed : {} errors, {} warnings".format(errors, len(findings) - errors))
+   if errors:
+      exit(exit_code_error)
+   if findings:
+      exit(exit_code_warning)
+   exit()
+
+# continuous monitoring of local DHCP Server
+if daemon:
+   args.interface = "lo"
+   args.server_ip = "127.0.0.1"
+   lock_file = os.path.join(os.path.dirname(config["status_file"]), "dhcp-probe.lock")
+   with toolkit.singleInstance(lock_file=lock_file):
+      probe_daemon = ProbeDaemon(build_option_list())
+      asyncio.run(probe_daemon.run())
+   exit()
 
 # automated monitoring of local DHCP Server only
 if monitoring:
-   if not toolkit.is_running("dhcpd"):
+   if not toolkit.is_running("dhcpd", pid_file=config["dhcpd_pid_file"]):
       logger.warning("DHCP Server is not running, exiting DHCP Probe")
       exit(exit_code_warning)
 
@@ -448,48 +1590,10 @@ if monitoring:
       exit(exit_code_error)
    logger.info("Reading dhcpd.conf completed")
 
-   # make sure ListenOnLoopback=1
-   dhcpd_pcy = dhcpd_conf.get_pcy()
-   listen_on_loopback = False
-   for policy in dhcpd_pcy["policies"]:
-      if re.search("ListenOnLoopback", policy["policy_name"], re.IGNORECASE):
-         if policy["policy_value"] == "1":
-            listen_on_loopback = True
-         break
-   if not listen_on_loopback:
-      logger.error("Need policy ListenOnLoopback=1 in dhcpd.pcy / Additional Policies")
-      exit(exit_code_error)
-
-   # get locally attached IPv4 subnets to check if they exist in the configuration
-   localnets = []
-   interface_nets = get_ipv4_networks()
-   for interface in interface_nets:
-      for localnet in interface_nets[interface]:
-         localnets.append(localnet)
-
-   # determine IP / MAC adddress to use (requires M-DHCP to be configured in local subnet)
-   found = False
-   relay_ip = None
-   mac_address = None
-   dhcpd_config = dhcpd_conf.get_config()
-   for subnet in dhcpd_config["subnets"]:
-      for localnet in localnets:
-         if subnet["subnet"] == str(localnet.network_address) and subnet["netmask"] == str(localnet.netmask):
-            ranges = subnet["ranges"]
-            for dhcp_range in ranges:
-               if dhcp_range["range_type"] == "manual-dhcp":
-                  mac = dhcp_range["mac"]
-                  if re.search("^4e-4e-4e-4e", mac):
-                     mac_address = re.sub("-", ":", mac)
-                     relay_ip = dhcp_range["ip"]
-                     found = True
-                     break
-         if found:
-            break            
-      if found:
-         break
-   if not found:
-      logger.error("Need M-DHCP with MAC 4e:4e:4e:4e:xx:xx in a local subnet: {}".format(localnets))
+   try:
+      (relay_ip, mac_address) = find_probe_address(dhcpd_conf)
+   except ValueError as error:
+      logger.error(error)
       exit(exit_code_error)
    logger.debug("Using Relay IP {} and MAC {} for DHCP Probe".format(relay_ip, mac_address))
 
@@ -518,43 +1622,18 @@ if args.relay_ip:
       logger.warn("Specify '-i <interface>' to receive unicast responses to {}".format(args.relay_ip))
 
 logger.debug("Using MAC {}".format(args.mac_address))
-logger.debug("Waiting for response on {}".format(dhcp_client))
-dhcp_socket = setup_socket(dhcp_client, args.interface, config["dhcp_timeout"])
+# rogue-detect uses a socket per interface
+if args.test != "rogue-detect":
+   logger.debug("Waiting for response on {}".format(dhcp_client))
+   dhcp_socket = setup_socket(dhcp_client, args.interface, config["dhcp_timeout"])
 
 receive_package_size = 2048
+receive_buffer = bytearray(receive_package_size)
+receive_view = memoryview(receive_buffer)
 
 
 # build option list
-options = dhcppython.options.OptionList()
-
-# simple options
-options.append(dhcppython.options.options.short_value_to_object(12, args.hostname))
-if args.vendor_class:
-   options.append(dhcppython.options.options.short_value_to_object(60, args.vendor_class))
-if args.user_class:
-   byte_value = bytes(args.user_class, encoding="utf-8")
-   options.append(dhcppython.options.UnknownOption(77, len(byte_value), byte_value))
-if args.client_id:
-   options.append(dhcppython.options.options.short_value_to_object(61, args.client_id))
-
-# other options
-if args.parameter_request_list:
-   requested_options = ""
-   for option in args.parameter_request_list.split(","):
-      requested_options += "{:02x}".format(int(option))
-   options.append(dhcppython.options.options.short_value_to_object(55, bytes.fromhex(requested_options)))
-
-# regular options
-for op_code in option_list:
-   value = option_list[op_code]
-   byte_value = bytes(value, encoding="utf-8")
-   options.append(dhcppython.options.UnknownOption(int(op_code), len(byte_value), byte_value))
-
-# hex options
-for op_code in option_list_hex:
-   value = option_list_hex[op_code]
-   byte_value = bytes.fromhex(value)
-   options.append(dhcppython.options.UnknownOption(int(op_code), len(byte_value), byte_value))
+options = build_option_list()
 
 # init packets to be sent/received
 dhcp_discover = None
@@ -563,10 +1642,71 @@ dhcp_response = None
 
 # run tests
 
+## Find DHCP Servers on all local segments
+if args.test == "rogue-detect":
+   if args.interface:
+      interfaces = [ args.interface ]
+   elif args.passive:
+      interfaces = []
+   else:
+      # interface labels of secondary addresses (eth0:1) share the interface
+      interfaces = sorted(set(if_name.split(":")[0] for if_name in get_ipv4_networks()) - {"lo"})
+      if not interfaces:
+         logger.error("No interfaces with IPv4 addresses found")
+         exit(exit_code_error)
+
+   if args.passive:
+      logger.info("Capturing DHCP Server responses on {} for {} seconds".format(", ".join(interfaces) or "all interfaces", args.listen_window))
+   else:
+      logger.info("Sending DHCPDISCOVER on {}, waiting {} seconds for responses".format(", ".join(interfaces), args.listen_window))
+   # responses to clients without IP might be broadcasted only
+   dhcp_discover = dhcppython.packet.DHCPPacket.Discover(mac_addr = args.mac_address, use_broadcast = True, option_list = options)
+   try:
+      servers = asyncio.run(detect_servers(interfaces, dhcp_discover, args.listen_window, args.passive))
+   except PermissionError as error:
+      logger.error("Capturing DHCP packets requires root : {}".format(error))
+      exit(exit_code_error)
+   if not servers:
+      logger.warn("Did not find any DHCP Server")
+      error_cnt += 1
+   elif not accepted_servers:
+      logger.warn("No accepted servers specified with '-a <accepted server IP>', cannot detect unexpected DHCP Servers")
+   if report_servers(servers, accepted_servers):
+      error_cnt += 2
+
+## Send DHCPDISCOVER to multiple servers concurrently
+elif sweep_servers:
+   dhcp_discover = dhcppython.packet.DHCPPacket.Discover(mac_addr = args.mac_address, use_broadcast = args.broadcast, relay = args.relay_ip, option_list = options)
+   logger.info("Sending DHCPDISCOVER to {} servers".format(len(sweep_servers)))
+   if debug > 1:
+      print_dhcp_packet(dhcp_discover)
+   statistics = ProbeStatistics()
+   error_cnt += asyncio.run(probe_servers(dhcp_socket, sweep_servers, dhcp_discover, config["dhcp_timeout"], config["dhcp_attempts"], statistics))
+   statistics.log_report()
+
+## Run DORA/RELEASE cycles for many clients
+elif args.test == "load-test":
+   # pre-built packets, option values are patched in for each client
+   templates = build_templates(args.mac_address, args.relay_ip, options)
+
+   # large receive buffer to not drop responses under load
+   dhcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+
+   logger.info("Starting load test with {} clients at {} DORA cycles per second against {}".format(args.clients, args.load_rate, dhcp_server))
+   base_mac = toolkit.HardwareKey.parse(args.mac_address).to_int()
+   statistics = ProbeStatistics()
+   stats = asyncio.run(load_test(dhcp_socket, dhcp_server, templates, base_mac, args.clients, args.load_rate, config["dhcp_timeout"], config["dhcp_attempts"], args.fake_server, statistics))
+   print_load_test_results(stats, args.clients)
+   statistics.log_report()
+   if stats["failed"]:
+      error_cnt += 1
+   if not stats["completed"]:
+      error_cnt += 1
+
 ## Send DHCPDISCOVER
 ## discover-only will wait for multiple DHCPOFFERs
 ## dora/full-cycle will use the first matching DHCPOFFER (xid) to continue
-if args.test == "discover-only" or args.test == "dora" or args.test == "full-cycle":
+elif args.test == "discover-only" or args.test == "dora" or args.test == "full-cycle":
    # build DISCOVER and send it
    dhcp_discover = dhcppython.packet.DHCPPacket.Discover(mac_addr = args.mac_address, use_broadcast = args.broadcast, relay = args.relay_ip, option_list = options)
    logger.trace("Sending DHCPDISCOVER: {}".format(dhcp_discover))
@@ -585,7 +1725,8 @@ if args.test == "discover-only" or args.test == "dora" or args.test == "full-cyc
       else:
          # received some response
          if dhcp_response.xid == dhcp_discover.xid:
-            logger.trace("Got response: {}".format(dhcp_response))
+            if debug > 2:
+               logger.trace("Got response: {}".format(dhcp_response))
             message_type = dhcp_type(dhcp_response)
             server_id = dhcp_server_id(dhcp_response)
             if not check_accepted_server(server_id, accepted_servers):
@@ -632,7 +1773,8 @@ if (args.test == "dora" or args.test == "full-cycle") and not error_cnt:
       else:
          # received some response
          if dhcp_response.xid == dhcp_discover.xid:
-            logger.trace("Got response: {}".format(dhcp_response))
+            if debug > 2:
+               logger.trace("Got response: {}".format(dhcp_response))
             message_type = dhcp_type(dhcp_response)
             server_id = dhcp_server_id(dhcp_response)
             if not check_accepted_server(server_id, accepted_servers):
@@ -724,7 +1866,8 @@ if (args.test == "request-only" or (dhcp_response and args.test == "full-cycle")
       else:
          # received some response
          if dhcp_response.xid == dhcp_discover.xid:
-            logger.trace("Got response: {}".format(dhcp_response))
+            if debug > 2:
+               logger.trace("Got response: {}".format(dhcp_response))
             message_type = dhcp_type(dhcp_response)
             server_id = dhcp_server_id(dhcp_response)
             if not check_accepted_server(server_id, accepted_servers):
@@ -0,0 +1,96 @@
+#!/usr/bin/python3.9
+
+##########################################################################
+#  _  _   _   _   ___ _____    ____        _       _   _
+# | || | | \ | | |_ _|_   _|  / ___|  ___ | |_   _| |_(_) ___  _ __  ___
+# | || |_|  \| |  | |  | |____\___ \ / _ \| | | | | __| |/ _ \| '_ \/ __|
+# |__   _| |\  |  | |  | |_____|__) | (_) | | |_| | |_| | (_) | | | \__ \
+#    |_| |_| \_| |___| |_|    |____/ \___/|_|\__,_|\__|_|\___/|_| |_|___/
+#
+##########################################################################
+#
+# Name:         dhcp-utilization.py
+# Company:      4N IT-Solutions GmbH
+#
+# Description:  Pool utilization of the local DHCP server based on its lease file(s)
+#
+# Requirements: Python version must be 3.8 or newer (i.e. Python 3.9 on Rocky Linux)
+#               The following non-default Python modules are required:
+#               nnnn_toolkit
+#
+# Known issues: DHCPv6 ranges are not supported
+#
+##########################################################################
+
+# python doc
+"""
+Pool utilization of the local DHCP server : the leases from the lease file(s) are mapped to the
+dynamic ranges in dhcpd.conf and counted per range, subnet and shared network.
+
+Usage:
+dhcp-utilization.py [-c <dhcpd.conf directory>] [-f <lease file>] [-o json|csv] [-l ranges|subnets|shared_networks] [-d]
+
+   -c <directory>:      Directory with dhcpd.conf, defaults to $QDHCPCONFIG or /opt/qip/current/dhcp
+
+   -f <lease file>:     Lease file to read, can be specified multiple times (in the order the files were written),
+                        defaults to dhcpd.leases in the dhcpd.conf directory
+
+   -o <format>:         Output format, json (default, all levels) or csv (one level, see "-l")
+
+   -l <level>:          Level to report as CSV : ranges (default), subnets or shared_networks
+
+   -d:                  Enable debugging output
+"""
+
+# required modules
+import os
+import sys
+import argparse
+# required for binary build
+from sys import exit
+
+# 4N modules
+import nnnn_toolkit as toolkit
+
+# exit codes
+exit_code_error = 2
+
+# initialize logging
+logger = toolkit.Logger(console_logging = True)
+logger.set_level("INFO")
+
+arg_parser = argparse.ArgumentParser(description='4N DHCP Pool Utilization', allow_abbrev=False, add_help=True)
+arg_parser.add_argument('-c', '--conf-dir', default=os.environ.get("QDHCPCONFIG", "/opt/qip/current/dhcp"), help="Directory with dhcpd.conf")
+arg_parser.add_argument('-f', '--lease-file', action='append', help="Lease file(s) to read")
+arg_parser.add_argument('-o', '--output', choices=['json', 'csv'], default='json', help="Output format")
+arg_parser.add_argument('-l', '--level', choices=['ranges', 'subnets', 'shared_networks'], default='ranges', help="Level to report as CSV")
+arg_parser.add_argument('-d', '--debug', action='store_true', help="Enable debugging")
+args = arg_parser.parse_args()
+
+if args.debug:
+   logger.set_level("DEBUG")
+
+lease_files = args.lease_file or [ os.path.join(args.conf_dir, "dhcpd.leases") ]
+
+logger.debug("Reading dhcpd.conf in {}".format(args.conf_dir))
+try:
+   dhcpd_conf = toolkit.DhcpdConf(args.conf_dir, pcy_file_name=None)
+except (OSError, SyntaxError) as error:
+   logger.error("Failed to parse dhcpd.conf in {} : {} - {}".format(args.conf_dir, type(error).__name__, error))
+   exit(exit_code_error)
+
+utilization = toolkit.LeaseUtilization(dhcpd_conf)
+for lease_file in lease_files:
+   logger.debug("Reading leases from {}".format(lease_file))
+   try:
+      utilization.read_leases(lease_file)
+   except (OSError, SyntaxError) as error:
+      logger.error("Failed to read lease file {} : {} - {}".format(lease_file, type(error).__name__, error))
+      exit(exit_code_error)
+if utilization.unmatched:
+   logger.debug("{} lease declarations are not within any dynamic range".format(utilization.unmatched))
+
+if args.output == "csv":
+   utilization.write_csv(sys.stdout, args.level)
+else:
+   print(utilization.get_json())
@@ -1,13 +1,723 @@
-from scapy.all import *
+#!/usr/bin/python3.9
 
-# DHCPv6-Solicit-Nachricht erstellen
-dhcpv6_solicit = IPv6(dst="ff02::1:2") / UDP(sport=546, dport=547) / DHCP6_Solicit()
+##########################################################################
+#  _  _   _   _   ___ _____    ____        _       _   _
+# | || | | \ | | |_ _|_   _|  / ___|  ___ | |_   _| |_(_) ___  _ __  ___
+# | || |_|  \| |  | |  | |____\___ \ / _ \| | | | | __| |/ _ \| '_ \/ __|
+# |__   _| |\  |  | |  | |_____|__) | (_) | | |_| | |_| | (_) | | | \__ \
+#    |_| |_| \_| |___| |_|    |____/ \___/|_|\__,_|\__|_|\___/|_| |_|___/
+#
+##########################################################################
+#
+# Name:         dhcpv6_probe.py
+# Company:      4N IT-Solutions GmbH
+# Author:       Thomas Erhardt
+# Date:         19.10.2026
+#
+# Description:  DHCPv6 Probe to check DHCPv6 responses from specific / all servers
+#
+# Requirements: Python version must be 3.8 or newer (i.e. Python 3.9 on Rocky Linux)
+#               The following non-default Python modules are required:
+#               nnnn_toolkit
+#
+# Known issues: -
+#
+# Tested with:  Rocky Linux 8.6
+#
+##########################################################################
 
-print("[*] Sende DHCPv6 Solicit...")
-response = sr1(dhcpv6_solicit, timeout=5)
 
-if response:
-    print("[+] Antwort vom DHCPv6-Server erhalten!")
-    response.show()
-else:
-    print("[-] Keine Antwort erhalten.")
+# dependencies : will be checked by installation script
+# DEPENDS_ON_MODULE: json,python3-libs
+
+# python doc
+"""
+DHCPv6 Probe to check DHCPv6 responses from specific / all servers. Sends DHCPv6 messages and displays the received response(s).
+
+Usage:
+dhcpv6_probe.py [-t <test>] [-m <MAC Address>] [-I <IAID>] [-s <server IP>] [-R <link address>] [-i <interface name>] [-a <accepted server DUID>] [-n <clients>] [-X] [-d]
+
+   -t <test>:     determine the type of DHCPv6 test that will be done, valid values are
+                  solicit (default): only send SOLICIT to see which DHCPv6 Servers respond with an ADVERTISE
+                  sarr: go through SOLICIT/ADVERTISE/REQUEST/REPLY cycle
+                  full-cycle: go through SOLICIT/ADVERTISE/REQUEST/REPLY, RENEW/REPLY, RELEASE/REPLY cycle
+
+   -m <MAC Address>:    MAC Address to use for the client DUID (DUID-LL) in format abcdef123456 (separators :, - or .
+                        are allowed), defaults to 4e:4e:4e:4e:00:00
+
+   -I <IAID>:           The IAID to use for IA_NA (decimal), defaults to the last 4 bytes of the MAC address
+
+   -s <server IP>:      Specify DHCPv6 Server IP address to use for unicasts. Defaults to the multicast address
+                        ff02::1:2 (All_DHCP_Relay_Agents_and_Servers) which requires "-i <interface name>".
+
+   -R <link address>:   Act as DHCPv6 Relay: encapsulate messages in RELAY-FORW with this link address, requires
+                        "-s <server IP>". Responses are expected as RELAY-REPL on port 547.
+
+   -i <interface name>: Specify the name of the interface for DHCPv6 testing, required for multicasts.
+
+   -a <accepted server DUID>: Specify a DHCPv6 Server DUID (hex, ":" separators allowed) to accept a response from.
+                        Can be repeated multiple times. If other servers do respond their response will be ignored.
+
+   -n <clients>:        Number of clients to run the test for concurrently, defaults to 1. The MAC addresses used are
+                        "-m <MAC Address>" incremented by one for each client.
+
+   -X:                  Start a fake DHCPv6 Server on ::1 (or "-s <server IP>"), allows to test the probe without a
+                        real DHCPv6 Server. Cannot be used with "-R <link address>".
+
+   -d:                  Enable debugging output. Specify multile times to get more details (max 3 times).
+"""
+
+# required modules
+import os
+import re
+import argparse
+import time
+import socket
+import ipaddress
+import random
+import asyncio
+import struct
+# required for binary build
+from sys import exit
+
+# required non-standard modules
+import nnnn_toolkit as toolkit
+
+# set up error codes
+error_code_base = 10000
+exit_code_warning = 1
+exit_code_error = 2
+
+# DHCPv6 ports and addresses (RFC 8415)
+client_port = 546
+server_port = 547
+all_dhcp_relay_agents_and_servers = "ff02::1:2"
+
+# DHCPv6 message types
+dhcpv6_message_types = {
+   1: "SOLICIT",
+   2: "ADVERTISE",
+   3: "REQUEST",
+   4: "CONFIRM",
+   5: "RENEW",
+   6: "REBIND",
+   7: "REPLY",
+   8: "RELEASE",
+   9: "DECLINE",
+   10: "RECONFIGURE",
+   11: "INFORMATION-REQUEST",
+   12: "RELAY-FORW",
+   13: "RELAY-REPL"
+}
+dhcpv6_message_codes = { name: code for (code, name) in dhcpv6_message_types.items() }
+
+# DHCPv6 options
+option_client_id = 1
+option_server_id = 2
+option_ia_na = 3
+option_ia_addr = 5
+option_oro = 6
+option_elapsed_time = 8
+option_relay_msg = 9
+option_status_code = 13
+option_interface_id = 18
+option_dns_servers = 23
+option_domain_list = 24
+
+# DHCPv6 status codes
+dhcpv6_status_codes = {
+   0: "Success",
+   1: "UnspecFail",
+   2: "NoAddrsAvail",
+   3: "NoBinding",
+   4: "NotOnLink",
+   5: "UseMulticast"
+}
+
+# helpers
+def encode_option(code, data):
+   return struct.pack("!HH", code, len(data)) + data
+
+def decode_options(data, offset=0):
+   """
+   Decode DHCPv6 options.
+
+   Returns
+   -------
+   dict
+      List of raw option values by option code.
+   """
+   options = {}
+   while offset + 4 <= len(data):
+      (code, length) = struct.unpack_from("!HH", data, offset)
+      if code not in options:
+         options[code] = []
+      options[code].append(data[offset + 4:offset + 4 + length])
+      offset += 4 + length
+   return options
+
+def build_message(message_type, transaction_id, options):
+   """
+   Build a DHCPv6 client message.
+
+   Parameters
+   ----------
+   message_type : str
+      The message type, e.g. "SOLICIT".
+   transaction_id : int
+      The transaction ID (24 bits).
+   options : list
+      Encoded options, see `encode_option`.
+   """
+   return struct.pack("!I", dhcpv6_message_codes[message_type] << 24 | transaction_id) + b"".join(options)
+
+def build_relay_forw(message, link_address, peer_address, interface_id=None):
+   """
+   Encapsulate a message into a RELAY-FORW message.
+   """
+   relay_message = struct.pack("!BB", dhcpv6_message_codes["RELAY-FORW"], 0) + ipaddress.IPv6Address(link_address).packed + ipaddress.IPv6Address(peer_address).packed
+   if interface_id:
+      relay_message += encode_option(option_interface_id, interface_id)
+   return relay_message + encode_option(option_relay_msg, message)
+
+def parse_message(data):
+   """
+   Parse a DHCPv6 message, RELAY-REPL / RELAY-FORW messages are unwrapped.
+
+   Returns
+   -------
+   dict
+      "message_type", "transaction_id", "options" (see `decode_options`) and
+      "relay" (list of link addresses of relay messages the message was encapsulated in).
+
+   Raises
+   ------
+   ValueError
+      If the message is malformed.
+   """
+   relay = []
+   while True:
+      if len(data) < 4:
+         raise ValueError("DHCPv6 message too short ({} bytes)".format(len(data)))
+      message_type = dhcpv6_message_types.get(data[0], str(data[0]))
+      if message_type not in ("RELAY-FORW", "RELAY-REPL"):
+         break
+      if len(data) < 34:
+         raise ValueError("DHCPv6 relay message too short ({} bytes)".format(len(data)))
+      relay.append(ipaddress.IPv6Address(data[2:18]))
+      options = decode_options(data, 34)
+      if option_relay_msg not in options:
+         raise ValueError("{} without Relay Message option".format(message_type))
+      data = options[option_relay_msg][0]
+   return {
+      "message_type": message_type,
+      "transaction_id": struct.unpack_from("!I", data)[0] & 0xffffff,
+      "options": decode_options(data, 4),
+      "relay": relay
+   }
+
+def build_duid(mac):
+   """
+   DUID-LL (type 3) for hardware type Ethernet (1).
+   """
+   return struct.pack("!HH", 3, 1) + mac
+
+def build_ia_na(iaid, address=None, t1=0, t2=0, preferred_lifetime=0, valid_lifetime=0):
+   ia_options = b""
+   if address:
+      ia_options = encode_option(option_ia_addr, ipaddress.IPv6Address(address).packed + struct.pack("!II", preferred_lifetime, valid_lifetime))
+   return encode_option(option_ia_na, struct.pack("!III", iaid, t1, t2) + ia_options)
+
+def parse_status_code(options):
+   """
+   Get status code and message from decoded options, defaults to Success.
+   """
+   if option_status_code not in options:
+      return (0, "")
+   value = options[option_status_code][0]
+   return (struct.unpack_from("!H", value)[0], value[2:].decode("utf-8", errors="replace"))
+
+def parse_ia_na(options):
+   """
+   Get the addresses assigned in IA_NA options.
+
+   Returns
+   -------
+   list
+      Dicts with "iaid", "address", "preferred_lifetime", "valid_lifetime", "t1", "t2" and "status".
+   """
+   addresses = []
+   for value in options.get(option_ia_na, []):
+      (iaid, t1, t2) = struct.unpack_from("!III", value)
+      ia_options = decode_options(value, 12)
+      status = parse_status_code(ia_options)
+      for ia_addr in ia_options.get(option_ia_addr, []):
+         (preferred_lifetime, valid_lifetime) = struct.unpack_from("!II", ia_addr, 16)
+         addresses.append({
+            "iaid": iaid,
+            "address": ipaddress.IPv6Address(ia_addr[:16]),
+            "preferred_lifetime": preferred_lifetime,
+            "valid_lifetime": valid_lifetime,
+            "t1": t1,
+            "t2": t2,
+            "status": status
+         })
+      if not ia_options.get(option_ia_addr):
+         addresses.append({ "iaid": iaid, "address": None, "status": status })
+   return addresses
+
+def link_local_address(mac):
+   """
+   EUI-64 based link local address for a MAC address, used as peer address when relaying.
+   """
+   eui64 = bytes([mac[0] ^ 0x02]) + mac[1:3] + b"\xff\xfe" + mac[3:6]
+   return ipaddress.IPv6Address(b"\xfe\x80" + b"\0" * 6 + eui64)
+
+def check_accepted_server(server_duid, accepted_servers):
+   if accepted_servers:
+      return server_duid in accepted_servers
+   return True
+
+class Dhcpv6Transaction():
+   """
+   A DHCPv6 request waiting for responses, see `Dhcpv6Protocol.transact`.
+   """
+   def __init__(self, transaction_id, expected_types, collect=False):
+      self.transaction_id = transaction_id
+      self.expected_types = expected_types
+      self.collect = collect
+      self.attempt = 0
+      self.sent = None
+      self.responses = []
+      self.done = asyncio.Event()
+
+   def add_response(self, message, sender):
+      if message["message_type"] not in self.expected_types:
+         logger.debug("Ignoring response ({}) from {} for transaction {:06x}".format(message["message_type"], sender[0], self.transaction_id))
+         return
+      message["sender"] = sender
+      message["attempt"] = self.attempt
+      message["latency"] = time.monotonic() - self.sent
+      self.responses.append(message)
+      # a single response completes the transaction unless collecting responses from multiple servers
+      if not self.collect:
+         self.done.set()
+
+class Dhcpv6Protocol(asyncio.DatagramProtocol):
+   """
+   Multiplexes many outstanding DHCPv6 transactions on a single socket, responses are matched by transaction ID.
+   """
+   def __init__(self):
+      self.transport = None
+      self.transactions = {}
+
+   def connection_made(self, transport):
+      self.transport = transport
+
+   def datagram_received(self, data, sender):
+      try:
+         message = parse_message(data)
+      except (ValueError, struct.error) as e:
+         logger.warn("Ignoring malformed response from {}: {} - {}".format(sender[0], type(e).__name__, e))
+         return
+      transaction = self.transactions.get(message["transaction_id"])
+      if not transaction:
+         logger.debug("Ignoring response from {} for unknown transaction {:06x}".format(sender[0], message["transaction_id"]))
+         return
+      transaction.add_response(message, sender)
+
+   def error_received(self, error):
+      logger.warn("Error while waiting for DHCPv6 Server responses: {} - {}".format(type(error).__name__, error))
+
+   def new_transaction_id(self):
+      transaction_id = random.getrandbits(24)
+      while transaction_id in self.transactions:
+         transaction_id = random.getrandbits(24)
+      return transaction_id
+
+   async def transact(self, packet, transaction_id, server, expected_types, timeout, attempts, collect=False):
+      """
+      Send a DHCPv6 message and wait for the response(s), re-sending it if no response is received.
+
+      Parameters
+      ----------
+      packet : bytes
+         The message to send (optionally encapsulated in RELAY-FORW).
+      transaction_id : int
+         The transaction ID of the (encapsulated) client message.
+      server : tuple
+         Socket address to send the message to.
+      expected_types : set
+         The DHCPv6 message types that are accepted as response, e.g. {"REPLY"}.
+      timeout : float
+         Time to wait for a response per attempt.
+      attempts : int
+         Number of times the message is sent at most.
+      collect : boolean, optional
+         Collect responses from multiple servers until the timeout expires (multicasts).
+
+      Returns
+      -------
+      Dhcpv6Transaction
+         The transaction, `responses` is empty if no response has been received.
+      """
+      transaction = Dhcpv6Transaction(transaction_id, expected_types, collect)
+      self.transactions[transaction_id] = transaction
+      try:
+         for attempt in range(1, attempts + 1):
+            transaction.attempt = attempt
+            transaction.sent = time.monotonic()
+            self.transport.sendto(packet, server)
+            try:
+               await asyncio.wait_for(transaction.done.wait(), timeout)
+            except asyncio.TimeoutError:
+               pass
+            if transaction.responses:
+               break
+            logger.debug("No response from {} for transaction {:06x} (attempt {} of {})".format(server[0], transaction_id, attempt, attempts))
+      finally:
+         del self.transactions[transaction_id]
+      return transaction
+
+class Dhcpv6Client():
+   """
+   A simulated DHCPv6 client running a test, see "-t".
+   """
+   def __init__(self, protocol, mac, iaid, server, relay_address=None, report=None):
+      self.protocol = protocol
+      # results are only displayed in detail if running a single client
+      self.report = report or logger.info
+      self.mac = mac
+      self.mac_address = ":".join("{:02x}".format(byte) for byte in mac)
+      self.duid = build_duid(mac)
+      self.iaid = iaid
+      self.server = server
+      self.relay_address = relay_address
+      self.server_duid = None
+      self.address = None
+      self.started = None
+      self.stats = {}
+
+   async def exchange(self, message_type, options, expected_types, collect=False):
+      """
+      Send a message to the server(s), counting sent messages, responses and latencies.
+      """
+      transaction_id = self.protocol.new_transaction_id()
+      elapsed_time = min(int((time.monotonic() - self.started) * 100), 0xffff)
+      options = [ encode_option(option_client_id, self.duid), encode_option(option_elapsed_time, struct.pack("!H", elapsed_time)) ] + options
+      packet = build_message(message_type, transaction_id, options)
+      if self.relay_address:
+         packet = build_relay_forw(packet, self.relay_address, link_local_address(self.mac))
+      logger.debug("Sending {} for {} to {} (transaction {:06x})".format(message_type, self.mac_address, self.server[0], transaction_id))
+      transaction = await self.protocol.transact(packet, transaction_id, self.server, expected_types, config["dhcp_timeout"], config["dhcp_attempts"], collect)
+
+      if message_type not in self.stats:
+         self.stats[message_type] = { "sent": 0, "responses": 0, "latency": toolkit.LatencyHistogram() }
+      self.stats[message_type]["sent"] += transaction.attempt
+      responses = []
+      for response in transaction.responses:
+         server_duid = response["options"].get(option_server_id, [b""])[0]
+         if not check_accepted_server(server_duid, accepted_servers):
+            logger.warn("Ignoring response ({}) from {} ({})".format(response["message_type"], server_duid.hex(":"), response["sender"][0]))
+            continue
+         response["server_duid"] = server_duid
+         self.stats[message_type]["responses"] += 1
+         self.stats[message_type]["latency"].record(response["latency"])
+         responses.append(response)
+      if not responses:
+         logger.error("Did not receive any response to {} for {}".format(message_type, self.mac_address))
+      return responses
+
+   def check_reply(self, message_type, reply):
+      """
+      Log the result of a REPLY, returns the assigned address or `None` on failure.
+      """
+      (status, status_message) = parse_status_code(reply["options"])
+      for ia in parse_ia_na(reply["options"]):
+         if ia["status"][0] != 0:
+            (status, status_message) = ia["status"]
+         elif ia["address"]:
+            self.report("Received REPLY to {} for {} : {} (preferred {}s, valid {}s) from {} ({:.1f} ms)".format(message_type, self.mac_address, ia["address"], ia["preferred_lifetime"], ia["valid_lifetime"], reply["sender"][0], reply["latency"] * 1000))
+            return ia["address"]
+      if status != 0 or message_type != "RELEASE":
+         logger.error("Received REPLY to {} for {} with status {} ({}) {}".format(message_type, self.mac_address, status, dhcpv6_status_codes.get(status, "unknown"), status_message))
+         return None
+      self.report("Received REPLY to {} for {} from {} ({:.1f} ms)".format(message_type, self.mac_address, reply["sender"][0], reply["latency"] * 1000))
+      return True
+
+   async def run(self, test):
+      """
+      Run the test, returns True on success.
+      """
+      self.started = time.monotonic()
+      oro = encode_option(option_oro, struct.pack("!HH", option_dns_servers, option_domain_list))
+
+      ## SOLICIT / ADVERTISE
+      ## solicit will wait for multiple ADVERTISEs
+      ## sarr / full-cycle will use the first ADVERTISE with an address to continue
+      advertises = await self.exchange("SOLICIT", [ build_ia_na(self.iaid), oro ], {"ADVERTISE"}, collect=(test == "solicit"))
+      for advertise in advertises:
+         addresses = [ ia["address"] for ia in parse_ia_na(advertise["options"]) if ia["address"] ]
+         self.report("Received ADVERTISE for {} : {} from {} ({}) ({:.1f} ms)".format(self.mac_address, ", ".join(str(address) for address in addresses) or "no address", advertise["server_duid"].hex(":"), advertise["sender"][0], advertise["latency"] * 1000))
+         if addresses and not self.address:
+            self.address = addresses[0]
+            self.server_duid = advertise["server_duid"]
+      if test == "solicit":
+         return len(advertises) > 0
+      if not self.address:
+         return False
+
+      ## REQUEST / REPLY
+      server_id = encode_option(option_server_id, self.server_duid)
+      replies = await self.exchange("REQUEST", [ server_id, build_ia_na(self.iaid, self.address), oro ], {"REPLY"})
+      if not replies or not self.check_reply("REQUEST", replies[0]):
+         return False
+      if test == "sarr":
+         return True
+
+      ## RENEW / REPLY
+      replies = await self.exchange("RENEW", [ server_id, build_ia_na(self.iaid, self.address), oro ], {"REPLY"})
+      if not replies or not self.check_reply("RENEW", replies[0]):
+         return False
+
+      ## RELEASE / REPLY
+      replies = await self.exchange("RELEASE", [ server_id, build_ia_na(self.iaid, self.address) ], {"REPLY"})
+      if not replies or not self.check_reply("RELEASE", replies[0]):
+         return False
+      return True
+
+class FakeDhcpv6Server(asyncio.DatagramProtocol):
+   """
+   Minimal DHCPv6 Server to test the probe : assigns addresses from fd00::/64 and replies directly
+   to the sender of a message (as RELAY-REPL if it has been relayed).
+   """
+   response_types = { "SOLICIT": "ADVERTISE", "REQUEST": "REPLY", "RENEW": "REPLY", "REBIND": "REPLY", "RELEASE": "REPLY" }
+
+   def __init__(self):
+      self.duid = build_duid(bytes.fromhex("00005e005301"))
+      self.leases = {}
+      self.next_address = int(ipaddress.IPv6Address("fd00::1000"))
+
+   def connection_made(self, transport):
+      self.transport = transport
+      transport.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+
+   def datagram_received(self, data, sender):
+      # unwrap relay messages, keeping the relay headers to wrap the response
+      relay_headers = []
+      while data and data[0] == dhcpv6_message_codes["RELAY-FORW"]:
+         relay_headers.append(data[1:34])
+         data = decode_options(data, 34)[option_relay_msg][0]
+      message = parse_message(data)
+      if message["message_type"] not in self.response_types:
+         return
+      client_duid = message["options"].get(option_client_id, [b""])[0]
+      options = [ encode_option(option_server_id, self.duid), encode_option(option_client_id, client_duid) ]
+      for value in message["options"].get(option_ia_na, []):
+         (iaid,) = struct.unpack_from("!I", value)
+         key = (client_duid, iaid)
+         if message["message_type"] == "RELEASE":
+            self.leases.pop(key, None)
+            options.append(encode_option(option_ia_na, struct.pack("!III", iaid, 0, 0) + encode_option(option_status_code, struct.pack("!H", 0) + b"Released")))
+            continue
+         if key not in self.leases:
+            self.leases[key] = ipaddress.IPv6Address(self.next_address)
+            self.next_address += 1
+         options.append(build_ia_na(iaid, self.leases[key], 1800, 2880, 3600, 7200))
+      response = build_message(self.response_types[message["message_type"]], message["transaction_id"], options)
+      for relay_header in reversed(relay_headers):
+         response = struct.pack("!B", dhcpv6_message_codes["RELAY-REPL"]) + relay_header + encode_option(option_relay_msg, response)
+      self.transport.sendto(response, sender)
+
+def setup_socket(ip_and_port, if_name):
+   dhcp_socket = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+   try:
+      if if_name:
+         dhcp_socket.setsockopt(socket.SOL_SOCKET, 25, bytes(if_name, 'ascii'))
+         dhcp_socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_IF, socket.if_nametoindex(if_name))
+      dhcp_socket.bind(ip_and_port)
+   except OSError as e:
+      logger.error("Setting up socket on '{}' (interface '{}') failed: {}".format(ip_and_port, if_name, e))
+      exit(exit_code_error)
+   return dhcp_socket
+
+async def run_clients(dhcp_socket, server, test, base_mac, clients, iaid=None, relay_address=None, fake_server=False):
+   """
+   Run the test for all clients concurrently.
+
+   Returns
+   -------
+   list
+      The clients, see `Dhcpv6Client`, and the number of successful clients.
+   """
+   loop = asyncio.get_running_loop()
+   if fake_server:
+      (server_transport, _) = await loop.create_datagram_endpoint(FakeDhcpv6Server, local_addr=server[:2])
+   # large receive buffer to not drop responses when running many clients
+   dhcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+   (transport, protocol) = await loop.create_datagram_endpoint(Dhcpv6Protocol, sock=dhcp_socket)
+   try:
+      dhcpv6_clients = []
+      for index in range(clients):
+         mac = (base_mac + index).to_bytes(6, "big")
+         client_iaid = iaid if iaid is not None else struct.unpack_from("!I", mac, 2)[0]
+         dhcpv6_clients.append(Dhcpv6Client(protocol, mac, client_iaid, server, relay_address, logger.info if clients == 1 else logger.debug))
+      results = await asyncio.gather(*[ client.run(test) for client in dhcpv6_clients ])
+   finally:
+      transport.close()
+      if fake_server:
+         server_transport.close()
+   return (dhcpv6_clients, results.count(True))
+
+# configuration file settings and their defaults
+config_schema = {
+   # path to log file
+   "log_file": { "type": str, "default": "/opt/qip/current/log/dhcpv6-probe.log" },
+
+   # timeout (in seconds)
+   "dhcp_timeout": { "type": (int, float), "default": 3, "min": 0 },
+
+   # number of retries
+   "dhcp_attempts": { "type": int, "default": 3, "min": 1 }
+}
+config = {}
+
+# override defaults based on environment
+if "QIPHOME" in os.environ:
+   config["log_file"] = os.path.join(os.environ["QIPHOME"],"log","dhcpv6-probe.log")
+
+# read config file if present
+script_dir = os.path.dirname(os.path.abspath(__file__))
+config_file = os.path.join(script_dir, "dhcpv6_probe.conf")
+try:
+   if os.path.exists(config_file):
+      config, config_json = toolkit.read_config(config_file, config)
+   config = toolkit.validate_config(config, config_schema)
+except (OSError, ValueError) as error:
+   print("Failed to read configuration {} : {} - {}".format(config_file, type(error).__name__, error))
+   exit(exit_code_error)
+
+# initialize logging
+logger = toolkit.Logger(log_file = config["log_file"], console_logging = True)
+logger.set_level("INFO")
+
+error_cnt = 0
+debug = 0
+
+arg_parser = argparse.ArgumentParser(description='4N DHCPv6-Probe', allow_abbrev=False, add_help=True)
+arg_parser.add_argument('-t', '--test', choices=['solicit', 'sarr', 'full-cycle'], default='solicit', help="Test mode to use")
+arg_parser.add_argument('-m', '--mac-address', default='4e:4e:4e:4e:00:00', help="MAC address to use for the DUID. Format is 11:22:33:aa:bb:cc, 44-55-66-dd-ee-ff or 123456abcdef")
+arg_parser.add_argument('-I', '--iaid', type=int, help="IAID to use")
+arg_parser.add_argument('-s', '--server-ip', help="Server IP Address (for unicasts)")
+arg_parser.add_argument('-R', '--relay-address', help="Fake DHCPv6 Relay link address (RELAY-FORW)")
+arg_parser.add_argument('-i', '--interface', help="Interface to use for sending/receiving packets")
+arg_parser.add_argument('-a', '--accepted-server', action='append', help="Use these server's (DUID) reponses only")
+arg_parser.add_argument('-n', '--clients', type=int, default=1, help="Number of clients to run the test for concurrently")
+arg_parser.add_argument('-X', '--fake-server', action='store_true', help="Start a local fake DHCPv6 Server")
+arg_parser.add_argument('-d', '--debug', action='count', help="Enable debugging, can be specified up to two times to increase level of details")
+args = arg_parser.parse_args()
+
+# handle command line args
+args_error = False
+
+# set up debugging
+if args.debug:
+   debug = args.debug
+   logger.set_level("DEBUG")
+   if debug > 2:
+      logger.set_level("TRACE")
+
+# format / check command line args
+match = re.search("^([a-fA-F0-9]{2}[:\-\.]?){5}[a-fA-F0-9]{2}$", args.mac_address)
+if not match:
+   logger.error("Invalid MAC address '{}', required format is 11:22:33:aa:bb:cc, 44-55-66-dd-ee-ff or 123456abcdef".format(args.mac_address))
+   exit(exit_code_error)
+base_mac = int(re.sub("[:\-\.]", "", args.mac_address), 16)
+
+if args.iaid is not None and not 0 <= args.iaid < 2**32:
+   logger.error("Invalid IAID '{}', must be between 0 and {}".format(args.iaid, 2**32 - 1))
+   args_error = True
+
+for address_arg in ("server_ip", "relay_address"):
+   if getattr(args, address_arg):
+      try:
+         ipaddress.IPv6Address(getattr(args, address_arg))
+      except ipaddress.AddressValueError:
+         logger.error("specified address '{}' is not a valid IPv6 Addresss".format(getattr(args, address_arg)))
+         args_error = True
+
+accepted_servers = []
+if args.accepted_server:
+   for duid in args.accepted_server:
+      try:
+         accepted_servers.append(bytes.fromhex(re.sub(":", "", duid)))
+      except ValueError:
+         logger.error("specified accepted server DUID '{}' is not a valid hex string".format(duid))
+         args_error = True
+
+if args.clients < 1 or base_mac + args.clients > 2**48:
+   logger.error("Cannot use {} clients starting with MAC {}".format(args.clients, args.mac_address))
+   args_error = True
+
+# check required options
+if args.relay_address and not args.server_ip and not args.fake_server:
+   logger.error("Option -R requires option '-s <server IP>'")
+   args_error = True
+
+if args.fake_server:
+   if args.relay_address:
+      logger.error("Option -X cannot be used with option '-R <link address>'")
+      args_error = True
+   if not args.server_ip:
+      args.server_ip = "::1"
+
+if not args.server_ip and not args.interface:
+   logger.error("Multicasts to {} require option '-i <interface name>'".format(all_dhcp_relay_agents_and_servers))
+   args_error = True
+
+# exit on error
+if args_error:
+   exit(exit_code_error)
+
+# set up DHCPv6 socket
+dhcp_server = (all_dhcp_relay_agents_and_servers, server_port, 0, socket.if_nametoindex(args.interface) if args.interface else 0)
+if args.server_ip:
+   dhcp_server = (args.server_ip, server_port, 0, 0)
+
+dhcp_client = ("::", client_port)
+if args.relay_address:
+   # relays receive RELAY-REPL messages on the server port
+   dhcp_client = ("::", server_port)
+
+logger.debug("Waiting for responses on {}".format(dhcp_client))
+dhcp_socket = setup_socket(dhcp_client, args.interface)
+
+# run tests
+logger.info("Sending SOLICIT to {} for {} client(s)".format(dhcp_server[0], args.clients))
+(dhcpv6_clients, successful) = asyncio.run(run_clients(dhcp_socket, dhcp_server, args.test, base_mac, args.clients, args.iaid, args.relay_address, args.fake_server))
+
+# summary for multiple clients
+if args.clients > 1:
+   logger.info("Completed test '{}' for {} of {} clients".format(args.test, successful, args.clients))
+   for message_type in ("SOLICIT", "REQUEST", "RENEW", "RELEASE"):
+      sent = sum(client.stats[message_type]["sent"] for client in dhcpv6_clients if message_type in client.stats)
+      if not sent:
+         continue
+      responses = sum(client.stats[message_type]["responses"] for client in dhcpv6_clients if message_type in client.stats)
+      histogram = toolkit.LatencyHistogram()
+      for client in dhcpv6_clients:
+         if message_type in client.stats:
+            histogram.merge(client.stats[message_type]["latency"])
+      line = "{:<8} : sent {}, responses {}".format(message_type, sent, responses)
+      if histogram.count:
+         line += ", latency (ms) p50 {:.2f} p90 {:.2f} p99 {:.2f} max {:.2f}".format(histogram.percentile(50) * 1000, histogram.percentile(90) * 1000, histogram.percentile(99) * 1000, histogram.max * 1000)
+      logger.info(line)
+
+# exit based on warnings/errors
+error_cnt = args.clients - successful
+if error_cnt > 0:
+   logger.error("DHCPv6 Probe did not complete successfully")
+if error_cnt > 1:
+   exit(exit_code_error)
+if error_cnt > 0:
+   exit(exit_code_warning)
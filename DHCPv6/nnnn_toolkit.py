@@ -56,12 +56,34 @@ import logging
 from logging.handlers import RotatingFileHandler
 from logging.handlers import SysLogHandler
 import json
+import copy
+import hashlib
+import glob
+import tarfile
+import importlib
+import concurrent.futures
 import psutil
 import configparser
 import sys
 import nnnn_stackoverflow as stackoverflow
 import time
-from threading import Timer
+import signal
+import socket
+import struct
+import ipaddress
+import bisect
+import calendar
+import csv
+import mmap
+import array
+import fnmatch
+import errno
+from threading import Timer, Thread
+# optional : batches of IP addresses are looked up with NumPy if installed (see AddressIndex)
+try:
+   import numpy
+except ImportError:
+   numpy = None
 
 try:
    import fcntl
@@ -312,7 +334,278 @@ def backup_directory(source,target):
 
    return 0
    
-def backup_daily(source,backup_base_dir=None):
+# name of the manifest file written into each incremental backup
+backup_manifest_name = ".backup_manifest.json"
+
+def _copy_and_hash(source_path, target_path, chunk_size=1024*1024):
+   """
+   Copy a file including its metadata and return the SHA-256 checksum of the content.
+   """
+   checksum = hashlib.sha256()
+   with open(source_path, "rb") as source_fh, open(target_path, "wb") as target_fh:
+      while True:
+         chunk = source_fh.read(chunk_size)
+         if not chunk:
+            break
+         checksum.update(chunk)
+         target_fh.write(chunk)
+   shutil.copystat(source_path, target_path, follow_symlinks=False)
+   return checksum.hexdigest()
+
+def _hash_file(path, chunk_size=1024*1024):
+   """
+   Return the SHA-256 checksum of a file's content.
+   """
+   checksum = hashlib.sha256()
+   with open(path, "rb") as fh:
+      while True:
+         chunk = fh.read(chunk_size)
+         if not chunk:
+            break
+         checksum.update(chunk)
+   return checksum.hexdigest()
+
+def read_backup_manifest(backup_dir):
+   """
+   Read the manifest of an incremental backup created by `backup_incremental`.
+
+   Parameters
+   ----------
+   backup_dir : str
+      The path of the backup directory.
+
+   Returns
+   -------
+   manifest : dict
+      Maps the relative path of each backed up file to a dict with "size",
+      "mtime_ns" and "sha256". Empty if there is no (valid) manifest.
+   """
+   manifest_path = os.path.join(backup_dir, backup_manifest_name)
+   try:
+      with open(manifest_path) as fh:
+         return json.load(fh)
+   except (OSError, ValueError):
+      return {}
+
+def backup_incremental(source, target, link_dest=None):
+   """
+   Backup complete directory, files that are unchanged compared to a previous backup
+   are hard linked instead of being copied (like rsync --link-dest).
+
+   A manifest (see `read_backup_manifest`) is written to `target` that records size,
+   modification time and SHA-256 checksum of each file. Checksums are only calculated
+   for files that actually had to be copied, checksums of unchanged files are taken
+   from the manifest of `link_dest`.
+
+   Parameters
+   ----------
+   source : str
+      The (absolute) path of the directory to be backed up.
+   target : str
+      The (absolute) path of the directory where the backed up files will be placed. Must already exist.
+   link_dest : str, optional
+      The (absolute) path of a previous backup created with `backup_incremental`.
+      If not specified or not present all files will be copied.
+
+   Returns
+   -------
+   int
+      0 if success, > 0 on error
+   """
+
+   # check paths
+   if not os.path.isdir(source):
+      logger.error("backup_incremental : source directory '{}' does not exist".format(source))
+      return 10
+   if not os.path.isdir(target):
+      logger.error("backup_incremental : target directory '{}' does not exist".format(target))
+      return 20
+   previous = {}
+   if link_dest and os.path.isdir(link_dest):
+      previous = read_backup_manifest(link_dest)
+   else:
+      link_dest = None
+
+   manifest = {}
+   counters = { "linked" : 0, "copied" : 0 }
+   try:
+      for (dir_path, dir_names, file_names) in os.walk(source):
+         rel_dir = os.path.relpath(dir_path, source)
+         target_dir = os.path.normpath(os.path.join(target, rel_dir))
+         if rel_dir != ".":
+            os.mkdir(target_dir)
+            shutil.copystat(dir_path, target_dir)
+         # os.walk does not descend into symlinked directories, recreate the links instead
+         for name in list(dir_names):
+            if os.path.islink(os.path.join(dir_path, name)):
+               dir_names.remove(name)
+               file_names.append(name)
+         for name in file_names:
+            source_path = os.path.join(dir_path, name)
+            target_path = os.path.join(target_dir, name)
+            rel_path = os.path.normpath(os.path.join(rel_dir, name))
+            if os.path.islink(source_path):
+               os.symlink(os.readlink(source_path), target_path)
+               continue
+            stat = os.stat(source_path)
+            entry = previous.get(rel_path)
+            # unchanged : hard link against previous generation
+            if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+               try:
+                  os.link(os.path.join(link_dest, rel_path), target_path)
+                  manifest[rel_path] = entry
+                  counters["linked"] += 1
+                  continue
+               except OSError as error:
+                  logger.debug("backup_incremental : cannot link {} ({}), copying instead".format(rel_path, error))
+            # new or changed : copy
+            checksum = _copy_and_hash(source_path, target_path)
+            manifest[rel_path] = { "size" : stat.st_size, "mtime_ns" : stat.st_mtime_ns, "sha256" : checksum }
+            counters["copied"] += 1
+      shutil.copystat(source, target)
+   except OSError as error:
+      logger.exception("backup_incremental : backing up {} to {} failed : {} - {}".format(source, target, type(error).__name__, error))
+      return 30
+
+   # write manifest
+   try:
+      with open(os.path.join(target, backup_manifest_name), "w") as fh:
+         json.dump(manifest, fh)
+   except OSError as error:
+      logger.exception("backup_incremental : writing manifest failed : {} - {}".format(type(error).__name__, error))
+      return 40
+
+   logger.debug("backup_incremental : {} files copied, {} files linked".format(counters["copied"], counters["linked"]))
+   return 0
+
+def verify_backup(backup_dir):
+   """
+   Verify an incremental backup created by `backup_incremental` against its manifest.
+
+   Parameters
+   ----------
+   backup_dir : str
+      The path of the backup directory.
+
+   Returns
+   -------
+   diff_messages : list of str
+      A list of printable descriptions of the problems that have been found,
+      empty if the backup is intact.
+   """
+   diff_messages = []
+   manifest = read_backup_manifest(backup_dir)
+   if not manifest:
+      diff_messages.append("No manifest found in {}".format(backup_dir))
+      return diff_messages
+   for rel_path in manifest:
+      path = os.path.join(backup_dir, rel_path)
+      if not os.path.isfile(path):
+         diff_messages.append("File missing: '{}'".format(rel_path))
+         continue
+      if os.path.getsize(path) != manifest[rel_path]["size"]:
+         diff_messages.append("File '{}' size is different: '{}' vs. '{}'".format(rel_path, os.path.getsize(path), manifest[rel_path]["size"]))
+         continue
+      checksum = _hash_file(path)
+      if checksum != manifest[rel_path]["sha256"]:
+         diff_messages.append("File '{}' checksum is different: '{}' vs. '{}'".format(rel_path, checksum, manifest[rel_path]["sha256"]))
+   return diff_messages
+
+def restore_backup(backup_dir, target, verify=True):
+   """
+   Restore an incremental backup created by `backup_incremental`.
+
+   Parameters
+   ----------
+   backup_dir : str
+      The path of the backup directory.
+   target : str
+      The directory to restore the files to. Will be created if it does not exist,
+      existing files will be overwritten.
+   verify : boolean, optional
+      Verify the backup using `verify_backup` before restoring it. Default is True.
+
+   Returns
+   -------
+   int
+      0 if success, > 0 on error
+   """
+   if verify:
+      diff_messages = verify_backup(backup_dir)
+      if diff_messages:
+         for message in diff_messages:
+            logger.error("restore_backup : {}".format(message))
+         return 10
+   try:
+      os.makedirs(target, 0o750, exist_ok=True)
+      for (dir_path, dir_names, file_names) in os.walk(backup_dir):
+         rel_dir = os.path.relpath(dir_path, backup_dir)
+         target_dir = os.path.normpath(os.path.join(target, rel_dir))
+         os.makedirs(target_dir, exist_ok=True)
+         for name in dir_names + file_names:
+            source_path = os.path.join(dir_path, name)
+            target_path = os.path.join(target_dir, name)
+            if rel_dir == "." and name == backup_manifest_name:
+               continue
+            if os.path.islink(source_path):
+               if os.path.lexists(target_path):
+                  os.unlink(target_path)
+               os.symlink(os.readlink(source_path), target_path)
+            elif os.path.isfile(source_path):
+               # never write through a hard link into the backup
+               if os.path.lexists(target_path):
+                  os.unlink(target_path)
+               shutil.copy2(source_path, target_path)
+         shutil.copystat(dir_path, target_dir)
+   except OSError as error:
+      logger.exception("restore_backup : restoring {} to {} failed : {} - {}".format(backup_dir, target, type(error).__name__, error))
+      return 20
+   return 0
+
+# directory within a backup base directory holding expired incremental backups until they are removed
+backup_trash_name = ".trash"
+
+def purge_backup_trash(backup_base_dir):
+   """
+   Remove the expired backups moved to the trash of `backup_base_dir` by `backup_daily` /
+   `backup_last_few`. Backups that cannot be removed stay in the trash for the next attempt.
+
+   Parameters
+   ----------
+   backup_base_dir : str
+      The backup base directory.
+
+   Returns
+   -------
+   int
+      The number of expired backups removed.
+   """
+   trash_dir = os.path.join(backup_base_dir, backup_trash_name)
+   removed = 0
+   try:
+      names = os.listdir(trash_dir)
+   except FileNotFoundError:
+      return removed
+   for name in names:
+      try:
+         shutil.rmtree(os.path.join(trash_dir, name))
+         removed += 1
+      except OSError as error:
+         logger.debug("purge_backup_trash : cannot remove {} : {} - {}".format(name, type(error).__name__, error))
+   return removed
+
+def _trash_backup(backup_dir, backup_base_dir):
+   """
+   Move an expired backup into the trash of `backup_base_dir`. This is a single rename, the files
+   (mostly hard links) are removed in a background thread, see `purge_backup_trash`. If the process
+   exits before, the remaining files are removed by the next backup.
+   """
+   trash_dir = os.path.join(backup_base_dir, backup_trash_name)
+   os.makedirs(trash_dir, 0o750, exist_ok=True)
+   os.rename(backup_dir, os.path.join(trash_dir, "{}.{}".format(os.path.basename(backup_dir), time.time_ns())))
+   Thread(target=purge_backup_trash, args=(backup_base_dir,), daemon=True).start()
+
+def backup_daily(source,backup_base_dir=None,incremental=False):
    """
    Backup files into a directory using the name of the current weekday.
    Do nothing if daily backup directory is present and has been modified less than 24h ago.
@@ -325,6 +618,10 @@ def backup_daily(source,backup_base_dir=None):
       The (absolute) path of the directory to back up.
    backup_base_dir : str, optional
       Path to the backup base directory where the numbered backup directories will be created.
+   incremental : boolean, optional
+      Use `backup_incremental` to hard link files that did not change since the most recent
+      daily backup instead of copying all files. An expired daily backup is moved to a trash
+      directory and removed in the background (see `purge_backup_trash`).
 
    Returns
    -------
@@ -353,7 +650,10 @@ def backup_daily(source,backup_base_dir=None):
       if (last_mod > 86000):
          logger.debug("backup_daily : Need to remove daily directory")
          try:
-            shutil.rmtree(backup_dir)
+            if incremental:
+               _trash_backup(backup_dir, backup_base_dir)
+            else:
+               shutil.rmtree(backup_dir)
          except Exception as error:
             logger.exception("backup_daily: Failed to delete directory {0} : {1} - {2}".format(backup_dir,type(error).__name__,error))
             return 20
@@ -367,7 +667,18 @@ def backup_daily(source,backup_base_dir=None):
    except Exception as error:
       logger.exception("backup_daily: Failed to create directory {0} : {1} - {2}".format(backup_dir,type(error).__name__,error))
       return 30
-   error = backup_directory(source, backup_dir)
+   if incremental:
+      # link against the most recent of the other daily backups
+      link_dest = None
+      for weekday_dir in os.listdir(backup_base_dir):
+         weekday_path = os.path.join(backup_base_dir, weekday_dir)
+         if weekday_path == backup_dir or not os.path.isfile(os.path.join(weekday_path, backup_manifest_name)):
+            continue
+         if not link_dest or os.stat(weekday_path).st_mtime > os.stat(link_dest).st_mtime:
+            link_dest = weekday_path
+      error = backup_incremental(source, backup_dir, link_dest)
+   else:
+      error = backup_directory(source, backup_dir)
    if error:
       logger.error("backup_daily: Backing up files failed with error code {0}".format(error))
       return 40
@@ -375,7 +686,7 @@ def backup_daily(source,backup_base_dir=None):
    # done
    return 0
 
-def backup_last_few(source,number_of_backups,backup_base_dir=None):
+def backup_last_few(source,number_of_backups,backup_base_dir=None,incremental=False):
    """
    Backup files into a directory to keep the results of the given number of previous generations.
 
@@ -391,6 +702,11 @@ def backup_last_few(source,number_of_backups,backup_base_dir=None):
       Number of backups to keep.
    backup_base_dir : str, optional
       Path to the backup base directory where the numbered backup directories will be created.
+   incremental : boolean, optional
+      Use `backup_incremental` to hard link files that did not change since the previous
+      backup instead of copying all files. The numbered directories are renamed and the
+      oldest one is moved to a trash directory and removed in the background (see
+      `purge_backup_trash`), so only the changed files are copied during the backup.
 
    Returns
    -------
@@ -417,7 +733,10 @@ def backup_last_few(source,number_of_backups,backup_base_dir=None):
       if number == number_of_backups:
          if os.path.exists(backup_dir):
             try:
-               shutil.rmtree(backup_dir)
+               if incremental:
+                  _trash_backup(backup_dir, backup_base_dir)
+               else:
+                  shutil.rmtree(backup_dir)
             except Exception as error:
                logger.exception("backup_last_few: Failed to delete directory {} : {} - {}".format(backup_dir,type(error).__name__,error))
                return 20
@@ -440,7 +759,10 @@ def backup_last_few(source,number_of_backups,backup_base_dir=None):
       return 40
 
    # finally create backup
-   error = backup_directory(source, backup_dir)
+   if incremental:
+      error = backup_incremental(source, backup_dir, backup_base_dir + "/2")
+   else:
+      error = backup_directory(source, backup_dir)
    if error:
       logger.error("backup_last_few: Backing up files failed with error code {}".format(error))
       return 50
@@ -448,7 +770,195 @@ def backup_last_few(source,number_of_backups,backup_base_dir=None):
    # done
    return 0
 
-def copy_files(file_list, target_dir):
+# compression supported by `copy_file`, maps name to (module name, file name suffix)
+copy_compressions = {
+   "gzip" : ("gzip", ".gz"),
+   "bz2" : ("bz2", ".bz2"),
+   "xz" : ("lzma", ".xz"),
+   "zstd" : ("compression.zstd", ".zst")
+}
+
+def _zero_copy(source_fh, target_fh, size):
+   """
+   Copy `size` bytes between two open files within the kernel using copy_file_range
+   or sendfile, falls back to a regular read/write loop if nothing could be copied
+   (e.g. file systems without support or files like /proc reporting a size of 0).
+   Raises OSError if the copy ends before `size` bytes have been copied.
+   """
+   source_fd = source_fh.fileno()
+   target_fd = target_fh.fileno()
+   copied = 0
+   for method in ("copy_file_range", "sendfile"):
+      if not hasattr(os, method):
+         continue
+      try:
+         while copied < size:
+            if method == "copy_file_range":
+               sent = os.copy_file_range(source_fd, target_fd, size - copied)
+            else:
+               sent = os.sendfile(target_fd, source_fd, None, size - copied)
+            if sent == 0:
+               break
+            copied += sent
+         if copied == size and size:
+            return copied
+         if copied:
+            raise OSError(errno.EIO, "Copy ended after {} of {} bytes, file truncated while copying?".format(copied, size))
+         logger.trace("_zero_copy : {} did not copy any data".format(method))
+      except OSError as error:
+         # e.g. EXDEV / EINVAL on older kernels or special file systems, try next method
+         if copied:
+            raise
+         logger.trace("_zero_copy : {} not usable : {}".format(method, error))
+   shutil.copyfileobj(source_fh, target_fh, 1024*1024)
+   return source_fh.tell()
+
+def copy_file(source_path, target_path, compress=None):
+   """
+   Copy a single file including its metadata (like "cp -a") without starting a process.
+
+   Uncompressed copies are done within the kernel (copy_file_range / sendfile) so
+   the data does not need to be copied into the Python process.
+
+   Parameters
+   ----------
+   source_path : str
+      The file to copy.
+   target_path : str
+      The path of the copy. If `compress` is used the compression suffix (e.g. ".gz")
+      will be appended.
+   compress : str, optional
+      Compress the copy, one of the keys of `copy_compressions` ("gzip", "bz2", "xz", "zstd").
+      "zstd" is only available if the Python version provides compression.zstd.
+
+   Returns
+   -------
+   int
+      The number of bytes read from `source_path`.
+
+   Raises
+   ------
+   ValueError
+      If an unsupported compression is specified.
+   OSError
+      If copying the file fails.
+   """
+   if compress:
+      if compress not in copy_compressions:
+         raise ValueError("Invalid compression '{}', must be one of {}".format(compress, list(copy_compressions)))
+      (module_name, suffix) = copy_compressions[compress]
+      try:
+         module = importlib.import_module(module_name)
+      except ImportError:
+         raise ValueError("Compression '{}' is not supported by this Python version".format(compress))
+      target_path += suffix
+      with open(source_path, "rb") as source_fh, module.open(target_path, "wb") as target_fh:
+         shutil.copyfileobj(source_fh, target_fh, 1024*1024)
+         size = source_fh.tell()
+   else:
+      with open(source_path, "rb") as source_fh, open(target_path, "wb") as target_fh:
+         size = _zero_copy(source_fh, target_fh, os.fstat(source_fh.fileno()).st_size)
+
+   # preserve metadata
+   shutil.copystat(source_path, target_path)
+   stat = os.stat(source_path)
+   try:
+      os.chown(target_path, stat.st_uid, stat.st_gid)
+   except PermissionError:
+      # only possible as root, "cp -a" silently ignores this, too
+      pass
+   return size
+
+def copy_files_native(file_list, target_dir, threads=4, compress=None, resume=False):
+   """
+   Copy a list of files to a specified directory in-process using a pool of threads,
+   see `copy_file`.
+
+   Parameters
+   ----------
+   file_list : list
+      A list of file or directory names that might include wildcards (see glob module).
+      Directories will be copied recursively.
+   target_dir : str
+      The target directory (must exist).
+   threads : int, optional
+      Number of files that are copied in parallel. Default is 4.
+   compress : str, optional
+      Compress the copies, see `copy_file`.
+   resume : boolean, optional
+      Skip files that already exist in the `target_dir` with the same size and modification time,
+      allows to continue an interrupted copy. Not used if `compress` is specified.
+
+   Returns
+   -------
+   stats : dict
+      The statistics of the copy with the following keys: "files", "skipped", "bytes",
+      "seconds", "bytes_per_second".
+
+   Raises
+   ------
+   FileNotFoundError
+      If specified target directory does not exist.
+   ValueError
+      If an unsupported compression is specified.
+   OSError
+      If copying files fails.
+   """
+
+   # basic check
+   if not os.path.isdir(target_dir):
+      raise FileNotFoundError("Specified target directory {} does not exist".format(target_dir))
+   if compress and compress not in copy_compressions:
+      raise ValueError("Invalid compression '{}', must be one of {}".format(compress, list(copy_compressions)))
+
+   # expand patterns and directories into list of (source, target) tuples
+   jobs = []
+   for file_pattern in file_list:
+      for path in sorted(glob.glob(file_pattern)):
+         path = os.path.normpath(path)
+         target_path = os.path.join(target_dir, os.path.basename(path))
+         if not os.path.isdir(path) or os.path.islink(path):
+            jobs.append((path, target_path))
+            continue
+         for (dir_path, dir_names, file_names) in os.walk(path):
+            target_sub_dir = os.path.join(target_path, os.path.relpath(dir_path, path))
+            os.makedirs(target_sub_dir, exist_ok=True)
+            for name in file_names:
+               jobs.append((os.path.join(dir_path, name), os.path.join(target_sub_dir, name)))
+
+   stats = { "files" : 0, "skipped" : 0, "bytes" : 0 }
+
+   def copy_job(job):
+      (source_path, target_path) = job
+      if os.path.islink(source_path):
+         if os.path.lexists(target_path):
+            os.unlink(target_path)
+         os.symlink(os.readlink(source_path), target_path)
+         return (0, False)
+      if resume and not compress and os.path.exists(target_path):
+         source_stat = os.stat(source_path)
+         target_stat = os.stat(target_path)
+         if source_stat.st_size == target_stat.st_size and source_stat.st_mtime_ns == target_stat.st_mtime_ns:
+            return (0, True)
+      return (copy_file(source_path, target_path, compress), False)
+
+   start_time = time.monotonic()
+   with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+      for (size, skipped) in executor.map(copy_job, jobs):
+         if skipped:
+            stats["skipped"] += 1
+         else:
+            stats["files"] += 1
+            stats["bytes"] += size
+   stats["seconds"] = time.monotonic() - start_time
+   if stats["seconds"] > 0:
+      stats["bytes_per_second"] = int(stats["bytes"] / stats["seconds"])
+   else:
+      stats["bytes_per_second"] = 0
+   logger.debug("copy_files_native : copied {} files ({} bytes, {} skipped) with {} bytes/s".format(stats["files"], stats["bytes"], stats["skipped"], stats["bytes_per_second"]))
+   return stats
+
+def copy_files(file_list, target_dir, native=False, **native_args):
    """
    Backup a list of files to a specified directory. Uses "cp -a" command.
 
@@ -459,6 +969,16 @@ def copy_files(file_list, target_dir):
       evaluated by the shell.
    target_dir : str
       The target directory (must exist).
+   native : boolean, optional
+      Copy the files in-process instead of using "cp -a", see `copy_files_native`.
+      Patterns are expanded using the glob module instead of the shell.
+   native_args : optional
+      Additional keyword arguments for `copy_files_native` (threads, compress, resume).
+
+   Returns
+   -------
+   stats : dict
+      The statistics returned by `copy_files_native` if `native` is set, `None` otherwise.
 
    Raises
    ------
@@ -468,6 +988,10 @@ def copy_files(file_list, target_dir):
       If copying files fails.
    """
 
+   # in-process copy
+   if native:
+      return copy_files_native(file_list, target_dir, **native_args)
+
    # basic check
    if not os.path.isdir(target_dir):
       raise FileNotFoundError("Specified target directory {} does not exist".format(target_dir))
@@ -482,13 +1006,168 @@ def copy_files(file_list, target_dir):
    if error:
       raise OSError("Copying files using '{} {}' failed with error code {} : {}".format(command, command_args, error, stderr))
 
-def save_logs(file_pattern, log_dir, tag = None):
+# tar modes used by `archive_files`, maps compression to (tarfile mode, file name suffix)
+archive_compressions = {
+   None : ("w", ".tar"),
+   "gzip" : ("w:gz", ".tar.gz"),
+   "bz2" : ("w:bz2", ".tar.bz2"),
+   "xz" : ("w:xz", ".tar.xz")
+}
+
+def parse_size(size):
+   """
+   Convert a size with an optional unit into bytes.
+
+   Parameters
+   ----------
+   size : int or str
+      A number and optionally a unit which can be one of (B)ytes, (K)ilobytes, (M)egabytes, (G)igabytes.
+      If no unit is specified bytes are assumed as the unit.
+      Valid examples are : 1024, "10K", "10M", "1G"
+
+   Returns
+   -------
+   int
+      The size in bytes.
+
+   Raises
+   ------
+   ValueError
+      If the size has an invalid format.
+   """
+   if isinstance(size, int):
+      return size
+   match = re.search("^([0-9]+)([BKMG]?)$", size)
+   if not match:
+      raise ValueError("Invalid size '{}', valid examples are 1024, 10K, 10M, 1G".format(size))
+   factors = { "" : 1, "B" : 1, "K" : 1024, "M" : 1024 * 1024, "G" : 1024 * 1024 * 1024 }
+   return int(match.group(1)) * factors[match.group(2)]
+
+def archive_files(file_list, archive_path, compress="gzip"):
+   """
+   Write a list of files into a (compressed) tar archive.
+
+   The files are streamed into the archive directly, no copies are staged on disk.
+   The archive is written to a temporary file first and linked to `archive_path` when
+   complete, so there will never be a partially written archive by the name of `archive_path`
+   and an existing archive is never overwritten.
+
+   Parameters
+   ----------
+   file_list : list of str
+      The files to add to the archive. They will be stored by their file name only.
+   archive_path : str
+      The path of the archive including the suffix (e.g. ".tar.gz").
+   compress : str, optional
+      The compression to use, one of the keys of `archive_compressions` ("gzip", "bz2", "xz"
+      or `None`). Default is "gzip".
+
+   Returns
+   -------
+   stats : dict
+      The statistics with the following keys: "files", "bytes" (uncompressed), "archive_bytes".
+
+   Raises
+   ------
+   ValueError
+      If an unsupported compression is specified.
+   FileExistsError
+      If `archive_path` already exists.
+   OSError
+      If writing the archive fails.
+   """
+   if compress not in archive_compressions:
+      raise ValueError("Invalid compression '{}', must be one of {}".format(compress, list(archive_compressions)))
+   (mode, suffix) = archive_compressions[compress]
+
+   stats = { "files" : 0, "bytes" : 0 }
+   tmp_archive_path = "{}.{}.tmp".format(archive_path, os.getpid())
+   try:
+      with tarfile.open(tmp_archive_path, mode) as archive:
+         for file_path in file_list:
+            try:
+               archive.add(file_path, arcname=os.path.basename(file_path), recursive=False)
+            except FileNotFoundError:
+               # log file has been rotated away in the meantime
+               logger.debug("archive_files : {} has disappeared, skipping it".format(file_path))
+               continue
+            stats["files"] += 1
+            stats["bytes"] += archive.getmember(os.path.basename(file_path)).size
+      # unlike rename, link fails if the archive exists
+      os.link(tmp_archive_path, archive_path)
+   finally:
+      if os.path.exists(tmp_archive_path):
+         os.unlink(tmp_archive_path)
+   stats["archive_bytes"] = os.path.getsize(archive_path)
+   return stats
+
+def prune_archives(archive_dir, prefix="save.", max_total_size=None, max_age=None):
+   """
+   Remove old archives created by `save_logs` so that the remaining archives
+   do not exceed a total size and a maximum age.
+
+   Only the archives themselves are checked (one stat per archive), their contents
+   are never read. The most recent archive is always kept.
+
+   Parameters
+   ----------
+   archive_dir : str
+      The directory that contains the archives.
+   prefix : str, optional
+      Only archives whose name is `prefix` followed by the timestamp (YYYYmmdd.HHMMSS) are
+      considered, e.g. "save.<tag>.". Default is "save." (archives without tag).
+   max_total_size : int or str, optional
+      The maximum total size of all archives, see `parse_size` for the format.
+   max_age : int, optional
+      The maximum age of an archive in seconds.
+
+   Returns
+   -------
+   removed : list of str
+      The paths of the archives that have been removed.
+   """
+   suffixes = tuple(archive_compressions[compress][1] for compress in archive_compressions)
+   # the timestamp must follow the prefix, so "save." does not match the archives of a tag
+   name_regex = re.compile(re.escape(prefix) + r"\d{8}\.\d{6}")
+   archives = []
+   with os.scandir(archive_dir) as entries:
+      for entry in entries:
+         if name_regex.match(entry.name) and entry.name.endswith(suffixes) and entry.is_file():
+            stat = entry.stat()
+            archives.append((stat.st_mtime, stat.st_size, entry.path))
+   # newest first
+   archives.sort(reverse=True)
+
+   if max_total_size is not None:
+      max_total_size = parse_size(max_total_size)
+   now = time.time()
+   removed = []
+   total_size = 0
+   for (index, (mtime, size, path)) in enumerate(archives):
+      total_size += size
+      if index == 0:
+         continue
+      too_big = max_total_size is not None and total_size > max_total_size
+      too_old = max_age is not None and now - mtime > max_age
+      if too_big or too_old:
+         logger.debug("prune_archives : removing {} (size {}, age {} seconds)".format(path, size, int(now - mtime)))
+         os.unlink(path)
+         removed.append(path)
+         total_size -= size
+   return removed
+
+def save_logs(file_pattern, log_dir, tag = None, native = False, archive = None, max_total_size = None, max_age = None, **native_args):
    """
    Backup the files in `log_dir` that match the specified `file_pattern`.
 
    Logs will be backed up to a sub-directory within the `log_dir` by the
    name of save[.<tag>].YYYYmmdd where `tag` will only be used if specified.
 
+   If `archive` is specified the logs will be written into a single archive
+   save[.<tag>].YYYYmmdd.HHMMSS[.<n>].tar[.<suffix>] instead (<n> is a counter if there
+   are multiple archives within a second) and older archives will be removed according
+   to `max_total_size` and `max_age` (see `prune_archives`).
+
    Parameters
    ----------
    file_pattern : str
@@ -497,25 +1176,50 @@ def save_logs(file_pattern, log_dir, tag = None):
       Path that contains the logs.
    tag : str, optional
       Will be used as part of the sub-directory that will be created
+   native : boolean, optional
+      Copy the files in-process, see `copy_files_native`.
+   archive : str, optional
+      Write a tar archive using this compression instead of copying files,
+      see `archive_files` ("gzip", "bz2", "xz" or "none").
+   max_total_size : int or str, optional
+      Only with `archive`: maximum total size of the archives of this `tag`.
+   max_age : int, optional
+      Only with `archive`: maximum age in seconds of the archives of this `tag`.
+   native_args : optional
+      Additional keyword arguments for `copy_files_native` (threads, compress, resume).
+
+   Returns
+   -------
+   stats : dict
+      The statistics returned by `archive_files` if `archive` is set, by `copy_files_native`
+      if `native` is set, `None` otherwise.
 
    Raises
    ------
+   ValueError
+      If an unsupported `archive` compression is specified.
    OSError
       In case directory cannot be created, log_dir does not exist
       or there is a permission problem.
    """
 
    # basic check
+   if archive and archive != "none" and archive not in archive_compressions:
+      raise ValueError("Invalid archive compression '{}', must be one of {}".format(archive, [ "none" ] + [ compress for compress in archive_compressions if compress ]))
    if not os.path.isdir(log_dir):
       raise FileNotFoundError("Specified log directory {} does not exist".format(log_dir))
 
    # get list of files to copy
    file_list = []
-   for file_name in os.listdir(log_dir):
-      if re.match(file_pattern, file_name):
-         file_path = os.path.join(log_dir,file_name)
-         if os.path.isfile(file_path):
-            file_list.append(file_path)
+   file_regex = re.compile(file_pattern)
+   archive_suffixes = tuple(archive_compressions[compress][1] for compress in archive_compressions)
+   with os.scandir(log_dir) as entries:
+      for entry in entries:
+         # never save previously created archives again
+         if entry.name.startswith("save.") and entry.name.endswith(archive_suffixes):
+            continue
+         if file_regex.match(entry.name) and entry.is_file():
+            file_list.append(entry.path)
 
    # create sub dir
    time_format = "%Y%m%d.%H%M%S"
@@ -525,78 +1229,417 @@ def save_logs(file_pattern, log_dir, tag = None):
    if tag:
       sub_dir += tag + "."
    sub_dir += timestamp
+
+   # write archive instead of sub dir
+   if archive:
+      if archive == "none":
+         archive = None
+      prefix = sub_dir[:-len(timestamp)]
+      suffix = archive_compressions[archive][1]
+      archive_path = os.path.join(log_dir, sub_dir + suffix)
+      counter = 0
+      while True:
+         try:
+            stats = archive_files(file_list, archive_path, archive)
+            break
+         except FileExistsError:
+            # another archive has been saved within the same second
+            counter += 1
+            archive_path = os.path.join(log_dir, "{}.{}{}".format(sub_dir, counter, suffix))
+      prune_archives(log_dir, prefix, max_total_size, max_age)
+      return stats
+
    target_dir = os.path.join(log_dir,sub_dir)
    os.mkdir(target_dir, mode = 0o750)
 
    # copy files
-   copy_files(file_list, target_dir)
+   if native:
+      # no pattern expansion required, avoid glob interpreting special characters
+      file_list = [ glob.escape(file_path) for file_path in file_list ]
+   return copy_files(file_list, target_dir, native, **native_args)
+
+# matches JSON strings (which need to be kept) and comments (which need to be removed)
+json_comment_regex = re.compile(r'"(?:\\.|[^"\\])*"|#[^\n]*')
 
-def read_config(config_file, existing_config=None):
+# parsed configuration files, see `read_config`
+config_cache = {}
+
+class LazyJson:
    """
-   Read/Parse a JSON based configuration file and return as dict & JSON content.
+   Formatted (indented) JSON text of some data that is only created when it is
+   actually used, e.g. printed or concatenated with a string.
+   """
+
+   def __init__(self, data):
+      """
+      Parameters
+      ----------
+      data : dict
+         The data to be converted to JSON.
+      """
+      self.data = data
+      self.__text = None
+
+   def __str__(self):
+      if self.__text is None:
+         self.__text = json.dumps(self.data, indent = 3)
+      return self.__text
+
+   def __repr__(self):
+      return str(self)
+
+   def __add__(self, other):
+      return str(self) + other
+
+   def __radd__(self, other):
+      return other + str(self)
+
+   def __eq__(self, other):
+      return str(self) == str(other)
+
+   def __hash__(self):
+      return hash(str(self))
+
+def strip_json_comments(text):
+   """
+   Remove comments starting with "#" from JSON text in a single pass.
+   A "#" within a JSON string is not treated as a comment.
+   Line breaks are kept so line numbers of JSON errors still match the original text.
 
    Parameters
    ----------
-   config_file : str
-      The (absolute) path to a configuration file in JSON syntax.
-   existing_config : dict, optional
-      An existing configuration that has been previously read which will be extended /
-      overwritten by the newly read configuration file.
+   text : str
+      JSON text with comments.
 
    Returns
    -------
+   str
+      JSON text without comments.
+   """
+   return json_comment_regex.sub(lambda match: match.group(0) if match.group(0)[0] == '"' else "", text)
+
+def validate_config(config, schema):
+   """
+   Validate a configuration against a declarative schema and add default values
+   for settings that are not present.
+
+   The schema maps each setting to a dict that may contain:
+      "type": the required type or tuple of types (e.g. `int` or `(int, float)`).
+      "default": the value to use if the setting is missing.
+      "required": True if the setting must be present (and has no default).
+      "choices": a list of allowed values.
+      "min" / "max": allowed range for numeric values.
+   `None` is always accepted as a value if it is the default.
+   Settings that are not in the schema are kept but reported as a warning.
+
+   Parameters
+   ----------
    config : dict
-      A dictionary representation of the configuration file contents.
-   config_json : str
-      The formatted (indented) JSON text from the configuration file.
+      The configuration to validate.
+   schema : dict
+      The schema as described above.
+
+   Returns
+   -------
+   config : dict
+      A copy of the configuration with defaults added.
 
    Raises
    ------
-   OSError 
-      If failure while opening/reading config file
-   json.JSONDecodeError
-      If failure to parse the JSON data
+   ValueError
+      If the configuration does not match the schema, the message lists all problems found.
+
+   Examples
+   --------
+   from nnnn_toolkit import validate_config
+   schema = {
+      "timeout" : { "type" : int, "default" : 3, "min" : 1 },
+      "mode" : { "type" : str, "choices" : [ "fast", "slow" ], "required" : True }
+   }
+   config = validate_config({ "mode" : "fast" }, schema)
+   """
+   new_config = dict(config)
+   errors = []
+   for key in schema:
+      rules = schema[key]
+      if key not in new_config:
+         if "default" in rules:
+            new_config[key] = copy.deepcopy(rules["default"])
+         elif rules.get("required"):
+            errors.append("'{}' is required".format(key))
+         continue
+      value = new_config[key]
+      if value is None and "default" in rules and rules["default"] is None:
+         continue
+      if "type" in rules:
+         # bool is a subclass of int but never a valid number
+         if not isinstance(value, rules["type"]) or (isinstance(value, bool) and rules["type"] in (int, float, (int, float))):
+            errors.append("'{}' has an invalid type {} : {}".format(key, type(value).__name__, value))
+            continue
+      if "choices" in rules and value not in rules["choices"]:
+         errors.append("'{}' must be one of {} : {}".format(key, rules["choices"], value))
+      if "min" in rules and value < rules["min"]:
+         errors.append("'{}' must be >= {} : {}".format(key, rules["min"], value))
+      if "max" in rules and value > rules["max"]:
+         errors.append("'{}' must be <= {} : {}".format(key, rules["max"], value))
+   for key in new_config:
+      if key not in schema:
+         logger.warning("validate_config : unknown setting '{}'".format(key))
+   if errors:
+      raise ValueError("Invalid configuration: {}".format("; ".join(errors)))
+   return new_config
+
+def read_config(config_file, existing_config=None, schema=None, use_cache=True):
+   """
+   Read/Parse a JSON based configuration file and return as dict & JSON content.
+
+   Comments start with "#" and end at the end of the line, "#" within strings is kept.
+   Parsed files are cached, the file is only parsed again if its modification time or
+   size has changed.
+
+   Parameters
+   ----------
+   config_file : str
+      The (absolute) path to a configuration file in JSON syntax.
+   existing_config : dict, optional
+      An existing configuration that has been previously read which will be extended /
+      overwritten by the newly read configuration file.
+   schema : dict, optional
+      Validate the resulting configuration and add defaults, see `validate_config`.
+   use_cache : boolean, optional
+      Re-use the result of a previous call for the same unchanged file. Default is True.
+
+   Returns
+   -------
+   config : dict
+      A dictionary representation of the configuration file contents.
+   config_json : LazyJson
+      The formatted (indented) JSON text from the configuration file, will only be
+      created when used as a string.
+
+   Raises
+   ------
+   OSError 
+      If failure while opening/reading config file
+   json.JSONDecodeError
+      If failure to parse the JSON data
+   ValueError
+      If the configuration does not match the `schema`.
    """
 
    # setup
-   config_json = ""
    if not existing_config:
       old_config = {}
    else:
       old_config = existing_config.copy()
 
-   # read configuration file
-   try:
+   # re-use cached config if file did not change
+   stat = os.stat(config_file)
+   cache_key = os.path.abspath(config_file)
+   cached = config_cache.get(cache_key)
+   if use_cache and cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+      logger.trace("read_config : using cached configuration for {}".format(config_file))
+      config = copy.deepcopy(cached[2])
+   else:
+      # read configuration file
       with open(config_file) as fd_config:
          config_json_tmp = fd_config.read()
-   except OSError as error:
-      raise
 
-   # remove comments & blank lines
-   config_json = ""
-   for line in config_json_tmp.split("\n"):
-      if re.search('^#|^\s+#|^$', line):
-         continue
-      line = re.sub('#.*', '', line)
-      config_json += line + "\n"
-   
-   # parse configuration file
-   try:
-      config = json.loads(config_json)
-   except json.JSONDecodeError as error:
-      raise
+      # remove comments & parse configuration file
+      config = json.loads(strip_json_comments(config_json_tmp))
+      if use_cache:
+         config_cache[cache_key] = (stat.st_mtime_ns, stat.st_size, copy.deepcopy(config))
 
    # merge configurations
    for key in config:
       old_config[key] = config[key]
    config = old_config
 
-   # format configuration for printing
-   config_json = json.dumps(config, indent = 3)
+   # validate
+   if schema:
+      config = validate_config(config, schema)
+
+   # format configuration for printing only when needed
+   config_json = LazyJson(config)
 
    return (config, config_json)
 
-def is_running(name_of_process):
+# cached result of the last /proc scan, see `are_running`
+process_cache = { "timestamp" : 0.0, "names" : None }
+# number of seconds a /proc scan result will be re-used
+process_cache_ttl = 1.0
+# /proc/<pid>/comm only contains the first 15 characters of a process name
+proc_comm_length = 15
+
+def pid_is_alive(pid, name_of_process=None):
+   """
+   Check if the process with the given `pid` exists (and optionally has the given name).
+
+   Parameters
+   ----------
+   pid : int
+      The process ID to check.
+   name_of_process : str, optional
+      If specified the process must also have this name, this avoids false positives
+      for PIDs that have been re-used by the OS.
+
+   Returns
+   -------
+   boolean
+      True if the process exists (and has the specified name), False if not.
+   """
+   try:
+      os.kill(pid, 0)
+   except ProcessLookupError:
+      return False
+   except PermissionError:
+      # process exists but is owned by a different user
+      pass
+   if not name_of_process:
+      return True
+   return get_process_name(pid) == name_of_process
+
+def get_process_name(pid):
+   """
+   Get the name of a process by reading /proc/<pid>/comm, falls back to
+   psutil if /proc is not available.
+
+   Long process names are truncated in /proc/<pid>/comm, in this case the name
+   is determined from the first argument of /proc/<pid>/cmdline.
+
+   Parameters
+   ----------
+   pid : int
+      The process ID.
+
+   Returns
+   -------
+   str
+      The name of the process or `None` if the process does not exist.
+   """
+   proc_dir = "/proc/{}".format(pid)
+   if not os.path.isdir("/proc/self"):
+      try:
+         return psutil.Process(pid).name()
+      except psutil.Error:
+         return None
+   try:
+      with open(proc_dir + "/comm", "rb") as fh:
+         name = fh.read().rstrip(b"\n").decode(errors="replace")
+      if len(name) >= proc_comm_length:
+         with open(proc_dir + "/cmdline", "rb") as fh:
+            argv0 = fh.read().split(b"\0", 1)[0].decode(errors="replace")
+         long_name = os.path.basename(argv0)
+         if long_name.startswith(name):
+            name = long_name
+   except OSError:
+      return None
+   return name
+
+def read_pid_file(pid_file):
+   """
+   Read the PID from a PID file as written by daemons like dhcpd or named.
+
+   Parameters
+   ----------
+   pid_file : str
+      The path to the PID file.
+
+   Returns
+   -------
+   int
+      The PID from the file or `None` if the file does not exist or is invalid.
+   """
+   try:
+      with open(pid_file) as fh:
+         return int(fh.readline().strip())
+   except (OSError, ValueError):
+      return None
+
+def _scan_process_names(max_age):
+   """
+   Get the names of all running processes from /proc/*/comm (or psutil if /proc
+   is not available). The result is cached for `max_age` seconds.
+   """
+   now = time.monotonic()
+   if process_cache["names"] is not None and now - process_cache["timestamp"] < max_age:
+      return process_cache["names"]
+
+   names = set()
+   if os.path.isdir("/proc/self"):
+      for entry in os.scandir("/proc"):
+         if not entry.name.isdigit():
+            continue
+         try:
+            with open("/proc/{}/comm".format(entry.name), "rb") as fh:
+               names.add(fh.read().rstrip(b"\n").decode(errors="replace"))
+         except OSError:
+            # process has ended in the meantime
+            continue
+   else:
+      for process in psutil.process_iter(["name"]):
+         names.add(process.info["name"])
+
+   process_cache["timestamp"] = now
+   process_cache["names"] = names
+   return names
+
+def are_running(names_of_processes, pid_files=None, max_age=None):
+   """
+   Check for multiple process names if there is a process by that name.
+
+   All names are checked using a single scan of /proc, PID files (if specified)
+   are checked first as this is much faster than scanning all processes.
+
+   Parameters
+   ----------
+   names_of_processes : list of str
+      Names of the processes to check.
+   pid_files : dict, optional
+      PID file to check per process name, e.g. { "named" : "/var/run/named/named.pid" }.
+      If the PID file references a running process of that name no scan is required.
+   max_age : float, optional
+      Number of seconds a previous scan result might be re-used, defaults to
+      `process_cache_ttl`. Use 0 to enforce a new scan.
+
+   Returns
+   -------
+   running : dict
+      Maps each process name to True if at least one process with that name is running,
+      False if not.
+
+   Examples
+   --------
+   from nnnn_toolkit import are_running
+   running = are_running([ "dhcpd", "named" ], pid_files={ "named" : "/var/run/named/named.pid" })
+   if not running["dhcpd"]:
+      print("dhcpd is not running")
+   """
+   if max_age is None:
+      max_age = process_cache_ttl
+   if not pid_files:
+      pid_files = {}
+
+   running = {}
+   remaining = []
+   for name in names_of_processes:
+      # fast path : PID file
+      if name in pid_files:
+         pid = read_pid_file(pid_files[name])
+         if pid and pid_is_alive(pid, name):
+            logger.trace("are_running : {} is running with pid {} (from {})".format(name, pid, pid_files[name]))
+            running[name] = True
+            continue
+      remaining.append(name)
+
+   if remaining:
+      names = _scan_process_names(max_age)
+      for name in remaining:
+         # compare the truncated name only as found in /proc/<pid>/comm
+         running[name] = name[:proc_comm_length] in names or name in names
+   return running
+
+def is_running(name_of_process, pid_file=None, max_age=None):
    """
    Check if there is a process with the specified name
 
@@ -604,6 +1647,10 @@ def is_running(name_of_process):
    ----------
    name_of_process : str
       Name of the process to check
+   pid_file : str, optional
+      PID file of the process, will be checked first to avoid scanning all processes.
+   max_age : float, optional
+      Number of seconds a previous process scan might be re-used, see `are_running`.
 
    Returns
    -------
@@ -616,10 +1663,10 @@ def is_running(name_of_process):
    if is_running("named"): 
       print("named is running")
    """
-   for process in psutil.process_iter():
-      if process.name() == name_of_process:
-         return True
-   return False
+   pid_files = None
+   if pid_file:
+      pid_files = { name_of_process : pid_file }
+   return are_running([ name_of_process ], pid_files=pid_files, max_age=max_age)[name_of_process]
 
 def get_list_item(my_list, primary_key, value):
    """
@@ -699,7 +1746,7 @@ def get_list_items(my_list, key, value):
    # done
    return item_list
 
-def diff_list(my_list, other_list, name="Item", primary_key=None, additional_keys=None, missing_only=False):
+def diff_list(my_list, other_list, name="Item", primary_key=None, additional_keys=None, missing_only=False, normalize=None):
    """
    Check which element (optionally identified by a key) from one list exists
    in another list.
@@ -725,6 +1772,11 @@ def diff_list(my_list, other_list, name="Item", primary_key=None, additional_key
    missing_only - boolean
       If `diff_messages` contain all messages about differences or only
       the ones about missing items.
+   normalize - function or dict, optional
+      Function that returns the value to compare for an item (lists without
+      `primary_key`) or dict with a function per additional key, e.g.
+      `{ "mac" : HardwareKey.parse }` so differently formatted MACs are the
+      same. The diff reports the values as they are in the lists.
 
    Returns
    -------
@@ -798,47 +1850,71 @@ def diff_list(my_list, other_list, name="Item", primary_key=None, additional_key
 
    logger.trace("diff_list: Comparing '{}', primary_key '{}', additional_keys '{}', missing_only {}".format(name, primary_key, keys, missing_only))
 
+   # functions to get the compared values
+   item_normalize = None
+   key_normalize = {}
+   if callable(normalize):
+      item_normalize = normalize
+   elif normalize:
+      key_normalize = normalize
+   if item_normalize and not primary_key:
+      other_list = [ item_normalize(other_item) for other_item in other_list ]
+
+   # index other_list (items or primary key values) so each lookup is a hash lookup instead of a scan,
+   # the first item wins for duplicate primary key values, unhashable values fall back to scanning
+   other_index = None
+   try:
+      if primary_key:
+         other_index = {}
+         for other_item in other_list:
+            other_index.setdefault(other_item[primary_key], other_item)
+      else:
+         other_index = set(other_list)
+   except TypeError:
+      other_index = None
+
    # iterate through lists
    for my_item in my_list:
       # standard list comparison
       if not primary_key:
-         if my_item in other_list:
+         my_value = item_normalize(my_item) if item_normalize else my_item
+         if my_value in (other_index if other_index is not None else other_list):
             if not missing_only:
                same.append(my_item)
          else:
             missing.append(my_item)
       # keys' value comparison
       else:
-         found = False
-         for other_item in other_list:
-            # compare primary key first
-            if my_item[primary_key] == other_item[primary_key]:
-               logger.trace("diff_list: primary key value '{}' matched : {}".format(primary_key, my_item[primary_key]))
-               found = True
-               different = False
-               # compare additional keys if required
-               if not missing_only:
-                  for key in keys:
-                     logger.trace("diff_list: checking additional key '{}'".format(key))
-                     # allow to compare optional additional keys which might not exist
-                     if key not in my_item:
-                        if key in other_item:
-                           different = True
-                           diff.append({ primary_key : my_item[primary_key], "diff" : key, "my_value" : "Not set", "other_value" : other_item[key] })
-                     elif key not in other_item:
-                        different = True
-                        diff.append({ primary_key : my_item[primary_key], "diff" : key, "my_value" : my_item[key], "other_value" : "Not set" })
-                     elif my_item[key] != other_item[key]:
+         # compare primary key first
+         other_item = None
+         if other_index is not None:
+            other_item = other_index.get(my_item[primary_key])
+         else:
+            other_item = get_list_item(other_list, primary_key, my_item[primary_key])
+         if other_item is not None:
+            logger.trace("diff_list: primary key value '{}' matched : {}".format(primary_key, my_item[primary_key]))
+            different = False
+            # compare additional keys if required
+            if not missing_only:
+               for key in keys:
+                  logger.trace("diff_list: checking additional key '{}'".format(key))
+                  # allow to compare optional additional keys which might not exist
+                  if key not in my_item:
+                     if key in other_item:
                         different = True
-                        diff.append({ primary_key : my_item[primary_key], "diff" : key, "my_value" : my_item[key], "other_value" : other_item[key] })
-               # no difference
-               if not different:
-                  if not missing_only:
-                     same.append(my_item[primary_key])
-               # done with this my_item
-               break
+                        diff.append({ primary_key : my_item[primary_key], "diff" : key, "my_value" : "Not set", "other_value" : other_item[key] })
+                  elif key not in other_item:
+                     different = True
+                     diff.append({ primary_key : my_item[primary_key], "diff" : key, "my_value" : my_item[key], "other_value" : "Not set" })
+                  elif my_item[key] != other_item[key] and (key not in key_normalize or key_normalize[key](my_item[key]) != key_normalize[key](other_item[key])):
+                     different = True
+                     diff.append({ primary_key : my_item[primary_key], "diff" : key, "my_value" : my_item[key], "other_value" : other_item[key] })
+            # no difference
+            if not different:
+               if not missing_only:
+                  same.append(my_item[primary_key])
          # missing
-         if not found:
+         else:
             missing.append(my_item[primary_key])
 
    # create diff messages
@@ -873,11 +1949,274 @@ def to_json(data):
    """
    return json.dumps(data, indent = 3)
 
+class LineReader():
+   """
+   Line by line access to a (large) text file without reading the whole file into memory : the file is
+   memory-mapped and lines are only decoded when they are used. Iterating over the reader streams the
+   lines, an index of line offsets is built on the first random access (see `get_line`, `get_block`).
+   Line numbers start at 1, a trailing "\\r" is removed like universal newlines would do.
+
+   Instead of a file, text that already is in memory (str or bytes, e.g. the output of a command) can
+   be used, which avoids creating a list of all lines.
+
+   Example
+   -------
+
+   use nnnn_toolkit as toolkit
+   with toolkit.LineReader("/opt/qip/current/dhcp/dhcpd.conf") as reader:
+      for line in reader:
+         ...
+      (start, end) = reader.get_block(1234)
+      print("\\n".join(reader.get_lines(start, end)))
+   """
+
+   def __init__(self, path=None, data=None, encoding="utf-8", errors="strict"):
+      """
+      Parameters
+      ----------
+      path : str, optional
+         The file to read.
+      data : str or bytes, optional
+         The text to read if no `path` is given.
+      encoding : str, optional
+         The encoding used to decode lines of files / bytes, default is "utf-8".
+      errors : str, optional
+         The error handling when decoding, see `bytes.decode`, default is "strict".
+
+      Raises
+      ------
+      OSError
+         If the file cannot be opened or mapped.
+      """
+      self.path = path
+      self.encoding = encoding
+      self.errors = errors
+      self.__offsets = None
+      self.__mmap = None
+      if path is not None:
+         with open(path, "rb") as fh:
+            # empty files cannot be mapped
+            if os.fstat(fh.fileno()).st_size:
+               self.__mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+         self.__buffer = self.__mmap if self.__mmap is not None else b""
+      else:
+         self.__buffer = data if data is not None else ""
+      self.__is_text = isinstance(self.__buffer, str)
+      self.__newline = "\n" if self.__is_text else b"\n"
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, exc_type, exc_value, traceback):
+      self.close()
+
+   def close(self):
+      """
+      Release the memory-mapping. The line index is kept, lines cannot be read anymore.
+      """
+      if self.__mmap is not None:
+         self.__mmap.close()
+         self.__mmap = None
+      self.__buffer = None
+
+   def __decode(self, start, end):
+      if end > start and self.__buffer[end - 1:end] in ("\r", b"\r"):
+         end -= 1
+      line = self.__buffer[start:end]
+      if self.__is_text:
+         return line
+      return line.decode(self.encoding, self.errors)
+
+   def __iter__(self):
+      # stream lines, does not need (or build) the index
+      buffer = self.__buffer
+      newline = self.__newline
+      size = len(buffer)
+      start = 0
+      while start < size:
+         end = buffer.find(newline, start)
+         if end < 0:
+            end = size
+         yield self.__decode(start, end)
+         start = end + 1
+
+   def __build_index(self):
+      # start offset of every line plus the end of the buffer
+      buffer = self.__buffer
+      newline = self.__newline
+      size = len(buffer)
+      offsets = array.array("Q", [ 0 ])
+      start = buffer.find(newline)
+      while start >= 0 and start + 1 < size:
+         offsets.append(start + 1)
+         start = buffer.find(newline, start + 1)
+      if size:
+         # end of the last line + 1, as if the last line ends with a newline
+         offsets.append(size if buffer[size - 1:size] == newline else size + 1)
+      self.__offsets = offsets
+
+   def __len__(self):
+      if self.__offsets is None:
+         self.__build_index()
+      return len(self.__offsets) - 1
+
+   def get_raw(self, line_number):
+      """
+      Get a line as `memoryview` of the file contents (without decoding, including a trailing "\\r").
+      Only available for files and bytes, not for str.
+
+      Raises
+      ------
+      IndexError
+         If the line does not exist.
+      """
+      if self.__offsets is None:
+         self.__build_index()
+      if not 0 < line_number < len(self.__offsets):
+         raise IndexError("LineReader : line {} does not exist".format(line_number))
+      start = self.__offsets[line_number - 1]
+      end = self.__offsets[line_number] - 1
+      return memoryview(self.__buffer)[start:end]
+
+   def get_line(self, line_number):
+      """
+      Get a single line (str).
+
+      Raises
+      ------
+      IndexError
+         If the line does not exist.
+      """
+      if self.__offsets is None:
+         self.__build_index()
+      if not 0 < line_number < len(self.__offsets):
+         raise IndexError("LineReader : line {} does not exist".format(line_number))
+      return self.__decode(self.__offsets[line_number - 1], self.__offsets[line_number] - 1)
+
+   def get_lines(self, first_line, last_line):
+      """
+      Get the lines `first_line` to `last_line` (inclusive) as list of str. Lines outside of the file are skipped.
+      """
+      return [ self.get_line(line_number) for line_number in range(max(first_line, 1), min(last_line, len(self)) + 1) ]
+
+   def get_line_number(self, offset):
+      """
+      Get the number of the line that contains the byte (or character for str) at `offset`.
+      """
+      if self.__offsets is None:
+         self.__build_index()
+      return max(bisect.bisect_right(self.__offsets, offset), 1)
+
+   def get_block(self, line_number):
+      """
+      Find the innermost block ("... {" up to the matching "}" with the same indentation) that contains the line,
+      e.g. to show the context of an error. A line that starts a block belongs to this block.
+
+      Returns
+      -------
+      (first_line, last_line)
+         The line numbers of the start and the end of the block, `(line_number, line_number)` if the line is not
+         within a block.
+      """
+      line = self.get_line(line_number)
+      indent = len(line) - len(line.lstrip())
+      first_line = line_number
+      if not line.rstrip().endswith("{"):
+         first_line = None
+         for other_line_number in range(line_number - 1, 0, -1):
+            other_line = self.get_line(other_line_number)
+            other_indent = len(other_line) - len(other_line.lstrip())
+            if other_line.strip() and other_indent < indent and other_line.rstrip().endswith("{"):
+               first_line = other_line_number
+               indent = other_indent
+               break
+         if first_line is None:
+            return (line_number, line_number)
+      for last_line in range(first_line + 1, len(self) + 1):
+         other_line = self.get_line(last_line)
+         if other_line.startswith("}", indent) and len(other_line) - len(other_line.lstrip()) == indent:
+            return (first_line, last_line)
+      return (first_line, len(self))
+
+# option line in policy files, see `iter_pcy`
+pcy_option_regex = re.compile(r"([^=:]*?)\s*[=:]\s*(.*)$")
+
+def iter_pcy(lines, inline_comments=False):
+   """
+   Read QIP policy files (e.g. qip.pcy, dhcpd.pcy) line by line in a single pass.
+
+   Yields one tuple per comment, section header or option:
+      (line_number, "comment", comment_text, None)
+      (line_number, "section", section_name, None)
+      (line_number, "option", option_name, option_value)
+   Options before the first section belong to the "DEFAULT" section, option names are
+   returned as found in the file. Lines indented deeper than an option line are
+   continuation lines, they are added to the option value separated by a newline.
+
+   Parameters
+   ----------
+   lines : iterable of str
+      The lines of the policy file, e.g. an open file.
+   inline_comments : boolean, optional
+      If True everything after ";" or "#" is a comment (dhcpd.pcy), otherwise only lines
+      starting with ";" or "#" are comments (qip.pcy). Default is False.
+
+   Raises
+   ------
+   SyntaxError
+      If a line is neither a comment, nor a section header nor an option.
+   """
+   pending = None
+   option_indent = 0
+   for (line_number, line) in enumerate(lines, start=1):
+      line = line.rstrip("\r\n")
+      stripped = line.strip()
+      comment = None
+      if stripped[:1] in ("#", ";"):
+         comment = stripped
+         stripped = ""
+      elif inline_comments:
+         index = min((i for i in (line.find("#"), line.find(";")) if i >= 0), default=-1)
+         if index >= 0:
+            comment = line[index:]
+            stripped = line[:index].strip()
+      if not stripped:
+         # empty line ends a (multi-line) value
+         if pending:
+            yield pending
+            pending = None
+         if comment:
+            yield (line_number, "comment", comment, None)
+         continue
+      indent = len(line) - len(line.lstrip())
+      # continuation line
+      if pending and indent > option_indent:
+         pending = (pending[0], "option", pending[2], pending[3] + "\n" + stripped)
+         continue
+      if pending:
+         yield pending
+         pending = None
+      option_indent = indent
+      if stripped[0] == "[" and stripped[-1] == "]":
+         yield (line_number, "section", stripped[1:-1], None)
+      else:
+         # first "=" or ":" separates option and value
+         match = pcy_option_regex.match(stripped)
+         if not match:
+            raise SyntaxError("Invalid line {} in policy file : '{}'".format(line_number, line))
+         pending = (line_number, "option", match.group(1), match.group(2))
+      if comment:
+         yield (line_number, "comment", comment, None)
+   if pending:
+      yield pending
+
 def read_qip_pcy(pcy_file):
    """
    Read qip.pcy file and return as dict.
 
-   Note: might raise additional exceptions (any exception that might be raised by configparser)
+   Option names are converted to lower case, options that appear multiple times in a section
+   are returned as a tuple of values. Each section also contains the options from the DEFAULT
+   section (i.e. options before the first section) unless overridden in the section.
 
    Parameters
    ----------
@@ -888,8 +2227,9 @@ def read_qip_pcy(pcy_file):
    -------
    config : dict
       A dictionary representation of the configuration file contents
-   config_json : str
-      The formatted (indented) JSON text representation of the configuration file
+   config_json : LazyJson
+      The formatted (indented) JSON text representation of the configuration file,
+      will only be created when used as a string.
 
    Raises
    ------
@@ -897,25 +2237,152 @@ def read_qip_pcy(pcy_file):
       If specified file does not exist
    OSError
       If failure while opening/reading config file
+   SyntaxError
+      If the file contains invalid lines.
    """
    
    # make sure specified file exists
    if not os.path.exists(pcy_file):
       raise FileNotFoundError("No such file {}".format(pcy_file))
 
-   # use ConfigParser that supports multiple options
-   config_parser = stackoverflow.ConfigParserMultiOpt()
-   config_parser.read(pcy_file)
+   # read sections & options
+   defaults = {}
+   sections = {}
+   section = defaults
+   with open(pcy_file) as fh:
+      for (line_number, item_type, name, value) in iter_pcy(fh):
+         if item_type == "section":
+            if name == "DEFAULT":
+               section = defaults
+            else:
+               section = sections.setdefault(name, {})
+         elif item_type == "option":
+            name = name.lower()
+            if name in section:
+               # duplicate option : collect values
+               if not isinstance(section[name], tuple):
+                  section[name] = (section[name],)
+               section[name] = section[name] + (value,)
+            else:
+               section[name] = value
+
+   # each section inherits the defaults
    config = {}
-   config["DEFAULT"] = config_parser.defaults()
-   for section in config_parser.sections():
-      config[section] = {}
-      for key in config_parser[section]:
-         config[section][key] = config_parser[section][key]
-   config_json = json.dumps(config, indent = 3)
+   config["DEFAULT"] = defaults
+   for name in sections:
+      config[name] = dict(sections[name])
+      for key in defaults:
+         if key not in config[name]:
+            config[name][key] = defaults[key]
+   config_json = LazyJson(config)
    return (config, config_json)
 
 
+class LatencyHistogram():
+   """
+   HDR style histogram for latencies : values are recorded in microseconds into log-linear buckets,
+   so percentiles have a relative error below 2 ** -(precision_bits - 1) regardless of the range of values.
+   Memory use only depends on the number of distinct buckets used, not on the number of values recorded.
+
+   Example
+   -------
+
+   use nnnn_toolkit as toolkit
+   histogram = toolkit.LatencyHistogram()
+   histogram.record(0.0123)
+   print(histogram.percentile(99))
+   """
+
+   def __init__(self, precision_bits=7):
+      self.precision_bits = precision_bits
+      self.counts = {}
+      self.count = 0
+      self.sum = 0.0
+      self.min = None
+      self.max = None
+
+   def __bucket(self, value):
+      shift = max(value.bit_length() - self.precision_bits, 0)
+      return (shift << self.precision_bits) + (value >> shift)
+
+   def __bucket_value(self, bucket):
+      # highest value in bucket
+      shift = bucket >> self.precision_bits
+      return (((bucket & ((1 << self.precision_bits) - 1)) + 1) << shift) - 1 if shift else bucket
+
+   def record(self, seconds, count=1):
+      """
+      Record a latency (in seconds), negative values (e.g. clock adjustments) are recorded as 0.
+      """
+      seconds = max(seconds, 0)
+      value = int(seconds * 1000000)
+      bucket = self.__bucket(value)
+      self.counts[bucket] = self.counts.get(bucket, 0) + count
+      self.count += count
+      self.sum += seconds * count
+      if self.min is None or seconds < self.min:
+         self.min = seconds
+      if self.max is None or seconds > self.max:
+         self.max = seconds
+
+   def merge(self, other):
+      """
+      Add all values recorded in another histogram (with the same precision).
+      """
+      if other.precision_bits != self.precision_bits:
+         raise ValueError("Cannot merge histograms with different precision ({} vs. {})".format(other.precision_bits, self.precision_bits))
+      for bucket in other.counts:
+         self.counts[bucket] = self.counts.get(bucket, 0) + other.counts[bucket]
+      self.count += other.count
+      self.sum += other.sum
+      for value in (other.min, other.max):
+         if value is not None:
+            if self.min is None or value < self.min:
+               self.min = value
+            if self.max is None or value > self.max:
+               self.max = value
+
+   def percentile(self, percent):
+      """
+      Get the latency (in seconds) below which `percent` percent of the recorded values are.
+      Returns `None` if no values have been recorded.
+      """
+      if not self.count:
+         return None
+      rank = max(int(percent / 100 * self.count + 0.5), 1)
+      seen = 0
+      for bucket in sorted(self.counts):
+         seen += self.counts[bucket]
+         if seen >= rank:
+            return min(self.__bucket_value(bucket) / 1000000, self.max)
+      return self.max
+
+   def to_dict(self):
+      """
+      Get the histogram as dict (e.g. to save it as JSON), see `from_dict`.
+      """
+      return {
+         "precision_bits": self.precision_bits,
+         "count": self.count,
+         "sum": self.sum,
+         "min": self.min,
+         "max": self.max,
+         "counts": { str(bucket): self.counts[bucket] for bucket in sorted(self.counts) }
+      }
+
+   @classmethod
+   def from_dict(cls, data):
+      """
+      Create a histogram from a dict created by `to_dict`.
+      """
+      histogram = cls(data["precision_bits"])
+      histogram.counts = { int(bucket): count for (bucket, count) in data["counts"].items() }
+      histogram.count = data["count"]
+      histogram.sum = data["sum"]
+      histogram.min = data["min"]
+      histogram.max = data["max"]
+      return histogram
+
 ##
 ## class Logger
 ##
@@ -1274,15 +2741,25 @@ class singleInstance():
    If an instance detects a lockfile and `max_runtime` is specified, the 
    new instance attempts to kill the already running instance of the script.
 
+   If `wait` is specified, a new instance does not give up but waits (blocking, without
+   polling) for the running instance to complete. Waiting instances are queued and will
+   run one after the other in the order they were started. With `coalesce` a new instance
+   exits immediately if another instance is already waiting, as the waiting instance
+   will do the same work anyway.
+
    Example
     -------
 
    use nnnn_toolkit as toolkit
    with toolkit.singleInstance(lock_file='/opt/qip/current/tmp/myscript.lock') as myscript:
       print("New instance started with pid", myscript.pid)
+
+   # wait up to 60 seconds for other instances, skip if one is already waiting
+   with toolkit.singleInstance(wait=60, coalesce=True) as myscript:
+      print("New instance started with pid", myscript.pid)
    """
 
-   def __init__(self, lock_file=None, max_runtime=None):
+   def __init__(self, lock_file=None, max_runtime=None, wait=None, coalesce=False):
       """
       Set up instance variables for later use.
    
@@ -1293,6 +2770,12 @@ class singleInstance():
          this instance of the script is already running.
       max_runtime : str, optional
          The maximum runtime allowed for another instance that is already running.
+         Not used if `wait` is specified.
+      wait : int, optional
+         The maximum number of seconds to wait for other instances to complete. Waiting
+         instances are served in FIFO order.
+      coalesce : boolean, optional
+         Only with `wait`: exit if another instance is already waiting.
       """
 
       # determine lockfile name automatically if not specified
@@ -1308,6 +2791,233 @@ class singleInstance():
       self.sleep_time = 3
       # pid of this instance
       self.pid = os.getpid()
+      # queueing
+      self.wait = wait
+      self.coalesce = coalesce
+      self.queue_dir = self.lock_file + ".queue"
+      self.ticket_fh = None
+      self.ticket_file = None
+
+   @staticmethod
+   def process_start_time(pid):
+      """
+      Get the start time of a process (from /proc via psutil).
+
+      Parameters
+      ----------
+      pid : int
+         The process ID.
+
+      Returns
+      -------
+      float
+         The start time of the process in seconds since the epoch or `None` if the
+         process does not exist.
+      """
+      try:
+         return psutil.Process(pid).create_time()
+      except (psutil.Error, ValueError):
+         return None
+
+   def __owner_info(self):
+      """
+      Text written to lock and ticket files : pid and process start time.
+      """
+      return "{} {}".format(self.pid, self.process_start_time(self.pid))
+
+   def __parse_owner_info(self, text):
+      """
+      Parse the contents of a lock or ticket file.
+
+      Returns
+      -------
+      pid : int
+         The pid of the owner or `None` if unknown.
+      start_time : float
+         The start time of the owner or `None` if unknown (e.g. lock file written by an older version).
+      alive : boolean
+         True if a process with that pid and start time exists.
+      """
+      fields = text.split()
+      try:
+         pid = int(fields[0])
+      except (IndexError, ValueError):
+         return (None, None, False)
+      start_time = None
+      if len(fields) > 1:
+         try:
+            start_time = float(fields[1])
+         except ValueError:
+            pass
+      actual_start_time = self.process_start_time(pid)
+      if actual_start_time is None:
+         return (pid, start_time, False)
+      # pid has been re-used by a different process
+      if start_time is not None and abs(actual_start_time - start_time) > 1:
+         return (pid, start_time, False)
+      return (pid, actual_start_time, True)
+
+   def __write_owner_info(self, fh):
+      fh.seek(0)
+      fh.truncate()
+      fh.write(self.__owner_info())
+      fh.flush()
+
+   def __lockf_wait(self, fh, deadline):
+      """
+      Exclusively lock `fh`, blocking until `deadline` (time.monotonic based) at most.
+      The timeout is implemented using an interval timer, so there is no polling.
+
+      Returns
+      -------
+      boolean
+         True if the lock has been acquired, False on timeout.
+      """
+      timeout = deadline - time.monotonic()
+      if timeout <= 0:
+         try:
+            fcntl.lockf(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+         except BlockingIOError:
+            return False
+
+      class LockTimeout(Exception):
+         pass
+      def on_alarm(signum, frame):
+         raise LockTimeout()
+
+      old_handler = signal.signal(signal.SIGALRM, on_alarm)
+      signal.setitimer(signal.ITIMER_REAL, timeout)
+      try:
+         fcntl.lockf(fh, fcntl.LOCK_EX)
+         return True
+      except LockTimeout:
+         return False
+      finally:
+         signal.setitimer(signal.ITIMER_REAL, 0)
+         signal.signal(signal.SIGALRM, old_handler)
+
+   def __waiting_tickets(self):
+      """
+      Get the tickets of all other instances in the queue sorted by their position.
+      Tickets of instances that no longer exist are removed.
+      """
+      tickets = []
+      for name in sorted(os.listdir(self.queue_dir)):
+         # skip the guard and tickets that are still being written
+         if name.startswith("."):
+            continue
+         path = os.path.join(self.queue_dir, name)
+         if path == self.ticket_file:
+            continue
+         try:
+            with open(path) as fh:
+               (pid, start_time, alive) = self.__parse_owner_info(fh.read())
+         except FileNotFoundError:
+            continue
+         if not alive:
+            logger.debug("singleInstance : removing stale ticket {}".format(name))
+            try:
+               os.unlink(path)
+            except FileNotFoundError:
+               pass
+            continue
+         tickets.append(path)
+      return tickets
+
+   def __leave_queue(self):
+      if self.ticket_fh:
+         try:
+            os.unlink(self.ticket_file)
+         except FileNotFoundError:
+            pass
+         # closing the file releases the lock and wakes up the next instance
+         self.ticket_fh.close()
+         self.ticket_fh = None
+
+   def __enter_queued(self):
+      """
+      Wait for other instances to complete in FIFO order, see `wait`.
+      """
+      deadline = time.monotonic() + self.wait
+      os.makedirs(self.queue_dir, 0o750, exist_ok=True)
+
+      # guard protects checking the queue & queueing / leaving the queue
+      guard_fh = open(os.path.join(self.queue_dir, ".guard"), "a+")
+      try:
+         if not self.__lockf_wait(guard_fh, deadline):
+            logger.error("Timeout while waiting for the queue of {}".format(self.lock_file))
+            exit(50)
+         if self.coalesce and self.__waiting_tickets():
+            logger.info("Another instance is already waiting, exiting")
+            exit()
+         # create and lock own ticket, name defines the position in the queue
+         # the ticket is written to a hidden file first and renamed, so other instances never see it empty
+         ticket_name = "{:020d}.{}".format(time.time_ns(), self.pid)
+         new_ticket_file = os.path.join(self.queue_dir, "." + ticket_name)
+         self.ticket_fh = open(new_ticket_file, "w")
+         fcntl.lockf(self.ticket_fh, fcntl.LOCK_EX)
+         self.__write_owner_info(self.ticket_fh)
+         self.ticket_file = os.path.join(self.queue_dir, ticket_name)
+         os.rename(new_ticket_file, self.ticket_file)
+      finally:
+         guard_fh.close()
+
+      # wait for all instances queued in front of this one
+      while True:
+         predecessors = [ ticket for ticket in self.__waiting_tickets() if ticket < self.ticket_file ]
+         if not predecessors:
+            break
+         # block on the ticket of the direct predecessor until it is done
+         logger.debug("singleInstance : waiting for {}".format(os.path.basename(predecessors[-1])))
+         try:
+            # lockf requires a file opened for writing
+            predecessor_fh = open(predecessors[-1], "a")
+         except FileNotFoundError:
+            continue
+         try:
+            if not self.__lockf_wait(predecessor_fh, deadline):
+               self.__leave_queue()
+               logger.error("Other instances are still running after waiting {} seconds".format(self.wait))
+               exit(50)
+         finally:
+            predecessor_fh.close()
+
+      # first in queue : wait for the running instance
+      while True:
+         try:
+            self.lock_file_fh = open(self.lock_file, "a+")
+         except OSError as error:
+            self.__leave_queue()
+            logger.error("Cannot access lock file: {} - {}".format(type(error).__name__,error))
+            exit(10)
+         self.lock_file_fh.seek(0)
+         (other_pid, other_start_time, alive) = self.__parse_owner_info(self.lock_file_fh.read())
+         if other_pid and not alive:
+            logger.info("Lock file references process {} which is not running anymore".format(other_pid))
+         if not self.__lockf_wait(self.lock_file_fh, deadline):
+            self.lock_file_fh.close()
+            self.__leave_queue()
+            logger.error("Other instance {} is still running after waiting {} seconds".format(other_pid, self.wait))
+            exit(50)
+         # the other instance might have removed the lock file in the meantime
+         try:
+            if os.stat(self.lock_file).st_ino == os.fstat(self.lock_file_fh.fileno()).st_ino:
+               break
+         except FileNotFoundError:
+            pass
+         self.lock_file_fh.close()
+
+      self.__write_owner_info(self.lock_file_fh)
+
+      # leave the queue, this wakes up the next instance
+      guard_fh = open(os.path.join(self.queue_dir, ".guard"), "a+")
+      try:
+         fcntl.lockf(guard_fh, fcntl.LOCK_EX)
+         self.__leave_queue()
+      finally:
+         guard_fh.close()
+      return self
 
    def __enter__(self):
       """
@@ -1315,7 +3025,11 @@ class singleInstance():
       If the lockfile is actually logged check runtime of previously started instance.
       If runtime exceeds (optionally) specified maximum runtime, try to stop the other
       instance and then lock the file.
+      If `wait` is specified, wait for the other instance instead.
       """
+      if self.wait is not None:
+         return self.__enter_queued()
+
       for my_try in range(1,self.max_tries + 1):
          try:
             # create lock file without overwriting it's content (if present)
@@ -1333,10 +3047,7 @@ class singleInstance():
             fcntl.lockf(self.lock_file_fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
 
             # successfully locked : write pid to lockfile
-            self.lock_file_fh.seek(0)
-            self.lock_file_fh.truncate()
-            self.lock_file_fh.write(str(self.pid))
-            self.lock_file_fh.flush()
+            self.__write_owner_info(self.lock_file_fh)
 
             # done
             return self
@@ -1344,7 +3055,7 @@ class singleInstance():
          except BlockingIOError:
             # failed to lock
             self.lock_file_fh.seek(0)
-            self.other_pid = self.lock_file_fh.read()
+            (self.other_pid, other_start_time, alive) = self.__parse_owner_info(self.lock_file_fh.read())
             if my_try <= 1:
                logger.info("Another instance is already running: {}".format(self.other_pid))
             else:
@@ -1355,10 +3066,15 @@ class singleInstance():
                exit(20)
 
             # determine how long other process has been running
-            lockfile_stat = os.stat(self.lock_file)
-            lockfile_create_time = lockfile_stat.st_ctime
-            current_time = time.mktime(time.localtime())
-            time_diff = current_time - lockfile_create_time
+            if alive:
+               # process start time is reliable, lock file timestamps might be changed by others
+               time_diff = time.time() - other_start_time
+            else:
+               # pid in lock file is stale, the lock is held by a process that inherited the lock file
+               lockfile_stat = os.stat(self.lock_file)
+               lockfile_create_time = lockfile_stat.st_ctime
+               current_time = time.mktime(time.localtime())
+               time_diff = current_time - lockfile_create_time
 
             if time_diff >= self.max_runtime:
                # running for too long : try to kill it
@@ -1390,18 +3106,425 @@ class singleInstance():
       Close lockfile and remove it.
       """
       # cleanup
-      self.lock_file_fh.close()
+      # remove the lock file before releasing the lock so no other instance locks the removed file
       os.unlink(self.lock_file)
+      self.lock_file_fh.close()
 
       # handle exception in with-block
       if exception_type:
          raise
 
 ##
-## DNS specific
+## Network specific
 ##
 
-class NamedConf:
+class Netlink():
+   """
+   Minimal rtnetlink client (Linux only) to manage and list interface addresses without
+   spawning `ip` processes.
+
+   Example
+   -------
+
+   use nnnn_toolkit as toolkit
+   with toolkit.Netlink() as netlink:
+      netlink.add_address("lo", "192.0.2.1", 32)
+      print(netlink.get_addresses(socket.AF_INET))
+      netlink.delete_address("lo", "192.0.2.1", 32)
+   """
+
+   # see linux/netlink.h, linux/rtnetlink.h and linux/if_addr.h
+   NETLINK_ROUTE = 0
+   NLMSG_ERROR = 2
+   NLMSG_DONE = 3
+   RTM_NEWADDR = 20
+   RTM_DELADDR = 21
+   RTM_GETADDR = 22
+   NLM_F_REQUEST = 0x001
+   NLM_F_ACK = 0x004
+   NLM_F_EXCL = 0x200
+   NLM_F_CREATE = 0x400
+   NLM_F_DUMP = 0x300
+   IFA_ADDRESS = 1
+   IFA_LOCAL = 2
+   IFA_LABEL = 3
+   RT_SCOPE_UNIVERSE = 0
+   RT_SCOPE_HOST = 254
+
+   # struct nlmsghdr, struct ifaddrmsg, struct rtattr
+   header_format = "=LHHLL"
+   header_size = struct.calcsize(header_format)
+   ifaddrmsg_format = "=BBBBL"
+   ifaddrmsg_size = struct.calcsize(ifaddrmsg_format)
+   rtattr_format = "=HH"
+   rtattr_size = struct.calcsize(rtattr_format)
+
+   def __init__(self):
+      self.sequence = 0
+      self.netlink_socket = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, self.NETLINK_ROUTE)
+      self.netlink_socket.bind((0, 0))
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, exception_type, exception_value, exception_traceback):
+      self.close()
+
+   def close(self):
+      self.netlink_socket.close()
+
+   @staticmethod
+   def __align(length):
+      return (length + 3) & ~3
+
+   def __attribute(self, attribute_type, data):
+      attribute = struct.pack(self.rtattr_format, self.rtattr_size + len(data), attribute_type) + data
+      return attribute + b"\0" * (self.__align(len(attribute)) - len(attribute))
+
+   def __request(self, message_type, flags, payload):
+      """
+      Send a request and return all response messages as (type, payload) until the request is done.
+      Raises OSError if the kernel reports an error.
+      """
+      self.sequence += 1
+      message = struct.pack(self.header_format, self.header_size + len(payload), message_type, flags, self.sequence, 0) + payload
+      self.netlink_socket.send(message)
+
+      messages = []
+      while True:
+         data = self.netlink_socket.recv(65536)
+         offset = 0
+         while offset + self.header_size <= len(data):
+            (length, response_type, response_flags, sequence, pid) = struct.unpack_from(self.header_format, data, offset)
+            response_payload = data[offset + self.header_size:offset + length]
+            offset += self.__align(length)
+            if sequence != self.sequence:
+               continue
+            if response_type == self.NLMSG_DONE:
+               return messages
+            if response_type == self.NLMSG_ERROR:
+               (error,) = struct.unpack_from("=i", response_payload)
+               if error:
+                  raise OSError(-error, os.strerror(-error))
+               # acknowledgement
+               return messages
+            messages.append((response_type, response_payload))
+
+   def __address_request(self, message_type, flags, if_name, ip, prefix_len):
+      ip = ipaddress.ip_address(ip)
+      family = socket.AF_INET if ip.version == 4 else socket.AF_INET6
+      scope = self.RT_SCOPE_HOST if ip.is_loopback else self.RT_SCOPE_UNIVERSE
+      payload = struct.pack(self.ifaddrmsg_format, family, prefix_len, 0, scope, socket.if_nametoindex(if_name))
+      payload += self.__attribute(self.IFA_LOCAL, ip.packed) + self.__attribute(self.IFA_ADDRESS, ip.packed)
+      self.__request(message_type, flags, payload)
+
+   def add_address(self, if_name, ip, prefix_len):
+      """
+      Add an IP address to an interface (like `ip address add <ip>/<prefix_len> dev <if_name>`).
+
+      Raises
+      ------
+      OSError
+         If the address cannot be added, e.g. because it already exists.
+      """
+      self.__address_request(self.RTM_NEWADDR, self.NLM_F_REQUEST | self.NLM_F_ACK | self.NLM_F_CREATE | self.NLM_F_EXCL, if_name, ip, prefix_len)
+
+   def delete_address(self, if_name, ip, prefix_len):
+      """
+      Remove an IP address from an interface (like `ip address delete <ip>/<prefix_len> dev <if_name>`).
+
+      Raises
+      ------
+      OSError
+         If the address cannot be removed, e.g. because it does not exist.
+      """
+      self.__address_request(self.RTM_DELADDR, self.NLM_F_REQUEST | self.NLM_F_ACK, if_name, ip, prefix_len)
+
+   def get_addresses(self, family=socket.AF_UNSPEC):
+      """
+      List the IP addresses of all interfaces.
+
+      Parameters
+      ----------
+      family : int, optional
+         Only list addresses of this family (socket.AF_INET or socket.AF_INET6).
+
+      Returns
+      -------
+      dict
+         List of IPv4Interface / IPv6Interface objects (address with prefix length) per interface name.
+      """
+      interface_names = dict(socket.if_nameindex())
+      payload = struct.pack(self.ifaddrmsg_format, family, 0, 0, 0, 0)
+      addresses = {}
+      for (message_type, message) in self.__request(self.RTM_GETADDR, self.NLM_F_REQUEST | self.NLM_F_DUMP, payload):
+         if message_type != self.RTM_NEWADDR:
+            continue
+         (address_family, prefix_len, flags, scope, index) = struct.unpack_from(self.ifaddrmsg_format, message)
+         attributes = {}
+         offset = self.ifaddrmsg_size
+         while offset + self.rtattr_size <= len(message):
+            (length, attribute_type) = struct.unpack_from(self.rtattr_format, message, offset)
+            attributes[attribute_type] = message[offset + self.rtattr_size:offset + length]
+            offset += self.__align(length)
+         # IFA_LOCAL is the local address on point-to-point interfaces
+         address = attributes.get(self.IFA_LOCAL, attributes.get(self.IFA_ADDRESS))
+         if not address:
+            continue
+         if_name = interface_names.get(index, str(index))
+         if if_name not in addresses:
+            addresses[if_name] = []
+         addresses[if_name].append(ipaddress.ip_interface((address, prefix_len)))
+      return addresses
+
+_uint32_typecode = "I" if array.array("I").itemsize == 4 else "L"
+
+def _ip_to_int(ip, version=None):
+   # (version, integer) of an IP address (str, ipaddress object or int of `version`)
+   if isinstance(ip, int):
+      return (version or 4, ip)
+   if isinstance(ip, str):
+      try:
+         if ":" in ip:
+            return (6, int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), "big"))
+         return (4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big"))
+      except OSError:
+         raise ValueError("'{}' does not appear to be an IPv4 or IPv6 address".format(ip)) from None
+   return (ip.version, int(ip))
+
+def parse_ips(ips, version=4):
+   """
+   Parse a column of IP addresses of one IP version to integers.
+
+   Parameters
+   ----------
+   ips : iterable of str or ipaddress objects
+      The IP addresses.
+   version : int, optional
+      The IP version of the addresses, 4 (default) or 6.
+
+   Returns
+   -------
+   numpy.ndarray, array.array or list
+      With NumPy : an array of uint32 (IPv4) or of Python integers (IPv6, NumPy has no 128 bit integers).
+      Without NumPy : an array of unsigned 32 bit integers (IPv4) or a list of int (IPv6).
+
+   Raises
+   ------
+   ValueError
+      If an address is invalid or of the other IP version.
+   """
+   (family, size) = (socket.AF_INET, 4) if version == 4 else (socket.AF_INET6, 16)
+   # the addresses are read twice if the fast path fails
+   if not isinstance(ips, (list, tuple, array.array)):
+      ips = list(ips)
+   try:
+      packed = b"".join([ socket.inet_pton(family, ip) for ip in ips ])
+   except (OSError, TypeError):
+      # ipaddress objects or invalid addresses : ipaddress reports which address is invalid
+      packed = []
+      for ip in ips:
+         address = ipaddress.ip_address(ip)
+         if address.version != version:
+            raise ValueError("'{}' is not an IPv{} address".format(ip, version))
+         packed.append(address.packed)
+      packed = b"".join(packed)
+   if version == 4:
+      if numpy is not None:
+         return numpy.frombuffer(packed, dtype=">u4").astype(numpy.uint32)
+      values = array.array(_uint32_typecode)
+      values.frombytes(packed)
+      if sys.byteorder == "little":
+         values.byteswap()
+      return values
+   values = [ int.from_bytes(packed[offset:offset + size], "big") for offset in range(0, len(packed), size) ]
+   if numpy is not None:
+      return numpy.array(values, dtype=object)
+   return values
+
+class AddressIndex():
+   """
+   Index of IPv4 / IPv6 address intervals (networks or ranges) to find the interval containing an address.
+
+   Intervals are kept as integers sorted by start address per IP version and found by binary search,
+   batches of addresses (`find_many`, `lookup_many`, `contains_many`) with numpy.searchsorted if NumPy is
+   installed. Intervals are expected to be nested or disjoint (as networks are), the innermost interval
+   containing an address is found.
+
+   Example
+   -------
+
+   use nnnn_toolkit as toolkit
+   index = toolkit.AddressIndex([ "10.1.0.0/16", "10.1.2.0/24", ("10.2.0.10", "10.2.0.99") ])
+   index.lookup("10.1.2.3")
+   index.contains_many([ "10.1.2.3", "10.3.0.1" ])
+   """
+
+   def __init__(self, intervals, items=None):
+      """
+      Parameters
+      ----------
+      intervals : iterable
+         Networks (ipaddress network or interface objects, str such as "10.1.0.0/24" or
+         "10.1.0.0/255.255.255.0") or ranges as tuple of start and end address.
+      items : list, optional
+         The objects returned by `lookup` / `lookup_many` for the intervals, defaults to the position
+         of the interval in `intervals`.
+
+      Raises
+      ------
+      ValueError
+         If an interval is invalid.
+      """
+      entries = { 4 : [], 6 : [] }
+      for (position, interval) in enumerate(intervals):
+         (version, start, end) = self.__interval(interval)
+         entries[version].append((start, -end, position))
+      self.items = list(items) if items is not None else None
+      # per IP version : sorted starts / ends, the enclosing interval and the position in `intervals`
+      self.__starts = {}
+      self.__ends = {}
+      self.__parents = {}
+      self.__positions = {}
+      self.__arrays = {}
+      for (version, version_entries) in entries.items():
+         version_entries.sort()
+         (starts, ends, parents, positions) = ([], [], [], [])
+         stack = []
+         for (start, end, position) in version_entries:
+            end = -end
+            while stack and ends[stack[-1]] < start:
+               stack.pop()
+            parent = -1
+            for other in reversed(stack):
+               if ends[other] >= end:
+                  parent = other
+                  break
+            stack.append(len(starts))
+            starts.append(start)
+            ends.append(end)
+            parents.append(parent)
+            positions.append(position)
+         self.__starts[version] = starts
+         self.__ends[version] = ends
+         self.__parents[version] = parents
+         self.__positions[version] = positions
+
+   def __interval(self, interval):
+      if isinstance(interval, tuple):
+         (start, end) = (ipaddress.ip_address(interval[0]), ipaddress.ip_address(interval[1]))
+         if start.version != end.version or start > end:
+            raise ValueError("AddressIndex : invalid range {} - {}".format(interval[0], interval[1]))
+         return (start.version, int(start), int(end))
+      if isinstance(interval, (ipaddress.IPv4Interface, ipaddress.IPv6Interface)):
+         network = interval.network
+      elif isinstance(interval, (ipaddress.IPv4Network, ipaddress.IPv6Network)):
+         network = interval
+      else:
+         network = ipaddress.ip_network(interval, strict=False)
+      return (network.version, int(network.network_address), int(network.broadcast_address))
+
+   def __len__(self):
+      return len(self.__starts[4]) + len(self.__starts[6])
+
+   def __item(self, position):
+      if position < 0:
+         return None
+      return self.items[position] if self.items is not None else position
+
+   def find(self, ip, version=None):
+      """
+      Get the position (in `intervals`) of the innermost interval containing an IP address (str,
+      ipaddress object or int of IP `version`, default 4), -1 if there is none.
+      """
+      (version, value) = _ip_to_int(ip, version)
+      (starts, ends, parents) = (self.__starts[version], self.__ends[version], self.__parents[version])
+      index = bisect.bisect_right(starts, value) - 1
+      while index >= 0 and ends[index] < value:
+         index = parents[index]
+      return self.__positions[version][index] if index >= 0 else -1
+
+   def lookup(self, ip, version=None):
+      """
+      Get the item of the innermost interval containing an IP address or `None`, see `find`.
+      """
+      return self.__item(self.find(ip, version))
+
+   def find_many(self, ips, version=4):
+      """
+      Get the positions of the innermost intervals containing the IP addresses, see `find`.
+
+      Parameters
+      ----------
+      ips : iterable
+         IP addresses of one IP version (str or ipaddress objects) or their integers as returned by `parse_ips`.
+      version : int, optional
+         The IP version of the addresses, 4 (default) or 6.
+
+      Returns
+      -------
+      numpy.ndarray or list of int
+         The positions, -1 for addresses not in any interval.
+      """
+      ips = self.__values(ips, version)
+      (starts, ends, parents, positions) = (self.__starts[version], self.__ends[version], self.__parents[version], self.__positions[version])
+      if numpy is None:
+         found = []
+         for value in ips:
+            index = bisect.bisect_right(starts, value) - 1
+            while index >= 0 and ends[index] < value:
+               index = parents[index]
+            found.append(positions[index] if index >= 0 else -1)
+         return found
+      if not starts:
+         return numpy.full(len(ips), -1, dtype=numpy.int64)
+      if version not in self.__arrays:
+         dtype = numpy.uint32 if version == 4 else object
+         self.__arrays[version] = (numpy.array(starts, dtype=dtype), numpy.array(ends, dtype=dtype),
+                                   numpy.array(parents, dtype=numpy.int64), numpy.array(positions, dtype=numpy.int64))
+      (starts, ends, parents, positions) = self.__arrays[version]
+      indexes = numpy.searchsorted(starts, ips, side="right").astype(numpy.int64) - 1
+      # walk up to the enclosing intervals while the interval found ends before the address
+      outside = (indexes >= 0) & (ends[numpy.maximum(indexes, 0)] < ips)
+      while outside.any():
+         indexes[outside] = parents[indexes[outside]]
+         outside = (indexes >= 0) & (ends[numpy.maximum(indexes, 0)] < ips)
+      return numpy.where(indexes >= 0, positions[numpy.maximum(indexes, 0)], -1)
+
+   def __values(self, ips, version):
+      # integers (as returned by `parse_ips`) are used as they are, addresses are parsed
+      if isinstance(ips, array.array) or (numpy is not None and isinstance(ips, numpy.ndarray)):
+         return ips
+      ips = list(ips)
+      if ips and isinstance(ips[0], int):
+         return numpy.array(ips, dtype=numpy.uint32 if version == 4 else object) if numpy is not None else ips
+      return parse_ips(ips, version)
+
+   def lookup_many(self, ips, version=4):
+      """
+      Get the items of the innermost intervals containing the IP addresses (`None` if not in any
+      interval), see `find_many`.
+      """
+      return [ self.__item(int(position)) for position in self.find_many(ips, version) ]
+
+   def contains_many(self, ips, version=4):
+      """
+      Check which IP addresses are within any interval, see `find_many`.
+
+      Returns
+      -------
+      numpy.ndarray or list of boolean
+      """
+      positions = self.find_many(ips, version)
+      if numpy is not None:
+         return positions >= 0
+      return [ position >= 0 for position in positions ]
+
+##
+## DNS specific
+##
+
+class NamedConf:
    """
    Provides easy access to (selected) named.conf contents.
    Note: Currently limited to the elements of the configuration that the 4N userexits require to work.
@@ -1409,7 +3532,10 @@ class NamedConf:
 
    ### TODO: handle exclusions in ACLs
 
-   def __init__(self, named_conf_dir, file_name="named.conf", change_dir=None):
+   # where to look for named-checkconf / named-checkzone
+   bin_dirs = ('/opt/qip/current/usr/bin', '/opt/qip/usr/bin')
+
+   def __init__(self, named_conf_dir, file_name="named.conf", change_dir=None, bin_dirs=None):
       """
       Read and parse named.conf to be able to provide easy access to configuration elements or the whole configuration.
       Note that to make parsing easier named-checkconf -p is called first.
@@ -1423,6 +3549,9 @@ class NamedConf:
          The name of the named configuration file to be read, defaults to named.conf.
       change_dir: str, optional
          The directory to change to before checking named.conf (see named-checkconf -X).
+      bin_dirs: tuple of str, optional
+         The directories to look for named-checkconf / named-checkzone in, defaults to `NamedConf.bin_dirs`
+         (the QIP installation).
 
       Raises
       ------
@@ -1432,15 +3561,10 @@ class NamedConf:
          In case unsupported syntax is detected, e.g. zone's file with absolute path.
       """
    
-      check_conf = 'named-checkconf'
-      found = False
-      bin_dirs = ('/opt/qip/current/usr/bin', '/opt/qip/usr/bin')
-      for bin_dir in bin_dirs:
-         check_conf_path = os.path.join(bin_dir,check_conf)
-         if os.path.exists(check_conf_path):
-            found = True
-            break
-      if not found:
+      if bin_dirs:
+         self.bin_dirs = tuple(bin_dirs)
+      check_conf_path = self.__find_tool('named-checkconf')
+      if not check_conf_path:
             raise SystemError("NamedConf: cannot determine path to named-checkconf")
       named_conf_path = os.path.join(named_conf_dir,file_name)
       if not change_dir:
@@ -1485,7 +3609,7 @@ class NamedConf:
       counters["zones"] = 0
       counters["acls"] = 0
    
-      lines = stdout.split("\n")
+      lines = LineReader(data=stdout)
       for line in lines:
          line_cnt += 1
          #print("XXX " + str(line_cnt) + " - '" + line + "'")
@@ -1721,6 +3845,14 @@ class NamedConf:
       # save result for further use
       self.__named_conf = named_conf
 
+   def __find_tool(self, tool):
+      # first match in bin_dirs
+      for bin_dir in self.bin_dirs:
+         tool_path = os.path.join(bin_dir, tool)
+         if os.path.exists(tool_path):
+            return tool_path
+      return None
+
    def get_config_raw(self):
       """
       Provide normalized named.conf text as created by named-checkconf -p
@@ -2373,15 +4505,8 @@ class NamedConf:
 
       """
 
-      check_zone = 'named-checkzone'
-      found = False
-      bin_dirs = ('/opt/qip/current/usr/bin', '/opt/qip/usr/bin')
-      for bin_dir in bin_dirs:
-         check_zone_path = os.path.join(bin_dir,check_zone)
-         if os.path.exists(check_zone_path):
-            found = True
-            break
-      if not found:
+      check_zone_path = self.__find_tool('named-checkzone')
+      if not check_zone_path:
             raise SystemError("get_records: cannot determine path to named-checkzone")
 
       zone = self.get_zone(view_name, zone_name)
@@ -2404,30 +4529,246 @@ class NamedConf:
       # read normalized file
       records = {}
 
-      with open(zone_file_path_tmp) as fh:
-         text = fh.read()
-      os.remove(zone_file_path_tmp)
-
-      for line in text.split("\n"):
-         if line == "":
-            continue
-         (rr_owner,rr_ttl,rr_class,rr_type,rr_rdata) = re.split("\s+", line, maxsplit=4)
-         rr_owner = re.sub("\.$", "", rr_owner)
-         rr_rdata = re.sub("\.$", "", rr_rdata)
-         if rr_owner not in records:
-            records[rr_owner] = {}
-         if rr_type not in records[rr_owner]:
-            records[rr_owner][rr_type] = { "ttl": rr_ttl, "rdata": [ rr_rdata ] }
-         else:
-            records[rr_owner][rr_type]["rdata"].append(rr_rdata)
+      with LineReader(zone_file_path_tmp) as lines:
+         os.remove(zone_file_path_tmp)
+         for line in lines:
+            if line == "":
+               continue
+            (rr_owner,rr_ttl,rr_class,rr_type,rr_rdata) = re.split("\s+", line, maxsplit=4)
+            rr_owner = re.sub("\.$", "", rr_owner)
+            rr_rdata = re.sub("\.$", "", rr_rdata)
+            if rr_owner not in records:
+               records[rr_owner] = {}
+            if rr_type not in records[rr_owner]:
+               records[rr_owner][rr_type] = { "ttl": rr_ttl, "rdata": [ rr_rdata ] }
+            else:
+               records[rr_owner][rr_type]["rdata"].append(rr_rdata)
 
       return records
 
 
 ##
-## DHCP specific 
+## DHCP specific
 ##
 
+_hardware_key_cache = {}
+
+class HardwareKey(bytes):
+   """
+   Canonical key for a MAC or DUID : the binary value as bytes, so keys from "00-11-22-33-44-55" (dhcpd.conf),
+   "00:11:22:33:44:55" (DHCP packets, probe), "0011.2233.4455" or "001122334455" are equal and hash the same
+   (the hash of bytes is computed once and cached by Python). Parse once with `parse`, format as often as
+   needed with `format`.
+
+   Example
+   -------
+
+   use nnnn_toolkit as toolkit
+   key = toolkit.HardwareKey.parse("00:11:22:AA:BB:CC")
+   key == toolkit.HardwareKey.parse("00-11-22-aa-bb-cc")
+   key.format(":")
+   """
+
+   __slots__ = ()
+
+   # number of parsed strings kept, the cache is cleared when it is full
+   cache_size = 65536
+
+   @classmethod
+   def parse(cls, text, cache=True):
+      """
+      Parse a MAC or DUID.
+
+      Parameters
+      ----------
+      text : str, bytes or HardwareKey
+         Hex digits separated by "-", ":", "." or not separated at all, case does not matter. Bytes are
+         used as binary value, a HardwareKey is returned unchanged.
+      cache : boolean, optional
+         Look up / keep the key in the cache of parsed strings (default). Disable for bulk input that is
+         parsed only once, e.g. lease files.
+
+      Returns
+      -------
+      HardwareKey
+
+      Raises
+      ------
+      ValueError
+         If the text is empty or not an even number of hex digits.
+      """
+      if text.__class__ is not str:
+         if isinstance(text, cls):
+            return text
+         if isinstance(text, (bytes, bytearray)):
+            return cls(text)
+      elif cache:
+         key = _hardware_key_cache.get(text)
+         if key is not None:
+            return key
+      try:
+         key = cls(bytes.fromhex(text.replace("-", "").replace(":", "").replace(".", "")))
+      except (ValueError, AttributeError):
+         key = None
+      if not key:
+         raise ValueError("HardwareKey : invalid MAC / DUID '{}'".format(text))
+      if cache:
+         if len(_hardware_key_cache) >= cls.cache_size:
+            _hardware_key_cache.clear()
+         _hardware_key_cache[text] = key
+      return key
+
+   @classmethod
+   def from_int(cls, value, length=6):
+      """
+      Create a key from an integer, e.g. to count up MACs. The length is in bytes (6 for a MAC).
+      """
+      return cls(value.to_bytes(length, "big"))
+
+   def to_int(self):
+      """
+      Get the key as integer.
+      """
+      return int.from_bytes(self, "big")
+
+   def is_mac(self):
+      """
+      Check if the key has the length of a MAC (6 bytes).
+      """
+      return len(self) == 6
+
+   def format(self, separator="-"):
+      """
+      Format the key as lower case hex digits.
+
+      Parameters
+      ----------
+      separator : str, optional
+         Separator between the bytes, "-" as in dhcpd.conf (default), ":" or "" (not separated).
+
+      Returns
+      -------
+      str
+      """
+      if separator:
+         return self.hex(separator)
+      return self.hex()
+
+   def __str__(self):
+      return self.hex("-")
+
+   def __repr__(self):
+      return "HardwareKey('{}')".format(self.hex("-"))
+
+def _hardware_key(mac):
+   # canonical key of a MAC / DUID, text that is not hex (e.g. MAC pool wildcards) is compared in lower case
+   try:
+      return HardwareKey.parse(mac)
+   except ValueError:
+      return mac.lower()
+
+class MacPool():
+   """
+   Membership index for the entries of a MAC pool (mac-pool / x-mac-pool in dhcpd.conf). Exact entries are
+   kept in a set of `HardwareKey`, entries with wildcards in a trie of octets, so checking a MAC does not depend
+   on the size of the pool. MACs / entries are compared in lower case with "-", ":" or no separators.
+
+   Wildcards : "*" as the last octet matches any number of remaining octets (e.g. "00-11-22-*"), "*" as any
+   other octet matches exactly one octet (e.g. "00-*-22-33-44-55"). Entries with a "*" within an octet
+   (e.g. "00-11-2*") are matched with fnmatch.
+
+   Example
+   -------
+
+   use nnnn_toolkit as toolkit
+   pool = toolkit.MacPool([ "00-11-22-33-44-55", "00-aa-bb-*" ])
+   pool.match("00:aa:bb:01:02:03")
+   """
+
+   def __init__(self, entries=()):
+      """
+      Parameters
+      ----------
+      entries : iterable of str, optional
+         The entries of the MAC pool.
+      """
+      self.exact = set()
+      self.patterns = []
+      self.__trie = {}
+      for entry in entries:
+         self.add(entry)
+
+   def __octets(self, mac):
+      mac = mac.lower()
+      if "-" in mac or ":" in mac:
+         return re.split("[-:]", mac)
+      return [ mac[i:i + 2] for i in range(0, len(mac), 2) ]
+
+   def add(self, entry):
+      """
+      Add an entry (MAC or wildcard pattern).
+      """
+      if "*" not in entry:
+         try:
+            self.exact.add(HardwareKey.parse(entry))
+            return
+         except ValueError:
+            pass
+      octets = self.__octets(entry)
+      if any("*" in octet and octet != "*" for octet in octets):
+         self.patterns.append("-".join(octets))
+         return
+      node = self.__trie
+      for (index, octet) in enumerate(octets):
+         if octet == "*" and index == len(octets) - 1:
+            node["rest"] = True
+            return
+         node = node.setdefault(octet, {})
+      node["end"] = True
+
+   def __contains__(self, mac):
+      return self.match(mac)
+
+   def __len__(self):
+      return len(self.exact) + len(self.patterns) + self.__count(self.__trie)
+
+   def __count(self, node):
+      count = int("rest" in node) + int("end" in node)
+      for (key, child) in node.items():
+         if key not in ("rest", "end"):
+            count += self.__count(child)
+      return count
+
+   def match(self, mac):
+      """
+      Check if the MAC matches an entry of the pool.
+      """
+      try:
+         key = HardwareKey.parse(mac)
+      except ValueError:
+         key = None
+      if key in self.exact:
+         return True
+      if not self.__trie and not self.patterns:
+         return False
+      octets = key.format("-").split("-") if key else self.__octets(mac)
+      if self.__trie and self.__match_trie(self.__trie, octets, 0):
+         return True
+      for pattern in self.patterns:
+         if fnmatch.fnmatchcase("-".join(octets), pattern):
+            return True
+      return False
+
+   def __match_trie(self, node, octets, index):
+      if node.get("rest"):
+         return True
+      if index == len(octets):
+         return node.get("end", False)
+      for key in (octets[index], "*"):
+         if key in node and self.__match_trie(node[key], octets, index + 1):
+            return True
+      return False
+
 class DhcpdConf:
    """
    Provides easy access to dhcpd.conf and dhcpd.pcy contents.
@@ -2490,6 +4831,14 @@ class DhcpdConf:
       self.__dhcpd_pcy = None
       self.__indent = []
       self.__v6 = False
+      # line numbers of configuration elements (by id, the element is kept so the id stays unique)
+      self.__line_numbers = {}
+      # bulk edits, see `begin_batch`
+      self.__batch = None
+      self.__change_log = []
+      # MAC pool / fingerprint indexes by id of the owner (kept with the index so the id stays unique), see `get_mac_pool`
+      self.__membership_indexes = {}
+      self.__subnet_index = None
 
       # setup indent - will be used when dumping dhcpd.conf back to text
       indent_width = 3
@@ -2503,13 +4852,11 @@ class DhcpdConf:
          # Note: even if the exception is not handled we use try/except/raise so it is easier
          #    to understand where in the code a certain Exception might be triggered
          try:
-            with open(dhcpd_conf_path) as fd_dhcpd_conf:
-               config_dhcpd = fd_dhcpd_conf.read()
+            lines = LineReader(dhcpd_conf_path)
          except OSError as error:
             raise
       
          # parse dhcpd.conf
-         lines = config_dhcpd.split("\n")
          dhcpd_conf = {}
          dhcpd_conf["file_name"] = dhcpd_conf_path
          line_cnt = 0
@@ -2517,398 +4864,409 @@ class DhcpdConf:
          hierarchy = [ self.__top ]
          range_types = []
          is_failover = False
-         for line in lines:
-            line_cnt += 1
-            ###print("XXX {} {} {}".format(hierarchy[-1], line_cnt, line))
+         try:
+            for line in lines:
+               line_cnt += 1
+               ###print("XXX {} {} {}".format(hierarchy[-1], line_cnt, line))
    
-            ### server name of this server
-            if hierarchy[-1] == self.__top:
-               # server line
-               match = re.search('^(v6-)?server-identifier\s(.*);$', line)
-               if match:
-                  if match.group(1) == "v6-":
-                     self.__v6 = True
-                     logger.trace("DhcpdConf : detected DHCPv6 at line {}".format(line_cnt))
-
-                  server_name = match.group(2)
-                  logger.trace("DhcpdConf : detected server {} at line {}".format(server_name,line_cnt))
-                  # add server name
-                  dhcpd_conf["server-identifier"] = server_name
-                  continue
+               ### server name of this server
+               if hierarchy[-1] == self.__top:
+                  # server line
+                  match = re.search('^(v6-)?server-identifier\s(.*);$', line)
+                  if match:
+                     if match.group(1) == "v6-":
+                        self.__v6 = True
+                        logger.trace("DhcpdConf : detected DHCPv6 at line {}".format(line_cnt))
+
+                     server_name = match.group(2)
+                     logger.trace("DhcpdConf : detected server {} at line {}".format(server_name,line_cnt))
+                     # add server name
+                     dhcpd_conf["server-identifier"] = server_name
+                     continue
      
-            ### primary server associated with a failover
-            if hierarchy[-1] == self.__top or hierarchy[-1] == self.__primary:
-               # primary line
-               match = re.search('^primary-server\s([0-9\.]+);', line)
-               if match:
-                  if hierarchy[-1] != self.__primary:
-                     hierarchy.append(self.__primary)
-                  is_failover = True
-                  server_ip = match.group(1)
-                  logger.trace("DhcpdConf : detected primary {} at line {}".format(server_ip,line_cnt))
-                  # add primary
-                  if self.__primary not in dhcpd_conf:
-                     dhcpd_conf[self.__primary] = []
-                  dhcpd_conf[self.__primary].append({ "primary_server" : server_ip })
+               ### primary server associated with a failover
+               if hierarchy[-1] == self.__top or hierarchy[-1] == self.__primary:
+                  # primary line
+                  match = re.search('^primary-server\s([0-9\.]+);', line)
+                  if match:
+                     if hierarchy[-1] != self.__primary:
+                        hierarchy.append(self.__primary)
+                     is_failover = True
+                     server_ip = match.group(1)
+                     logger.trace("DhcpdConf : detected primary {} at line {}".format(server_ip,line_cnt))
+                     # add primary
+                     if self.__primary not in dhcpd_conf:
+                        dhcpd_conf[self.__primary] = []
+                     dhcpd_conf[self.__primary].append({ "primary_server" : server_ip })
    
-            ### fingerprints
-            if hierarchy[-1] == self.__top or hierarchy[-1] == self.__primary or hierarchy[-1] == self.__subnets:
-               # start of fingerprints
-               match = re.search('^(\s+)excluded-fingerprints\s{', line)
-               if match:
-                  hierarchy.append(self.__fingerprints)
-                  in_fingerprint = 1
-                  fingerprint_indent = match.group(1)
-                  logger.trace("DhcpdConf : detected start of excluded-fingerprints at line {}".format(line_cnt))
-                  continue
-            if hierarchy[-1] == self.__fingerprints:
-               # end of fingerprints
-               pattern = '^' + fingerprint_indent + "}"
-               match = re.search(pattern, line)
-               if match:
-                  in_fingerprint = 0
-                  hierarchy.pop()
-                  logger.trace("DhcpdConf : detected end of excluded-fingerprints at line {}".format(line_cnt))
-                  continue
-               # fingerprint entry
-               match = re.search('\s+([0-9,]+)', line)
-               if match:
-                  fingerprint = match.group(1)
-                  # determine to which entity to attach the fingerprint
-                  owner = dhcpd_conf
-                  if self.__primary in hierarchy:
-                     owner = owner[self.__primary][-1]
-                  if self.__shared_networks in hierarchy:
-                     owner = owner[self.__shared_networks][-1]
-                  if self.__subnets in hierarchy:
-                     owner = owner[self.__subnets][-1]
-                  # add fingerprints
-                  if self.__fingerprints not in owner:
-                     owner[self.__fingerprints] = []
-                  owner[self.__fingerprints].append(fingerprint)
-                  continue
+               ### fingerprints
+               if hierarchy[-1] == self.__top or hierarchy[-1] == self.__primary or hierarchy[-1] == self.__subnets:
+                  # start of fingerprints
+                  match = re.search('^(\s+)excluded-fingerprints\s{', line)
+                  if match:
+                     hierarchy.append(self.__fingerprints)
+                     in_fingerprint = 1
+                     fingerprint_indent = match.group(1)
+                     logger.trace("DhcpdConf : detected start of excluded-fingerprints at line {}".format(line_cnt))
+                     continue
+               if hierarchy[-1] == self.__fingerprints:
+                  # end of fingerprints
+                  pattern = '^' + fingerprint_indent + "}"
+                  match = re.search(pattern, line)
+                  if match:
+                     in_fingerprint = 0
+                     hierarchy.pop()
+                     logger.trace("DhcpdConf : detected end of excluded-fingerprints at line {}".format(line_cnt))
+                     continue
+                  # fingerprint entry
+                  match = re.search('\s+([0-9,]+)', line)
+                  if match:
+                     fingerprint = match.group(1)
+                     # determine to which entity to attach the fingerprint
+                     owner = dhcpd_conf
+                     if self.__primary in hierarchy:
+                        owner = owner[self.__primary][-1]
+                     if self.__shared_networks in hierarchy:
+                        owner = owner[self.__shared_networks][-1]
+                     if self.__subnets in hierarchy:
+                        owner = owner[self.__subnets][-1]
+                     # add fingerprints
+                     if self.__fingerprints not in owner:
+                        owner[self.__fingerprints] = []
+                     owner[self.__fingerprints].append(fingerprint)
+                     continue
    
-            ### MAC Pools
-            if hierarchy[-1] == self.__top or hierarchy[-1] == self.__subnets:
-               # start of MAC Pool
-               match = re.search('^(\s+)(mac-pool|x-mac-pool)\s{', line)
-               if match:
-                  hierarchy.append(self.__mac_pools)
-                  in_mac_pool = 1
-                  mac_pool_indent = match.group(1)
-                  mac_pool_type = match.group(2)
-                  logger.trace("DhcpdConf : detected start of {} at line {}".format(mac_pool_type,line_cnt))
-                  # determine to which entity to attach the MAC Pool
-                  owner = dhcpd_conf
-                  if self.__primary in hierarchy:
-                     owner = owner[self.__primary][-1]
-                  if self.__shared_networks in hierarchy:
-                     owner = owner[self.__shared_networks][-1]
-                  if self.__subnets in hierarchy:
-                     owner = owner[self.__subnets][-1]
-                  ###if in_subnet:
-                     ###owner = dhcpd_conf["subnets"][-1]
-                  ###else:
-                     ###owner = dhcpd_conf
-                  # add the MAC Pool 
-                  if mac_pool_type not in owner:
-                     owner[mac_pool_type] = []
-                  continue
-            if hierarchy[-1] == self.__mac_pools:
-               # end of mac pool
-               pattern = '^' + mac_pool_indent + "}"
-               match = re.search(pattern, line)
-               if match:
-                  hierarchy.pop()
-                  logger.trace("DhcpdConf : detected end of {} at line {}".format(mac_pool_type,line_cnt))
-                  continue
-               # MAC pool entry
-               match = re.search('\s+([0-9a-f-\*]+)', line)
-               if match:
-                  mac_address = match.group(1)
-                  # add MAC Address
-                  owner[mac_pool_type].append(mac_address)
+               ### MAC Pools
+               if hierarchy[-1] == self.__top or hierarchy[-1] == self.__subnets:
+                  # start of MAC Pool
+                  match = re.search('^(\s+)(mac-pool|x-mac-pool)\s{', line)
+                  if match:
+                     hierarchy.append(self.__mac_pools)
+                     in_mac_pool = 1
+                     mac_pool_indent = match.group(1)
+                     mac_pool_type = match.group(2)
+                     logger.trace("DhcpdConf : detected start of {} at line {}".format(mac_pool_type,line_cnt))
+                     # determine to which entity to attach the MAC Pool
+                     owner = dhcpd_conf
+                     if self.__primary in hierarchy:
+                        owner = owner[self.__primary][-1]
+                     if self.__shared_networks in hierarchy:
+                        owner = owner[self.__shared_networks][-1]
+                     if self.__subnets in hierarchy:
+                        owner = owner[self.__subnets][-1]
+                     ###if in_subnet:
+                        ###owner = dhcpd_conf["subnets"][-1]
+                     ###else:
+                        ###owner = dhcpd_conf
+                     # add the MAC Pool 
+                     if mac_pool_type not in owner:
+                        owner[mac_pool_type] = []
+                     continue
+               if hierarchy[-1] == self.__mac_pools:
+                  # end of mac pool
+                  pattern = '^' + mac_pool_indent + "}"
+                  match = re.search(pattern, line)
+                  if match:
+                     hierarchy.pop()
+                     logger.trace("DhcpdConf : detected end of {} at line {}".format(mac_pool_type,line_cnt))
+                     continue
+                  # MAC pool entry
+                  match = re.search('\s+([0-9a-f-\*]+)', line)
+                  if match:
+                     mac_address = match.group(1)
+                     # add MAC Address
+                     owner[mac_pool_type].append(mac_address)
      
-            ### Shared Networks
-            if not self.__v6 and (hierarchy[-1] == self.__top or hierarchy[-1] == self.__primary):
-               # Shared Networks step #1
-               match = re.search('^# Name: (.*)$', line)
-               if match:
-                  shared_network_name = match.group(1)
-                  logger.trace("DhcpdConf : detected shared network '{}' at line {}".format(shared_network_name,line_cnt))
-               # Shared Networks step #2
-               match = re.search('^(\s+)shared-network\s([_0-9]+)\s{', line)
-               if match:
-                  hierarchy.append(self.__shared_networks)
-                  shared_network_indent = match.group(1)
-                  shared_network_id = match.group(2)
-                  logger.trace("DhcpdConf : detected start of shared network '{}' at line {}".format(shared_network_id,line_cnt))
-                  # determine to which entity to attach the subnet
-                  owner = dhcpd_conf
-                  if self.__primary in hierarchy:
-                     owner = owner[self.__primary][-1]
-                  # add shared network
-                  if self.__shared_networks not in owner:
-                     owner[self.__shared_networks] = []
-                  owner[self.__shared_networks].append({ "shared_network_name" : shared_network_name, "shared_network_id" : shared_network_id })
-                  # update counters
-                  if self.__shared_networks not in counters:
-                     counters[self.__shared_networks] = 1
-                  else:
-                     counters[self.__shared_networks] += 1
-            if hierarchy[-1] == self.__shared_networks:
-               # end of Shared Network
-               pattern = '^' + shared_network_indent + "}"
-               match = re.search(pattern, line)
-               if match:
-                  hierarchy.pop()
-                  logger.trace("DhcpdConf : detected end of shared network '{}' at line {}".format(shared_network_id,line_cnt))
+               ### Shared Networks
+               if not self.__v6 and (hierarchy[-1] == self.__top or hierarchy[-1] == self.__primary):
+                  # Shared Networks step #1
+                  match = re.search('^# Name: (.*)$', line)
+                  if match:
+                     shared_network_name = match.group(1)
+                     logger.trace("DhcpdConf : detected shared network '{}' at line {}".format(shared_network_name,line_cnt))
+                  # Shared Networks step #2
+                  match = re.search('^(\s+)shared-network\s([_0-9]+)\s{', line)
+                  if match:
+                     hierarchy.append(self.__shared_networks)
+                     shared_network_indent = match.group(1)
+                     shared_network_id = match.group(2)
+                     logger.trace("DhcpdConf : detected start of shared network '{}' at line {}".format(shared_network_id,line_cnt))
+                     # determine to which entity to attach the subnet
+                     owner = dhcpd_conf
+                     if self.__primary in hierarchy:
+                        owner = owner[self.__primary][-1]
+                     # add shared network
+                     if self.__shared_networks not in owner:
+                        owner[self.__shared_networks] = []
+                     owner[self.__shared_networks].append({ "shared_network_name" : shared_network_name, "shared_network_id" : shared_network_id })
+                     self.__set_line_number(owner[self.__shared_networks][-1], line_cnt)
+                     # update counters
+                     if self.__shared_networks not in counters:
+                        counters[self.__shared_networks] = 1
+                     else:
+                        counters[self.__shared_networks] += 1
+               if hierarchy[-1] == self.__shared_networks:
+                  # end of Shared Network
+                  pattern = '^' + shared_network_indent + "}"
+                  match = re.search(pattern, line)
+                  if match:
+                     hierarchy.pop()
+                     logger.trace("DhcpdConf : detected end of shared network '{}' at line {}".format(shared_network_id,line_cnt))
    
-            ### Subnets
-            if hierarchy[-1] == self.__top or hierarchy[-1] == self.__primary or hierarchy[-1] == self.__shared_networks:
-               # start of subnet
-               match = re.search('(^\s+)subnet ([0-9\.]+) netmask ([0-9\.]+) {', line)
-               if not match:
-                  #      v6-subnet  fdec:9220:102a:101::/64 {
-                  match = re.search('(^\s+)v6-subnet\s+([0-9a-f:]+)/([0-9]+) {', line)
-               if match:
-                  hierarchy.append(self.__subnets)
-                  subnet_indent = match.group(1)
-                  subnet_addr = match.group(2)
-                  netmask = match.group(3)
-                  logger.trace("DhcpdConf : detected subnet '{}' at line {}".format(subnet_addr,line_cnt))
-                  # determine to which entity to attach the subnet
-                  owner = dhcpd_conf
-                  if self.__primary in hierarchy:
-                     owner = owner[self.__primary][-1]
-                  if self.__shared_networks in hierarchy:
-                     owner = owner[self.__shared_networks][-1]
-                  # add subnet
-                  if self.__subnets not in owner:
-                     owner[self.__subnets] = []
-                  if self.__shared_networks in hierarchy:
-                     owner[self.__subnets].append({ "subnet" : subnet_addr, "netmask" : netmask, "shared_network" : shared_network_id })
-                  else:
-                     owner[self.__subnets].append({ "subnet" : subnet_addr, "netmask" : netmask })
-                  # update counters
-                  if self.__subnets not in counters:
-                     counters[self.__subnets] = 1
-                  else:
-                     counters[self.__subnets] += 1
-                  continue
+               ### Subnets
+               if hierarchy[-1] == self.__top or hierarchy[-1] == self.__primary or hierarchy[-1] == self.__shared_networks:
+                  # start of subnet
+                  match = re.search('(^\s+)subnet ([0-9\.]+) netmask ([0-9\.]+) {', line)
+                  if not match:
+                     #      v6-subnet  fdec:9220:102a:101::/64 {
+                     match = re.search('(^\s+)v6-subnet\s+([0-9a-f:]+)/([0-9]+) {', line)
+                  if match:
+                     hierarchy.append(self.__subnets)
+                     subnet_indent = match.group(1)
+                     subnet_addr = match.group(2)
+                     netmask = match.group(3)
+                     logger.trace("DhcpdConf : detected subnet '{}' at line {}".format(subnet_addr,line_cnt))
+                     # determine to which entity to attach the subnet
+                     owner = dhcpd_conf
+                     if self.__primary in hierarchy:
+                        owner = owner[self.__primary][-1]
+                     if self.__shared_networks in hierarchy:
+                        owner = owner[self.__shared_networks][-1]
+                     # add subnet
+                     if self.__subnets not in owner:
+                        owner[self.__subnets] = []
+                     if self.__shared_networks in hierarchy:
+                        owner[self.__subnets].append({ "subnet" : subnet_addr, "netmask" : netmask, "shared_network" : shared_network_id })
+                     else:
+                        owner[self.__subnets].append({ "subnet" : subnet_addr, "netmask" : netmask })
+                     self.__set_line_number(owner[self.__subnets][-1], line_cnt)
+                     # update counters
+                     if self.__subnets not in counters:
+                        counters[self.__subnets] = 1
+                     else:
+                        counters[self.__subnets] += 1
+                     continue
                
-            if hierarchy[-1] == self.__subnets:
-               # end of subnet
-               pattern = '^' + subnet_indent + '}$'
-               match = re.search(pattern, line)
-               if match:
-                  hierarchy.pop()
-                  logger.trace("DhcpdConf : detected end of subnet '{}' at line {}".format(subnet_addr,line_cnt))
-                  continue
+               if hierarchy[-1] == self.__subnets:
+                  # end of subnet
+                  pattern = '^' + subnet_indent + '}$'
+                  match = re.search(pattern, line)
+                  if match:
+                     hierarchy.pop()
+                     logger.trace("DhcpdConf : detected end of subnet '{}' at line {}".format(subnet_addr,line_cnt))
+                     continue
    
-            ### IP Ranges / Fixed Addresses
-            ### Note: fixed addresses are simply treated as a different kind of range
-            if hierarchy[-1] == self.__subnets:
-               # start of ip range
-               match = re.search('^(\s+)(v6-dynamic-dhcp|dynamic-dhcp|automatic-dhcp|automatic-bootp) range ([0-9a-f:\.]+) ([0-9a-f:\.]+) ', line)
-               if match:
-                  hierarchy.append(self.__ranges)
-                  range_indent = match.group(1)
-                  range_type = match.group(2)
-                  range_start = match.group(3)
-                  range_end = match.group(4)
-                  logger.trace("DhcpdConf : detected " + range_type + " '" + range_start + " - " + range_end + "' at line " + str(line_cnt))
-                  range_def = { "range_type" : range_type, "range_start" : range_start, "range_end" : range_end }
-                  # vendor class filter for range
-                  vc_match = re.search('\sclass\s"([^"]+)"\s', line)
-                  if vc_match:
-                     vendor_class = vc_match.group(1)
-                     range_def["vendor_class"] = vendor_class
-                  # user class filter for range
-                  uc_match = re.search('\suserclass\s"(.*)"\s{', line)
-                  if uc_match:
-                     user_class = uc_match.group(1)
-                     # user class might have multiple values
-                     values = user_class.split('" "')
-                     user_class = values
-                     range_def["user_class"] = user_class
-                  # determine to which entity to attach the range
-                  owner = dhcpd_conf
-                  if self.__primary in hierarchy:
-                     owner = owner[self.__primary][-1]
-                  if self.__shared_networks in hierarchy:
-                     owner = owner[self.__shared_networks][-1]
-                  if self.__subnets in hierarchy:
-                     owner = owner[self.__subnets][-1]
-                  # add range
-                  if self.__ranges not in owner:
-                     owner[self.__ranges] = []
-                  owner[self.__ranges].append(range_def)
-                  # update counters
-                  if range_type not in counters:
-                     counters[range_type] = 1
-                  else:
-                     counters[range_type] += 1
-                  if range_type not in range_types:
-                     range_types.append(range_type)
-                  continue
+               ### IP Ranges / Fixed Addresses
+               ### Note: fixed addresses are simply treated as a different kind of range
+               if hierarchy[-1] == self.__subnets:
+                  # start of ip range
+                  match = re.search('^(\s+)(v6-dynamic-dhcp|dynamic-dhcp|automatic-dhcp|automatic-bootp) range ([0-9a-f:\.]+) ([0-9a-f:\.]+) ', line)
+                  if match:
+                     hierarchy.append(self.__ranges)
+                     range_indent = match.group(1)
+                     range_type = match.group(2)
+                     range_start = match.group(3)
+                     range_end = match.group(4)
+                     logger.trace("DhcpdConf : detected " + range_type + " '" + range_start + " - " + range_end + "' at line " + str(line_cnt))
+                     range_def = { "range_type" : range_type, "range_start" : range_start, "range_end" : range_end }
+                     # vendor class filter for range
+                     vc_match = re.search('\sclass\s"([^"]+)"\s', line)
+                     if vc_match:
+                        vendor_class = vc_match.group(1)
+                        range_def["vendor_class"] = vendor_class
+                     # user class filter for range
+                     uc_match = re.search('\suserclass\s"(.*)"\s{', line)
+                     if uc_match:
+                        user_class = uc_match.group(1)
+                        # user class might have multiple values
+                        values = user_class.split('" "')
+                        user_class = values
+                        range_def["user_class"] = user_class
+                     # determine to which entity to attach the range
+                     owner = dhcpd_conf
+                     if self.__primary in hierarchy:
+                        owner = owner[self.__primary][-1]
+                     if self.__shared_networks in hierarchy:
+                        owner = owner[self.__shared_networks][-1]
+                     if self.__subnets in hierarchy:
+                        owner = owner[self.__subnets][-1]
+                     # add range
+                     if self.__ranges not in owner:
+                        owner[self.__ranges] = []
+                     owner[self.__ranges].append(range_def)
+                     self.__set_line_number(range_def, line_cnt)
+                     # update counters
+                     if range_type not in counters:
+                        counters[range_type] = 1
+                     else:
+                        counters[range_type] += 1
+                     if range_type not in range_types:
+                        range_types.append(range_type)
+                     continue
    
-               # start of fixed address
-               match = re.search('^(\s+)(v6-manual-dhcp(-mac)?|manual-dhcp|manual-bootp) (duid )?([0-9a-f\-]+) ([0-9a-f\.:]+) ', line)
-               if match:
-                  hierarchy.append(self.__ranges)
-                  range_indent = match.group(1)
-                  range_type = match.group(2)
-                  mac = match.group(5)
-                  ip = match.group(6)
-                  try:
-                     logger.trace("DhcpdConf : detected " + range_type + " '" + ip + " / " + mac + "' at line " + str(line_cnt))
-                  except TypeError:
-                     print(f'"{match.group(1)}", "{match.group(2)}", "{match.group(3)}", "{match.group(4)}", "{match.group(5)}", "{match.group(6)}"')
-                     exit()
-                  # determine to which entity to attach the fixed address
-                  owner = dhcpd_conf
-                  if self.__primary in hierarchy:
-                     owner = owner[self.__primary][-1]
-                  if self.__shared_networks in hierarchy:
-                     owner = owner[self.__shared_networks][-1]
-                  if self.__subnets in hierarchy:
-                     owner = owner[self.__subnets][-1]
-                  # add fixed address
-                  if self.__ranges not in owner:
-                     owner[self.__ranges] = []
-                  owner[self.__ranges].append({ "range_type" : range_type, "mac" : mac, "ip" : ip })
-                  # update counters
-                  if range_type not in counters:
-                     counters[range_type] = 1
-                  else:
-                     counters[range_type] += 1
-                  if range_type not in range_types:
-                     range_types.append(range_type)
-                  continue
+                  # start of fixed address
+                  match = re.search('^(\s+)(v6-manual-dhcp(-mac)?|manual-dhcp|manual-bootp) (duid )?([0-9a-f\-]+) ([0-9a-f\.:]+) ', line)
+                  if match:
+                     hierarchy.append(self.__ranges)
+                     range_indent = match.group(1)
+                     range_type = match.group(2)
+                     mac = match.group(5)
+                     ip = match.group(6)
+                     try:
+                        logger.trace("DhcpdConf : detected " + range_type + " '" + ip + " / " + mac + "' at line " + str(line_cnt))
+                     except TypeError:
+                        print(f'"{match.group(1)}", "{match.group(2)}", "{match.group(3)}", "{match.group(4)}", "{match.group(5)}", "{match.group(6)}"')
+                        exit()
+                     # determine to which entity to attach the fixed address
+                     owner = dhcpd_conf
+                     if self.__primary in hierarchy:
+                        owner = owner[self.__primary][-1]
+                     if self.__shared_networks in hierarchy:
+                        owner = owner[self.__shared_networks][-1]
+                     if self.__subnets in hierarchy:
+                        owner = owner[self.__subnets][-1]
+                     # add fixed address
+                     if self.__ranges not in owner:
+                        owner[self.__ranges] = []
+                     owner[self.__ranges].append({ "range_type" : range_type, "mac" : mac, "ip" : ip })
+                     # DHCPv6 reservation by DUID
+                     if match.group(4):
+                        owner[self.__ranges][-1]["duid"] = True
+                     self.__set_line_number(owner[self.__ranges][-1], line_cnt)
+                     # update counters
+                     if range_type not in counters:
+                        counters[range_type] = 1
+                     else:
+                        counters[range_type] += 1
+                     if range_type not in range_types:
+                        range_types.append(range_type)
+                     continue
    
-            if hierarchy[-1] == self.__ranges:
-               # end of range / fixed address
-               pattern = '^' + range_indent + '}$'
-               match = re.search(pattern, line)
-               if match:
-                  hierarchy.pop()
-                  logger.trace("DhcpdConf : detected end of range at line {}".format(line_cnt))
-                  continue
+               if hierarchy[-1] == self.__ranges:
+                  # end of range / fixed address
+                  pattern = '^' + range_indent + '}$'
+                  match = re.search(pattern, line)
+                  if match:
+                     hierarchy.pop()
+                     logger.trace("DhcpdConf : detected end of range at line {}".format(line_cnt))
+                     continue
    
-            if hierarchy[-1] == self.__top or hierarchy[-1] == self.__primary or hierarchy[-1] == self.__subnets or hierarchy[-1] == self.__ranges:
-               # client classes : user / vendor class
-               match = re.search('^(\s+)(user-class|vendor-class)\s"(.+)"', line)
-               if match:
-                  hierarchy.append(self.__client_classes)
-                  class_indent = match.group(1)
-                  class_type = match.group(2)
-                  class_match_value = match.group(3)
-                  # user-class might have multiple values
-                  if class_type == "user-class":
-                     values = class_match_value.split('" "')
-                     class_match_value = values
-                  logger.trace("DhcpdConf : detected class {} matching {} at line {}".format(class_type,class_match_value,line_cnt))
-                  # determine to which entity to attach the client class
-                  owner = dhcpd_conf
-                  if self.__primary in hierarchy:
-                     owner = owner[self.__primary][-1]
-                  if self.__shared_networks in hierarchy:
-                     owner = owner[self.__shared_networks][-1]
-                  if self.__subnets in hierarchy:
-                     owner = owner[self.__subnets][-1]
-                  if self.__ranges in hierarchy:
-                     owner = owner[self.__ranges][-1]
-                  # add client class
-                  if self.__client_classes not in owner:
-                     owner[self.__client_classes] = []
-                  owner[self.__client_classes].append({ "class_type" : class_type, "class_match_value" : class_match_value })
-                  continue
-               # client classes : option class
-               match = re.search('^(\s+)(option-class)\s([0-9]+)\s"([^"]+)"', line)
-               if match:
-                  hierarchy.append(self.__client_classes)
-                  class_indent = match.group(1)
-                  class_type = match.group(2)
-                  class_match_nr = match.group(3)
-                  class_match_value = match.group(4)
-                  logger.trace("DhcpdConf : detected class {} at line {}".format(class_type,line_cnt))
-                  # determine to which entity to attach the client class
-                  owner = dhcpd_conf
-                  if self.__primary in hierarchy:
-                     owner = owner[self.__primary][-1]
-                  if self.__shared_networks in hierarchy:
-                     owner = owner[self.__shared_networks][-1]
-                  if self.__subnets in hierarchy:
-                     owner = owner[self.__subnets][-1]
-                  if self.__ranges in hierarchy:
-                     owner = owner[self.__ranges][-1]
-                  # add client class
-                  if self.__client_classes not in owner:
-                     owner[self.__client_classes] = []
-                  owner[self.__client_classes].append({ "class_type" : class_type, "class_match_nr" : class_match_nr, "class_match_value" : class_match_value })
-                  continue
-     
-            if hierarchy[-1] == self.__client_classes:
-               # end of class
-               pattern = '^' + class_indent + '}$'
-               match = re.search(pattern, line)
-               if match:
-                  hierarchy.pop()
-                  logger.trace("DhcpdConf : end of class {} at line {}".format(class_type,line_cnt))
-                  continue
+               if hierarchy[-1] == self.__top or hierarchy[-1] == self.__primary or hierarchy[-1] == self.__subnets or hierarchy[-1] == self.__ranges:
+                  # client classes : user / vendor class
+                  match = re.search('^(\s+)(user-class|vendor-class)\s"(.+)"', line)
+                  if match:
+                     hierarchy.append(self.__client_classes)
+                     class_indent = match.group(1)
+                     class_type = match.group(2)
+                     class_match_value = match.group(3)
+                     # user-class might have multiple values
+                     if class_type == "user-class":
+                        values = class_match_value.split('" "')
+                        class_match_value = values
+                     logger.trace("DhcpdConf : detected class {} matching {} at line {}".format(class_type,class_match_value,line_cnt))
+                     # determine to which entity to attach the client class
+                     owner = dhcpd_conf
+                     if self.__primary in hierarchy:
+                        owner = owner[self.__primary][-1]
+                     if self.__shared_networks in hierarchy:
+                        owner = owner[self.__shared_networks][-1]
+                     if self.__subnets in hierarchy:
+                        owner = owner[self.__subnets][-1]
+                     if self.__ranges in hierarchy:
+                        owner = owner[self.__ranges][-1]
+                     # add client class
+                     if self.__client_classes not in owner:
+                        owner[self.__client_classes] = []
+                     owner[self.__client_classes].append({ "class_type" : class_type, "class_match_value" : class_match_value })
+                     self.__set_line_number(owner[self.__client_classes][-1], line_cnt)
+                     continue
+                  # client classes : option class
+                  match = re.search('^(\s+)(option-class)\s([0-9]+)\s"([^"]+)"', line)
+                  if match:
+                     hierarchy.append(self.__client_classes)
+                     class_indent = match.group(1)
+                     class_type = match.group(2)
+                     class_match_nr = match.group(3)
+                     class_match_value = match.group(4)
+                     logger.trace("DhcpdConf : detected class {} at line {}".format(class_type,line_cnt))
+                     # determine to which entity to attach the client class
+                     owner = dhcpd_conf
+                     if self.__primary in hierarchy:
+                        owner = owner[self.__primary][-1]
+                     if self.__shared_networks in hierarchy:
+                        owner = owner[self.__shared_networks][-1]
+                     if self.__subnets in hierarchy:
+                        owner = owner[self.__subnets][-1]
+                     if self.__ranges in hierarchy:
+                        owner = owner[self.__ranges][-1]
+                     # add client class
+                     if self.__client_classes not in owner:
+                        owner[self.__client_classes] = []
+                     owner[self.__client_classes].append({ "class_type" : class_type, "class_match_nr" : class_match_nr, "class_match_value" : class_match_value })
+                     self.__set_line_number(owner[self.__client_classes][-1], line_cnt)
+                     continue
+     
+               if hierarchy[-1] == self.__client_classes:
+                  # end of class
+                  pattern = '^' + class_indent + '}$'
+                  match = re.search(pattern, line)
+                  if match:
+                     hierarchy.pop()
+                     logger.trace("DhcpdConf : end of class {} at line {}".format(class_type,line_cnt))
+                     continue
    
-            if hierarchy[-1] == self.__ranges or hierarchy[-1] == self.__client_classes or hierarchy[-1] == self.__subnets:
-               # options / policies
-               match = re.search('^\s+(option|policy)\s(\S+)\s(.*);', line)
-               if match:
-                  option_type = match.group(1)
-                  option_name = match.group(2)
-                  option_value = match.group(3)
-                  if option_type == "option":
-                     key_name = self.__options
-                  elif option_type == "policy":
-                     key_name = self.__policies
-                     # policy might have multiple values
-                     values = option_value.split(", ")
-                     option_value = values
-                  else:
-                     raise SyntaxError("Unknown configuration type {} at line {}".format(option_type, line_cnt))
-                  # determine to which entity to attach the option / policy
-                  owner = dhcpd_conf
-                  if self.__primary in hierarchy:
-                     owner = owner[self.__primary][-1]
-                  if self.__shared_networks in hierarchy:
-                     owner = owner[self.__shared_networks][-1]
-                  if self.__subnets in hierarchy:
-                     owner = owner[self.__subnets][-1]
-                  if self.__ranges in hierarchy:
-                     owner = owner[self.__ranges][-1]
-                  if self.__client_classes in hierarchy:
-                     owner = owner[self.__client_classes][-1]
-                  # add option/policy
-                  if key_name not in owner:
-                     owner[key_name] = [] 
-                  owner[key_name].append({ "{}_name".format(option_type) : option_name, "{}_value".format(option_type) : option_value })
-                  logger.trace("DhcpdConf : detected {} '{}' = '{}' at line {}".format(option_type, option_name, option_value, line_cnt))
-                  continue
+               if hierarchy[-1] == self.__ranges or hierarchy[-1] == self.__client_classes or hierarchy[-1] == self.__subnets:
+                  # options / policies
+                  match = re.search('^\s+(option|policy)\s(\S+)\s(.*);', line)
+                  if match:
+                     option_type = match.group(1)
+                     option_name = match.group(2)
+                     option_value = match.group(3)
+                     if option_type == "option":
+                        key_name = self.__options
+                     elif option_type == "policy":
+                        key_name = self.__policies
+                        # policy might have multiple values
+                        values = option_value.split(", ")
+                        option_value = values
+                     else:
+                        raise SyntaxError("Unknown configuration type {} at line {}".format(option_type, line_cnt))
+                     # determine to which entity to attach the option / policy
+                     owner = dhcpd_conf
+                     if self.__primary in hierarchy:
+                        owner = owner[self.__primary][-1]
+                     if self.__shared_networks in hierarchy:
+                        owner = owner[self.__shared_networks][-1]
+                     if self.__subnets in hierarchy:
+                        owner = owner[self.__subnets][-1]
+                     if self.__ranges in hierarchy:
+                        owner = owner[self.__ranges][-1]
+                     if self.__client_classes in hierarchy:
+                        owner = owner[self.__client_classes][-1]
+                     # add option/policy
+                     if key_name not in owner:
+                        owner[key_name] = [] 
+                     owner[key_name].append({ "{}_name".format(option_type) : option_name, "{}_value".format(option_type) : option_value })
+                     logger.trace("DhcpdConf : detected {} '{}' = '{}' at line {}".format(option_type, option_name, option_value, line_cnt))
+                     continue
+         finally:
+            lines.close()
    
-            # add counters, range types and additional info for convienience
-            dhcpd_conf["counters"] = {}
-            for range_type in counters:
-               dhcpd_conf["counters"][range_type] = counters[range_type]
-            dhcpd_conf["range_types"] = range_types
-            dhcpd_conf["is_failover"] = is_failover
-            dhcpd_conf["has_changed"] = False
+         # add counters, range types and additional info for convienience
+         dhcpd_conf["counters"] = {}
+         for range_type in counters:
+            dhcpd_conf["counters"][range_type] = counters[range_type]
+         dhcpd_conf["range_types"] = range_types
+         dhcpd_conf["is_failover"] = is_failover
+         dhcpd_conf["has_changed"] = False
      
-            # save result for later use
-            self.__dhcpd_conf = dhcpd_conf
+         # save result for later use
+         self.__dhcpd_conf = dhcpd_conf
 
       if dhcpd_pcy_path:
          # read dhcpd.pcy
          try:
-            with open(dhcpd_pcy_path) as fd_dhcpd_pcy:
-               pcy_dhcpd = fd_dhcpd_pcy.read()
+            pcy_lines = LineReader(dhcpd_pcy_path)
          except OSError as error:
             raise
    
@@ -2917,19 +5275,19 @@ class DhcpdConf:
          dhcpd_pcy["file_name"] = dhcpd_pcy_path
          dhcpd_pcy["policies"] = []
          additional_policy = False
-         for line in pcy_dhcpd.split("\n"):
-            # remove comments
-            new_line = re.sub('[;#].*', "", line)
-            # skip empty / blank lines
-            if re.search('^\s*$', new_line):
-               continue
-            # assign values
-            (key, value) = new_line.split("=")
-            dhcpd_pcy["policies"].append({ "policy_name" : key, "policy_value" : value, "additional_policy" : additional_policy })
-            # detected start of additional policies
-            if re.search('# Begin corporate extensions', line):
-               additional_policy = True
-         dhcpd_pcy["has_changed"] = False
+         try:
+            for (line_number, item_type, name, value) in iter_pcy(pcy_lines, inline_comments=True):
+               if item_type == "option":
+                  dhcpd_pcy["policies"].append({ "policy_name" : name, "policy_value" : value, "additional_policy" : additional_policy })
+               # detected start / end of additional policies
+               elif item_type == "comment":
+                  if "Begin corporate extensions" in name:
+                     additional_policy = True
+                  elif "End corporate extensions" in name:
+                     additional_policy = False
+            dhcpd_pcy["has_changed"] = False
+         finally:
+            pcy_lines.close()
 
          # save result for later use
          self.__dhcpd_pcy = dhcpd_pcy
@@ -2987,8 +5345,9 @@ class DhcpdConf:
             Each range has a "range_start" and "range_end". Optionally ranges might have "user_class" and/or
             "vendor_class" filters associated with them. "user_class" is a list, "vendor_class" is a single
             value.
-         For fixed addresses of type "manual-dhcp", "manual-bootp": 
-            Each fixed address type has a "mac" and an "ip".
+         For fixed addresses of type "manual-dhcp", "manual-bootp", "v6-manual-dhcp", "v6-manual-dhcp-mac":
+            Each fixed address type has a "mac" and an "ip". DHCPv6 reservations by DUID also have "duid" set
+            to True, the DUID is stored in "mac".
          In addition each range or fixed address  might have "options", "policies" and "client_classes".
          Ranges exist on subnet level.
       
@@ -3049,8 +5408,40 @@ class DhcpdConf:
    def conf_has_changed(self):
       """
       Set the "has_changed" property for the current configuration to `True`.
+      Also needs to be called after changing MAC pools / fingerprints via `get_config` so that
+      `mac_allowed` and `fingerprint_excluded` use the changed lists.
       """
       self.__dhcpd_conf["has_changed"] = True
+      self.__membership_indexes = {}
+      self.__subnet_index = None
+
+   def begin_batch(self):
+      """
+      Start a transactional bulk edit of the configuration, see `DhcpdConfBatch`. Only one batch can be open
+      at a time, `dump_to_file` does not write while a batch is open.
+
+      Returns
+      -------
+      DhcpdConfBatch
+         The batch to add the edits to, can be used as context manager (commit on success, rollback on exception).
+
+      Raises
+      ------
+      RuntimeError
+         If another batch is still open.
+      """
+      if self.__batch and self.__batch.is_open():
+         raise RuntimeError("DhcpdConf : another batch is still open")
+      self.__batch = DhcpdConfBatch(self)
+      return self.__batch
+
+   def get_change_log(self):
+      """
+      Get the edits of all committed batches, each as dict with "action" (add, remove, update, set), "type"
+      (fixed-address, range, option, policy, mac-pool, x-mac-pool), "target" (IP / subnet / "global") and
+      optional "details".
+      """
+      return self.__change_log
 
    def get_pcy(self):
       """
@@ -3167,6 +5558,151 @@ class DhcpdConf:
       # iterate through MACs
       return self.get_list(mac_pool_type, owner_config)
 
+   def get_mac_pool(self, mac_pool_type="mac-pool", owner_config=None):
+      """
+      Get the MACs of the specified MAC Pool type as `MacPool` index (built on first use), e.g. to check
+      many MACs against a large pool.
+
+      Parameters
+      ----------
+      mac_pool_type : str, optional
+         "mac-pool" (default) or "x-mac-pool".
+      owner_config : dict, optional
+         Can be a subnet configuration or a complete dhcpd configuration as returned by `get_config`.
+         If not specified the current dhcpd configuration is used.
+
+      Returns
+      -------
+      MacPool
+         The index of the MAC Pool, empty if there is no MAC Pool of the specified type.
+      """
+      if not owner_config:
+         owner_config = self.__dhcpd_conf
+      key = (id(owner_config), mac_pool_type)
+      if key not in self.__membership_indexes:
+         self.__membership_indexes[key] = (owner_config, MacPool(self.get_macs(mac_pool_type, owner_config)))
+      return self.__membership_indexes[key][1]
+
+   def get_subnet_index(self):
+      """
+      Get the subnets as `AddressIndex` (built on first use) with the subnet configurations as items.
+      Call `conf_has_changed` after adding / removing subnets via `get_config`.
+
+      Returns
+      -------
+      AddressIndex
+      """
+      if self.__subnet_index is None:
+         subnets = self.get_subnets()
+         self.__subnet_index = AddressIndex([ "{}/{}".format(subnet["subnet"], subnet["netmask"]) for subnet in subnets ], items=subnets)
+      return self.__subnet_index
+
+   def find_subnet(self, ip):
+      """
+      Get the configuration of the (innermost) subnet containing an IP address.
+
+      Parameters
+      ----------
+      ip : str, ipaddress.IPv4Address or ipaddress.IPv6Address
+         The IP address.
+
+      Returns
+      -------
+      dict
+         The subnet configuration or `None` if no subnet contains the IP.
+      """
+      return self.get_subnet_index().lookup(ip)
+
+   def find_subnets(self, ips, version=4):
+      """
+      Get the subnet configurations for a batch of IP addresses, see `AddressIndex.lookup_many`.
+
+      Parameters
+      ----------
+      ips : iterable
+         IP addresses of one IP version (str or ipaddress objects) or their integers as returned by `parse_ips`.
+      version : int, optional
+         The IP version of the addresses, 4 (default) or 6.
+
+      Returns
+      -------
+      list of dict
+         The subnet configurations, `None` for IPs not within any subnet.
+      """
+      return self.get_subnet_index().lookup_many(ips, version)
+
+   def __get_subnet_by_address(self, subnet):
+      # subnet configuration by subnet address (or any IP of the subnet), subnet configurations are passed through
+      if subnet is None or isinstance(subnet, dict):
+         return subnet
+      subnet_config = self.find_subnet(subnet)
+      if not subnet_config:
+         raise KeyError("DhcpdConf : no subnet {}".format(subnet))
+      return subnet_config
+
+   def mac_allowed(self, mac, subnet=None):
+      """
+      Check if a client is allowed by the MAC Pools : a MAC in the Exclude MAC Pool of the subnet or the
+      global one is not allowed. If the subnet has a MAC Pool the MAC must be in it, otherwise if there
+      is a global MAC Pool the MAC must be in the global one. Without MAC Pools all MACs are allowed.
+
+      Parameters
+      ----------
+      mac : str
+         The MAC of the client (separated by "-", ":" or not at all).
+      subnet : str or dict, optional
+         The subnet address (or any IP of the subnet, e.g. the client IP) or configuration of the subnet the
+         client is in, only the global MAC Pools are used if not specified.
+
+      Returns
+      -------
+      boolean
+         True if the MAC is allowed.
+
+      Raises
+      ------
+      KeyError
+         If no subnet contains the specified address.
+      """
+      config = self.__dhcpd_conf
+      subnet_config = self.__get_subnet_by_address(subnet)
+      owners = [ subnet_config, config ] if subnet_config else [ config ]
+      for owner_config in owners:
+         if self.__x_mac_pools in owner_config and self.get_mac_pool(self.__x_mac_pools, owner_config).match(mac):
+            return False
+      for owner_config in owners:
+         if self.__mac_pools in owner_config:
+            return self.get_mac_pool(self.__mac_pools, owner_config).match(mac)
+      return True
+
+   def fingerprint_excluded(self, fingerprint, subnet=None):
+      """
+      Check if a DHCP fingerprint (e.g. "1,3,6,15") is in the Excluded Fingerprints of the subnet or the global ones.
+
+      Parameters
+      ----------
+      fingerprint : str
+         The fingerprint (option numbers of the parameter request list separated by ",").
+      subnet : str or dict, optional
+         The subnet address (or any IP of the subnet) or configuration, only the global Excluded Fingerprints are
+         used if not specified.
+
+      Returns
+      -------
+      boolean
+         True if the fingerprint is excluded.
+      """
+      fingerprint = fingerprint.replace(" ", "")
+      config = self.__dhcpd_conf
+      subnet_config = self.__get_subnet_by_address(subnet)
+      for owner_config in ([ subnet_config, config ] if subnet_config else [ config ]):
+         key = (id(owner_config), self.__fingerprints)
+         if key not in self.__membership_indexes:
+            self.__membership_indexes[key] = (owner_config, frozenset(self.get_fingerprints(owner_config)))
+         if fingerprint in self.__membership_indexes[key][1]:
+            return True
+      return False
+
    def get_fingerprints(self, owner_config=None):
       """
       Get the excluded fingerprints.
@@ -3574,7 +6110,7 @@ class DhcpdConf:
       # mac-pool / x-mac-pool
       my_mac_pool = self.get_macs(mac_pool_type=mac_pool_type, owner_config=my_conf)
       other_mac_pool = self.get_macs(mac_pool_type=mac_pool_type, owner_config=other_conf)
-      (diff_messages, diff_data) = diff_list(my_mac_pool, other_mac_pool, name=name, missing_only=missing_only)
+      (diff_messages, diff_data) = diff_list(my_mac_pool, other_mac_pool, name=name, missing_only=missing_only, normalize=_hardware_key)
       return (diff_messages, diff_data)
 
    def diff_conf(self, other, missing_only=False):
@@ -3694,13 +6230,23 @@ class DhcpdConf:
             name = "MAC from Subnet {} Exclude MAC Pool".format(subnet)
             (diff_messages, x_mac_pool_diff_data) = self.diff_macs(my_subnet_conf, other_subnet_conf, mac_pool_type="x-mac-pool", name=name, missing_only=missing_only)
             diff.extend(diff_messages)
+
+            # subnet options
+            name = "Subnet {} Option".format(subnet)
+            (diff_messages, option_diff_data) = self.diff_options(my_subnet_conf, other_subnet_conf, name=name, missing_only=missing_only)
+            diff.extend(diff_messages)
+
+            # subnet policies
+            name = "Subnet {} Policy".format(subnet)
+            (diff_messages, policies_diff_data) = self.diff_policies(my_subnet_conf, other_subnet_conf, name=name, missing_only=missing_only)
+            diff.extend(diff_messages)
    
             # ranges
             my_ranges = self.get_ranges(my_subnet_conf)
             other_ranges = other.get_ranges(other_subnet_conf)
    
             # part #1 dynamic ranges
-            range_types = ( 'dynamic-dhcp', 'automatic-dhcp', 'automatic-bootp' )
+            range_types = ( 'dynamic-dhcp', 'automatic-dhcp', 'automatic-bootp', 'v6-dynamic-dhcp' )
             for range_type in range_types:
                my_dynamic_ranges = (get_list_items(my_ranges, "range_type", range_type))
                other_dynamic_ranges = (get_list_items(other_ranges, "range_type", range_type))
@@ -3739,7 +6285,7 @@ class DhcpdConf:
                   diff.extend(diff_messages)
    
             # part #2 fixed addresses
-            fixed_address_types = ( 'manual-dhcp', 'manual-bootp' )
+            fixed_address_types = ( 'manual-dhcp', 'manual-bootp', 'v6-manual-dhcp', 'v6-manual-dhcp-mac' )
             for fixed_address_type in fixed_address_types:
                my_fixed_addresses = get_list_items(my_ranges, "range_type", fixed_address_type)
                other_fixed_addresses = get_list_items(other_ranges, "range_type", fixed_address_type)
@@ -3747,7 +6293,7 @@ class DhcpdConf:
                fixed_addresses_name = "{} IP".format(fixed_address_type.title())
                range_pkey = "ip"
                additional_keys = [ "mac" ]
-               (diff_messages, range_diff_data) = diff_list(my_fixed_addresses, other_fixed_addresses, name=fixed_addresses_name, primary_key=range_pkey, additional_keys=additional_keys, missing_only=missing_only)
+               (diff_messages, range_diff_data) = diff_list(my_fixed_addresses, other_fixed_addresses, name=fixed_addresses_name, primary_key=range_pkey, additional_keys=additional_keys, missing_only=missing_only, normalize={ "mac" : _hardware_key })
                diff.extend(diff_messages)
    
                # compare child elements for same and different ranges part #2
@@ -3811,6 +6357,146 @@ class DhcpdConf:
          diff_messages.append("< " + message)
       return diff_messages
 
+   def __set_line_number(self, conf_item, line_number):
+      self.__line_numbers[id(conf_item)] = (conf_item, line_number)
+
+   def get_line_number(self, conf_item):
+      """
+      Get the line number in dhcpd.conf of a shared network, subnet, range / fixed address or client
+      class. Returns `None` if the element has not been read from dhcpd.conf.
+      """
+      entry = self.__line_numbers.get(id(conf_item))
+      if entry and entry[0] is conf_item:
+         return entry[1]
+      return None
+
+   def validate(self):
+      """
+      Check the configuration for conflicts dhcpd does not report. Duplicates are found by hashing,
+      overlaps by sorting intervals, so all checks together run in O(n log n).
+
+      The following checks are done (severity in brackets):
+         "subnet-overlap" (error) : subnets overlap each other.
+         "outside-subnet" (error) : a range or fixed address is not within its subnet.
+         "range-overlap" (error) : dynamic ranges overlap each other.
+         "fixed-in-range" (error) : a fixed address is within a dynamic range.
+         "duplicate-ip" (error) : multiple fixed addresses use the same IP.
+         "duplicate-mac" (error within a subnet, warning across subnets) : multiple fixed addresses
+            use the same MAC (DUID for DHCPv6).
+         "duplicate-class" (warning) : a client class is defined multiple times for the same element.
+         "orphaned-class" (warning) : a client class has neither options nor policies.
+
+      Returns
+      -------
+      list of dict
+         The findings sorted by line number, each with "check", "severity", "line" (`None` if not
+         known) and "message".
+      """
+
+      findings = []
+      def add_finding(check, severity, conf_item, message):
+         findings.append({ "check" : check, "severity" : severity, "line" : self.get_line_number(conf_item), "message" : message })
+
+      def describe(range_config):
+         if "ip" in range_config:
+            return "{} {} {}".format(range_config["range_type"], range_config["mac"], range_config["ip"])
+         return "{} range {} {}".format(range_config["range_type"], range_config["range_start"], range_config["range_end"])
+
+      def at_line(conf_item):
+         line_number = self.get_line_number(conf_item)
+         return " (line {})".format(line_number) if line_number else ""
+
+      # subnets as (IP version, first IP, last IP, name, config) sorted by first IP
+      subnets = []
+      for subnet in self.get_subnets():
+         network = ipaddress.ip_network("{}/{}".format(subnet["subnet"], subnet["netmask"]), strict=False)
+         subnets.append((network.version, int(network.network_address), int(network.broadcast_address), str(network), subnet))
+      subnets.sort(key=lambda item: item[:2])
+
+      def find_overlaps(intervals, check, name):
+         # intervals must be sorted by start, compare with the interval reaching furthest so far
+         furthest = None
+         for interval in intervals:
+            if furthest and furthest[0] == interval[0] and interval[1] <= furthest[2]:
+               add_finding(check, "error", interval[4], "{} overlaps {}{}".format(name(interval), name(furthest), at_line(furthest[4])))
+            if not furthest or furthest[0] != interval[0] or interval[2] > furthest[2]:
+               furthest = interval
+
+      find_overlaps(subnets, "subnet-overlap", lambda interval: "Subnet " + interval[3])
+
+      # ranges and fixed addresses
+      dynamic_ranges = []
+      fixed_addresses = []
+      ips = {}
+      macs = {}
+      for (version, first, last, subnet_name, subnet) in subnets:
+         for range_config in self.get_ranges(subnet):
+            if "ip" in range_config:
+               ip = ipaddress.ip_address(range_config["ip"])
+               (start, end) = (int(ip), int(ip))
+               fixed_addresses.append((version, start, end, subnet_name, range_config))
+               if ip in ips:
+                  add_finding("duplicate-ip", "error", range_config, "IP {} of {} is already used by {}{}".format(ip, describe(range_config), describe(ips[ip]), at_line(ips[ip])))
+               else:
+                  ips[ip] = range_config
+               mac = _hardware_key(range_config["mac"])
+               if mac in macs:
+                  (other_subnet_name, other) = macs[mac]
+                  if other_subnet_name == subnet_name:
+                     add_finding("duplicate-mac", "error", range_config, "MAC {} of {} is already used by {}{}".format(range_config["mac"], describe(range_config), describe(other), at_line(other)))
+                  else:
+                     add_finding("duplicate-mac", "warning", range_config, "MAC {} of {} is also used by {} in subnet {}{}".format(range_config["mac"], describe(range_config), describe(other), other_subnet_name, at_line(other)))
+               else:
+                  macs[mac] = (subnet_name, range_config)
+            else:
+               start = int(ipaddress.ip_address(range_config["range_start"]))
+               end = int(ipaddress.ip_address(range_config["range_end"]))
+               dynamic_ranges.append((version, start, end, subnet_name, range_config))
+            if start < first or end > last:
+               add_finding("outside-subnet", "error", range_config, "{} is not within subnet {}".format(describe(range_config), subnet_name))
+
+      dynamic_ranges.sort(key=lambda item: item[:2])
+      find_overlaps(dynamic_ranges, "range-overlap", lambda interval: describe(interval[4]))
+
+      # fixed addresses within dynamic ranges : bisect the range starts, the range reaching furthest
+      # among all ranges starting at or before the fixed address is the one that might contain it
+      starts = [ item[:2] for item in dynamic_ranges ]
+      furthest = []
+      for item in dynamic_ranges:
+         if furthest and furthest[-1][0] == item[0] and furthest[-1][2] >= item[2]:
+            furthest.append(furthest[-1])
+         else:
+            furthest.append(item)
+      for item in fixed_addresses:
+         index = bisect.bisect_right(starts, item[:2]) - 1
+         if index >= 0 and furthest[index][0] == item[0] and furthest[index][2] >= item[1]:
+            dynamic_range = furthest[index][4]
+            add_finding("fixed-in-range", "error", item[4], "{} is within {}{}".format(describe(item[4]), describe(dynamic_range), at_line(dynamic_range)))
+
+      # client classes
+      config = self.__dhcpd_conf
+      owner_configs = [ config ]
+      if config.get("is_failover"):
+         owner_configs += self.get_primaries()
+      owner_configs += [ subnet for (version, first, last, subnet_name, subnet) in subnets ]
+      owner_configs += [ item[4] for item in dynamic_ranges + fixed_addresses ]
+      for owner_config in owner_configs:
+         classes = {}
+         for client_class in self.get_client_classes(owner_config):
+            class_match_value = client_class["class_match_value"]
+            if isinstance(class_match_value, list):
+               class_match_value = '" "'.join(class_match_value)
+            name = '{} {}"{}"'.format(client_class["class_type"], client_class["class_match_nr"] + " " if "class_match_nr" in client_class else "", class_match_value)
+            if name in classes:
+               add_finding("duplicate-class", "warning", client_class, "Client class {} is already defined{}".format(name, at_line(classes[name])))
+            else:
+               classes[name] = client_class
+            if not client_class.get(self.__options) and not client_class.get(self.__policies):
+               add_finding("orphaned-class", "warning", client_class, "Client class {} has neither options nor policies".format(name))
+
+      findings.sort(key=lambda finding: (finding["line"] is None, finding["line"] or 0))
+      return findings
+
    def __dump_list(self, list_name, list_items, list_indent, item_indent):
       """
       Used internally by the dump method to dump a list of configuration items,
@@ -3943,7 +6629,7 @@ class DhcpdConf:
       # done
       return client_class_text
 
-   def __dump_subnet(self, subnet, indent):
+   def __iter_subnet(self, subnet, indent):
       """
       Dump a subnet within a DHCP configuration in dhcpd.conf format.
 
@@ -3954,15 +6640,17 @@ class DhcpdConf:
       indent : int
          The indention level to use for a subnet
 
-      Returns
-      -------
-      subnet_text : str
-         A string representation of the subnet in dhcpd.conf syntax
+      Yields
+      ------
+      str
+         The subnet in dhcpd.conf syntax, one chunk per range / fixed address.
       """
 
       # start of subnet
-      subnet_text = ""
-      subnet_text += "{}subnet {} netmask {} {{\n".format(self.__indent[indent],subnet["subnet"],subnet["netmask"])
+      if self.__v6:
+         subnet_text = "{}v6-subnet {}/{} {{\n".format(self.__indent[indent],subnet["subnet"],subnet["netmask"])
+      else:
+         subnet_text = "{}subnet {} netmask {} {{\n".format(self.__indent[indent],subnet["subnet"],subnet["netmask"])
 
       # Excluded Fingerprints
       if self.__fingerprints in subnet:
@@ -3974,65 +6662,72 @@ class DhcpdConf:
       if self.__x_mac_pools in subnet:
          subnet_text += self.__dump_list(self.__x_mac_pools,subnet[self.__x_mac_pools],indent+1,indent+2)
 
+      # subnet policies & options
+      if self.__policies in subnet:
+         subnet_text += self.__dump_policies(subnet[self.__policies], indent + 1)
+      if self.__options in subnet:
+         subnet_text += self.__dump_options(subnet[self.__options], indent + 1)
+      yield subnet_text
+
       # ranges & fixed addresses
       if self.__ranges in subnet:
          for range_config in subnet[self.__ranges]:
             # range or fixed address?
             range_type = range_config["range_type"]
-            fixed_addresses = [ 'manual-dhcp', 'manual-bootp' ]
-            ranges = [ 'dynamic-dhcp', 'automatic-dhcp', 'automatic-bootp' ]
-            if range_type in fixed_addresses:
-               # start of fixed address
-               subnet_text += '{}{} {} {}'.format(self.__indent[indent + 1],range_type,range_config["mac"],range_config["ip"])
+            if "ip" in range_config:
+               # start of fixed address, DHCPv6 reservations might use a DUID
+               duid = "duid " if range_config.get("duid") else ""
+               range_text = '{}{} {}{} {}'.format(self.__indent[indent + 1],range_type,duid,range_config["mac"],range_config["ip"])
             else:
                # start of range
-               subnet_text += '{}{} range {} {}'.format(self.__indent[indent + 1],range_type,range_config["range_start"],range_config["range_end"])
+               range_text = '{}{} range {} {}'.format(self.__indent[indent + 1],range_type,range_config["range_start"],range_config["range_end"])
                # vendor / user class filter
                if "vendor_class" in range_config:
-                  subnet_text += ' class "{}"'.format(range_config["vendor_class"])
+                  range_text += ' class "{}"'.format(range_config["vendor_class"])
                if "user_class" in range_config:
-                  subnet_text += ' userclass'
+                  range_text += ' userclass'
                   for user_class in range_config["user_class"]:
-                     subnet_text += ' "{}"'.format(user_class)
-            subnet_text += ' {\n'
+                     range_text += ' "{}"'.format(user_class)
+            range_text += ' {\n'
             # range policies
             if self.__policies in range_config:
-               subnet_text += self.__dump_policies(range_config[self.__policies], indent + 2)
+               range_text += self.__dump_policies(range_config[self.__policies], indent + 2)
             # range options
             if self.__options in range_config:
-               subnet_text += self.__dump_options(range_config[self.__options], indent + 2)
+               range_text += self.__dump_options(range_config[self.__options], indent + 2)
             # range client classes
             if self.__client_classes in range_config:
                for client_class in range_config[self.__client_classes]:
-                  subnet_text += self.__dump_client_class(client_class, indent + 2)
+                  range_text += self.__dump_client_class(client_class, indent + 2)
             # end of range
-            subnet_text += '{}}}\n'.format(self.__indent[indent + 1])
+            range_text += '{}}}\n'.format(self.__indent[indent + 1])
+            yield range_text
 
       # sbubnet client class
+      subnet_text = ""
       if self.__client_classes in subnet:
          for client_class in subnet[self.__client_classes]:
             subnet_text += self.__dump_client_class(client_class,indent + 1)
 
       # end of subnet
       subnet_text += "{}}}\n".format(self.__indent[indent])
+      yield subnet_text
 
-      # done
-      return subnet_text
-
-
-   def dump(self, dhcpd_conf=None):
+   def iter_dump(self, dhcpd_conf=None):
       """
-      Dump a dhcpd conf dictionary back into a dhcpd.conf format.
+      Dump a dhcpd conf dictionary back into a dhcpd.conf format chunk by chunk, e.g. to write
+      large configurations to a file without building the whole text in memory.
+      Configurations read from a DHCPv6 dhcpd.conf (see `is_v6`) are dumped in DHCPv6 syntax.
 
       Params
       ------
       dhcpd_conf : dict
          A dictionary representing the dhcpd.conf, like the one returned by `get_config`.
 
-      Returns
-      -------
-      dhcpd_conf_text : str
-         A string representation of a dhcpd.conf file's content.
+      Yields
+      ------
+      str
+         Consecutive parts of the dhcpd.conf file's content.
       """
 
       # if no config specified, use the current one
@@ -4041,7 +6736,7 @@ class DhcpdConf:
 
       # start of file
       dhcpd_conf_text = ""
-      dhcpd_conf_text += "server-identifier {};\n\n".format(dhcpd_conf["server-identifier"])
+      dhcpd_conf_text += "{}server-identifier {};\n\n".format("v6-" if self.__v6 else "", dhcpd_conf["server-identifier"])
       indent_level = 1
 
       # fingerprints on top level
@@ -4057,6 +6752,7 @@ class DhcpdConf:
       if self.__x_mac_pools in dhcpd_conf:
          dhcpd_conf_text += self.__dump_list(self.__x_mac_pools, dhcpd_conf[self.__x_mac_pools], indent_level, indent_level + 1)
          dhcpd_conf_text += "\n"
+      yield dhcpd_conf_text
 
       # primary or failover configuration with multiple assigned primaries
       server_configurations = []
@@ -4069,34 +6765,48 @@ class DhcpdConf:
       # dump rest of configuration
       for config in server_configurations:
          if "primary_server" in config:
-            dhcpd_conf_text += "\nprimary-server {};\n\n".format(config["primary_server"])
+            yield "\nprimary-server {};\n\n".format(config["primary_server"])
 
          # print subnet
          if self.__subnets in config:
             for subnet in config[self.__subnets]:
-               dhcpd_conf_text += self.__dump_subnet(subnet, 1)
+               yield from self.__iter_subnet(subnet, 1)
 
          # shared_networks
          if self.__shared_networks in config:
             for shared_network in config[self.__shared_networks]:
-               dhcpd_conf_text += "# Name: {}\n".format(shared_network["shared_network_name"])
-               dhcpd_conf_text += "{}shared-network {} {{\n".format(self.__indent[0],shared_network["shared_network_id"])
+               yield "# Name: {}\n".format(shared_network["shared_network_name"])
+               yield "{}shared-network {} {{\n".format(self.__indent[0],shared_network["shared_network_id"])
                for subnet in shared_network[self.__subnets]:
-                  dhcpd_conf_text += self.__dump_subnet(subnet, indent_level)
-               dhcpd_conf_text += "{}}}\n".format(self.__indent[0])
+                  yield from self.__iter_subnet(subnet, indent_level)
+               yield "{}}}\n".format(self.__indent[0])
 
          # client_classes
          if self.__client_classes in config:
-            dhcpd_conf_text += "\n"
+            yield "\n"
             for client_class in config[self.__client_classes]:
-               dhcpd_conf_text += self.__dump_client_class(client_class, indent_level, option_indent=indent_level + 2)
+               yield self.__dump_client_class(client_class, indent_level, option_indent=indent_level + 2)
 
-      # done
-      return dhcpd_conf_text
+   def dump(self, dhcpd_conf=None):
+      """
+      Dump a dhcpd conf dictionary back into a dhcpd.conf format, see `iter_dump`.
+
+      Params
+      ------
+      dhcpd_conf : dict
+         A dictionary representing the dhcpd.conf, like the one returned by `get_config`.
+
+      Returns
+      -------
+      dhcpd_conf_text : str
+         A string representation of a dhcpd.conf file's content.
+      """
+      return "".join(self.iter_dump(dhcpd_conf))
 
    def dump_to_file(self, dhcpd_conf_dir=None, file_name=None, backup_file_name=None, force=False):
       """
       Dump DHCP configuration to file if the `has_changed` attribute of dhcpd_conf or `force` is set to `True`
+      Nothing is written while a batch is open (see `begin_batch`), edits become visible when the batch is committed.
 
       Parameters
       ----------
@@ -4117,6 +6827,9 @@ class DhcpdConf:
 
       # first check if something needs to be done at all
       dhcpd_conf = self.__dhcpd_conf
+      if self.__batch and self.__batch.is_open():
+         logger.error("DhcpdConf : not dumping configuration while a batch is open")
+         return 30
       if not dhcpd_conf["has_changed"] and not force:
          return 0
 
@@ -4129,6 +6842,21 @@ class DhcpdConf:
          backup_file_name = file_name + ".orig"
       dhcpd_conf_path = dhcpd_conf_dir + "/" + file_name
       dhcpd_conf_backup_path = dhcpd_conf_dir + "/" + backup_file_name
+      dhcpd_conf_tmp_path = dhcpd_conf_path + ".tmp"
+
+      # create new dhcpd.conf based on dhcp_conf in a temporary file, the live file is only replaced if the dump is complete
+      try:
+         with open(dhcpd_conf_tmp_path, "w") as dhcpd_conf_fh:
+            dhcpd_conf_fh.writelines(self.iter_dump())
+            dhcpd_conf_fh.flush()
+            os.fsync(dhcpd_conf_fh.fileno())
+      except Exception as error:
+         logger.exception("Failed to write {} : {} - {}".format(dhcpd_conf_tmp_path,type(error).__name__,error))
+         try:
+            os.unlink(dhcpd_conf_tmp_path)
+         except OSError:
+            pass
+         return 20
 
       # backup existing file before overwriting it
       if os.path.exists(dhcpd_conf_path):
@@ -4136,15 +6864,13 @@ class DhcpdConf:
             shutil.move(dhcpd_conf_path, dhcpd_conf_backup_path)
          except Exception as error:
             logger.exception("Failed to rename {} to {} : {} - {}".format(dhcpd_conf_path,dhcpd_conf_backup_path,type(error).__name__,error))
+            os.unlink(dhcpd_conf_tmp_path)
             return 10
 
-      # create new dhcpd.conf based on dhcp_conf
-      dhcpd_conf_text = self.dump()
       try:
-         with open(dhcpd_conf_path, "w") as dhcpd_conf_fh:
-            dhcpd_conf_fh.write(dhcpd_conf_text)
+         os.replace(dhcpd_conf_tmp_path, dhcpd_conf_path)
       except Exception as error:
-         logger.exception("Failed to write {} : {} - {}".format(dhcpd_conf_path,type(error).__name__,error))
+         logger.exception("Failed to rename {} to {} : {} - {}".format(dhcpd_conf_tmp_path,dhcpd_conf_path,type(error).__name__,error))
          return 20
 
    def dump_pcy(self, dhcpd_pcy=None):
@@ -4236,6 +6962,735 @@ class DhcpdConf:
          logger.exception("Failed to write {} : {} - {}".format(dhcpd_pcy_path,type(error).__name__,error))
          return 20
          
+class DhcpdConfBatch():
+   """
+   Transactional bulk edit of a DhcpdConf. Edits are checked against indexes of the configuration (built
+   once when the batch starts, so each check is O(log n) instead of a scan of all subnets) and are only
+   applied when the batch is committed. Until then `get_config` is unchanged and `dump_to_file` refuses
+   to write. A rollback simply discards the edits.
+
+   Fixed addresses, ranges and subnets are addressed by their IP (fixed address), start IP (range) or
+   subnet address, the subnet of new fixed addresses / ranges is determined by the IP.
+
+   Example
+   -------
+
+   use nnnn_toolkit as toolkit
+   dhcpd_conf = toolkit.DhcpdConf("/opt/qip/current/dhcp")
+   with dhcpd_conf.begin_batch() as batch:
+      batch.add_fixed_address("10.1.0.50", "00-11-22-33-44-55", options={ "host-name" : '"printer1"' })
+      batch.remove_fixed_address("10.1.0.51")
+      batch.add_mac("00-11-22-33-44-55")
+   dhcpd_conf.dump_to_file()
+   """
+
+   # range types with range_start / range_end
+   range_types = ("dynamic-dhcp", "automatic-dhcp", "automatic-bootp", "v6-dynamic-dhcp")
+
+   def __init__(self, dhcpd_conf):
+      """
+      Use `DhcpdConf.begin_batch` to create a batch.
+
+      Parameters
+      ----------
+      dhcpd_conf : DhcpdConf
+         The configuration to edit.
+      """
+      self.dhcpd_conf = dhcpd_conf
+      self.__open = True
+      self.__edits = []
+      self.__change_log = []
+
+      # indexes reflect the configuration including the edits of this batch
+      subnets = []
+      self.__subnet_addresses = {}
+      self.__fixed_addresses = {}
+      self.__ranges = {}
+      self.__macs = {}
+      self.__mac_pools = {}
+      # MACs of fixed addresses changed by this batch by IP, option / policy names by owner
+      self.__staged_macs = {}
+      self.__value_names = {}
+      config = dhcpd_conf.get_config()
+      for subnet in dhcpd_conf.get_subnets():
+         network = ipaddress.ip_network("{}/{}".format(subnet["subnet"], subnet["netmask"]), strict=False)
+         subnet_info = { "network" : network, "config" : subnet, "ranges" : [], "fixed_addresses" : set() }
+         subnets.append(subnet_info)
+         self.__subnet_addresses[network.network_address] = subnet_info
+         for range_config in dhcpd_conf.get_ranges(subnet):
+            if "ip" in range_config:
+               self.__index_fixed_address(subnet_info, range_config)
+            elif range_config["range_type"] in self.range_types:
+               self.__index_range(subnet_info, range_config)
+      self.__subnet_index = AddressIndex([ subnet_info["network"] for subnet_info in subnets ], items=subnets)
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, exc_type, exc_value, traceback):
+      if not self.__open:
+         return
+      if exc_type is None:
+         self.commit()
+      else:
+         self.rollback()
+
+   def is_open(self):
+      """
+      True until the batch has been committed or rolled back.
+      """
+      return self.__open
+
+   def get_change_log(self):
+      """
+      The edits of this batch (not yet applied while the batch is open), see `DhcpdConf.get_change_log`.
+      """
+      return self.__change_log
+
+   ##
+   ## indexes
+   ##
+
+   def __index_fixed_address(self, subnet_info, range_config):
+      ip = ipaddress.ip_address(range_config["ip"])
+      self.__fixed_addresses[ip] = (subnet_info, range_config)
+      subnet_info["fixed_addresses"].add(ip)
+      mac = _hardware_key(range_config["mac"])
+      self.__macs.setdefault((subnet_info["network"], mac), set()).add(ip)
+
+   def __unindex_fixed_address(self, subnet_info, range_config):
+      ip = ipaddress.ip_address(range_config["ip"])
+      del self.__fixed_addresses[ip]
+      subnet_info["fixed_addresses"].discard(ip)
+      self.__macs[(subnet_info["network"], _hardware_key(self.__get_mac(ip, range_config)))].discard(ip)
+      self.__staged_macs.pop(ip, None)
+
+   def __get_mac(self, ip, range_config):
+      # MAC of a fixed address including the updates of this batch
+      return self.__staged_macs.get(ip, range_config["mac"])
+
+   def __get_value_names(self, owner, key):
+      # names of the options / policies of owner including the edits of this batch
+      if (id(owner), key) not in self.__value_names:
+         name_key = "option_name" if key == "options" else "policy_name"
+         self.__value_names[(id(owner), key)] = set(item[name_key] for item in owner.get(key, []))
+      return self.__value_names[(id(owner), key)]
+
+   def __index_range(self, subnet_info, range_config):
+      start = ipaddress.ip_address(range_config["range_start"])
+      end = ipaddress.ip_address(range_config["range_end"])
+      subnet_info["ranges"].append((start, end, range_config))
+      self.__ranges[start] = (subnet_info, range_config)
+
+   def __format_mac(self, mac):
+      # MACs / DUIDs are written as lower case hex digits separated by "-"
+      try:
+         return HardwareKey.parse(mac).format("-")
+      except ValueError:
+         raise ValueError("DhcpdConfBatch : invalid MAC / DUID {}".format(mac)) from None
+
+   def __find_subnet(self, ip):
+      # innermost subnet containing ip
+      subnet_info = self.__subnet_index.lookup(ip)
+      if subnet_info is None:
+         raise KeyError("DhcpdConfBatch : no subnet found for {}".format(ip))
+      return subnet_info
+
+   def __find_range(self, subnet_info, start, end):
+      # first dynamic range of the subnet overlapping start - end
+      for (range_start, range_end, range_config) in subnet_info["ranges"]:
+         if range_start <= end and start <= range_end:
+            return range_config
+      return None
+
+   def __find_target(self, address):
+      ip = ipaddress.ip_address(address)
+      if ip in self.__fixed_addresses:
+         return self.__fixed_addresses[ip][1]
+      if ip in self.__ranges:
+         return self.__ranges[ip][1]
+      if ip in self.__subnet_addresses:
+         return self.__subnet_addresses[ip]["config"]
+      raise KeyError("DhcpdConfBatch : no fixed address, range or subnet {}".format(address))
+
+   def __stage(self, action, item_type, target, apply, details=None):
+      # apply is called on commit
+      entry = { "action" : action, "type" : item_type, "target" : str(target) }
+      if details:
+         entry["details"] = details
+      self.__edits.append(apply)
+      self.__change_log.append(entry)
+
+   def __check_open(self):
+      if not self.__open:
+         raise RuntimeError("DhcpdConfBatch : batch has already been committed / rolled back")
+
+   ##
+   ## edits
+   ##
+
+   def __named_values(self, values, key_type):
+      # options / policies as list of dicts in get_config format
+      named_values = []
+      for (name, value) in (values or {}).items():
+         if key_type == "policy" and not isinstance(value, list):
+            value = [ str(value) ]
+         named_values.append({ "{}_name".format(key_type) : name, "{}_value".format(key_type) : value })
+      return named_values
+
+   def add_fixed_address(self, ip, mac, range_type=None, duid=False, options=None, policies=None):
+      """
+      Add a fixed address to the subnet that contains `ip`.
+
+      Parameters
+      ----------
+      ip : str
+         The IP address.
+      mac : str
+         The MAC address (or DUID for DHCPv6 reservations with `duid` set).
+      range_type : str, optional
+         Defaults to "manual-dhcp" (DHCPv4), "v6-manual-dhcp-mac" or "v6-manual-dhcp" (DHCPv6 by DUID).
+      duid : boolean, optional
+         DHCPv6 reservation by DUID.
+      options : dict, optional
+         Options as name : value.
+      policies : dict, optional
+         Policies as name : value or list of values.
+
+      Raises
+      ------
+      KeyError
+         If there is no subnet for the IP.
+      ValueError
+         If the IP is already used by a fixed address or within a dynamic range, if the MAC is
+         already used by a fixed address of the subnet or if the MAC is invalid.
+      """
+      self.__check_open()
+      address = ipaddress.ip_address(ip)
+      # dhcpd.conf only contains lower case / compressed IPs
+      ip = str(address)
+      mac = self.__format_mac(mac)
+      subnet_info = self.__find_subnet(address)
+      if address in self.__fixed_addresses:
+         raise ValueError("DhcpdConfBatch : {} is already used by a fixed address".format(ip))
+      dynamic_range = self.__find_range(subnet_info, address, address)
+      if dynamic_range:
+         raise ValueError("DhcpdConfBatch : {} is within range {} {}".format(ip, dynamic_range["range_start"], dynamic_range["range_end"]))
+      if self.__macs.get((subnet_info["network"], _hardware_key(mac))):
+         raise ValueError("DhcpdConfBatch : MAC {} is already used in subnet {}".format(mac, subnet_info["network"]))
+      if not range_type:
+         if address.version == 6:
+            range_type = "v6-manual-dhcp" if duid else "v6-manual-dhcp-mac"
+         else:
+            range_type = "manual-dhcp"
+      range_config = { "range_type" : range_type, "mac" : mac, "ip" : ip }
+      if duid:
+         range_config["duid"] = True
+      if policies:
+         range_config["policies"] = self.__named_values(policies, "policy")
+      if options:
+         range_config["options"] = self.__named_values(options, "option")
+      self.__index_fixed_address(subnet_info, range_config)
+      subnet = subnet_info["config"]
+      self.__stage("add", "fixed-address", ip, lambda: subnet.setdefault("ranges", []).append(range_config), { "mac" : mac, "range_type" : range_type })
+
+   def remove_fixed_address(self, ip):
+      """
+      Remove the fixed address with the IP.
+
+      Raises
+      ------
+      KeyError
+         If there is no fixed address with the IP.
+      """
+      self.__check_open()
+      address = ipaddress.ip_address(ip)
+      if address not in self.__fixed_addresses:
+         raise KeyError("DhcpdConfBatch : no fixed address {}".format(ip))
+      (subnet_info, range_config) = self.__fixed_addresses[address]
+      mac = self.__get_mac(address, range_config)
+      self.__unindex_fixed_address(subnet_info, range_config)
+      subnet = subnet_info["config"]
+      self.__stage("remove", "fixed-address", ip, lambda: subnet["ranges"].remove(range_config), { "mac" : mac, "range_type" : range_config["range_type"] })
+
+   def update_fixed_address(self, ip, mac=None, options=None, policies=None):
+      """
+      Change the MAC and / or set options / policies (name : value, a value of `None` removes the
+      option / policy) of the fixed address with the IP.
+
+      Raises
+      ------
+      KeyError
+         If there is no fixed address with the IP.
+      ValueError
+         If the MAC is already used by another fixed address of the subnet or invalid.
+      """
+      self.__check_open()
+      address = ipaddress.ip_address(ip)
+      if address not in self.__fixed_addresses:
+         raise KeyError("DhcpdConfBatch : no fixed address {}".format(ip))
+      (subnet_info, range_config) = self.__fixed_addresses[address]
+      if mac:
+         mac = self.__format_mac(mac)
+         users = self.__macs.get((subnet_info["network"], _hardware_key(mac)))
+         if users and users != { address }:
+            raise ValueError("DhcpdConfBatch : MAC {} is already used in subnet {}".format(mac, subnet_info["network"]))
+         old_mac = self.__get_mac(address, range_config)
+         self.__macs[(subnet_info["network"], _hardware_key(old_mac))].discard(address)
+         self.__macs.setdefault((subnet_info["network"], _hardware_key(mac)), set()).add(address)
+         self.__staged_macs[address] = mac
+         def apply():
+            range_config["mac"] = mac
+         self.__stage("update", "fixed-address", ip, apply, { "mac" : mac, "old_mac" : old_mac })
+      for (name, value) in (options or {}).items():
+         self.__set_value(range_config, ip, "option", name, value)
+      for (name, value) in (policies or {}).items():
+         self.__set_value(range_config, ip, "policy", name, value)
+
+   def add_range(self, range_start, range_end, range_type=None, options=None, policies=None):
+      """
+      Add a dynamic range to the subnet that contains it.
+
+      Parameters
+      ----------
+      range_start : str
+         The first IP of the range.
+      range_end : str
+         The last IP of the range.
+      range_type : str, optional
+         Defaults to "dynamic-dhcp" (DHCPv4) or "v6-dynamic-dhcp" (DHCPv6).
+      options : dict, optional
+         Options as name : value.
+      policies : dict, optional
+         Policies as name : value or list of values.
+
+      Raises
+      ------
+      KeyError
+         If there is no subnet for the range.
+      ValueError
+         If the range is not within a single subnet, overlaps another range or contains a fixed address.
+      """
+      self.__check_open()
+      start = ipaddress.ip_address(range_start)
+      end = ipaddress.ip_address(range_end)
+      # dhcpd.conf only contains lower case / compressed IPs
+      (range_start, range_end) = (str(start), str(end))
+      subnet_info = self.__find_subnet(start)
+      if end < start or end not in subnet_info["network"]:
+         raise ValueError("DhcpdConfBatch : range {} {} is not within subnet {}".format(range_start, range_end, subnet_info["network"]))
+      other_range = self.__find_range(subnet_info, start, end)
+      if other_range:
+         raise ValueError("DhcpdConfBatch : range {} {} overlaps range {} {}".format(range_start, range_end, other_range["range_start"], other_range["range_end"]))
+      for ip in subnet_info["fixed_addresses"]:
+         if start <= ip <= end:
+            raise ValueError("DhcpdConfBatch : range {} {} contains fixed address {}".format(range_start, range_end, ip))
+      if not range_type:
+         range_type = "v6-dynamic-dhcp" if start.version == 6 else "dynamic-dhcp"
+      range_config = { "range_type" : range_type, "range_start" : range_start, "range_end" : range_end }
+      if policies:
+         range_config["policies"] = self.__named_values(policies, "policy")
+      if options:
+         range_config["options"] = self.__named_values(options, "option")
+      self.__index_range(subnet_info, range_config)
+      subnet = subnet_info["config"]
+      self.__stage("add", "range", range_start, lambda: subnet.setdefault("ranges", []).append(range_config), { "range_end" : range_end, "range_type" : range_type })
+
+   def remove_range(self, range_start):
+      """
+      Remove the dynamic range starting at `range_start`.
+
+      Raises
+      ------
+      KeyError
+         If there is no range starting at the IP.
+      """
+      self.__check_open()
+      start = ipaddress.ip_address(range_start)
+      if start not in self.__ranges:
+         raise KeyError("DhcpdConfBatch : no range starting at {}".format(range_start))
+      (subnet_info, range_config) = self.__ranges.pop(start)
+      subnet_info["ranges"] = [ item for item in subnet_info["ranges"] if item[2] is not range_config ]
+      subnet = subnet_info["config"]
+      self.__stage("remove", "range", range_start, lambda: subnet["ranges"].remove(range_config), { "range_end" : range_config["range_end"], "range_type" : range_config["range_type"] })
+
+   def __set_value(self, owner, address, key_type, name, value):
+      # set / replace (value) or remove (value None) an option / policy
+      key = "options" if key_type == "option" else "policies"
+      name_key = "{}_name".format(key_type)
+      names = self.__get_value_names(owner, key)
+      if value is None:
+         if name not in names:
+            raise KeyError("DhcpdConfBatch : {} {} not set for {}".format(key_type, name, address))
+         names.discard(name)
+         def apply():
+            owner[key] = [ item for item in owner[key] if item[name_key] != name ]
+            if not owner[key]:
+               del owner[key]
+         self.__stage("remove", key_type, address, apply, { "name" : name })
+         return
+      new_item = self.__named_values({ name : value }, key_type)[0]
+      names.add(name)
+      def apply():
+         items = owner.setdefault(key, [])
+         for (index, item) in enumerate(items):
+            if item[name_key] == name:
+               items[index] = new_item
+               return
+         items.append(new_item)
+      self.__stage("set", key_type, address, apply, { "name" : name, "value" : new_item["{}_value".format(key_type)] })
+
+   def set_option(self, address, option_name, option_value):
+      """
+      Set an option of a fixed address (IP), range (start IP) or subnet (subnet address).
+      """
+      self.__check_open()
+      self.__set_value(self.__find_target(address), address, "option", option_name, option_value)
+
+   def remove_option(self, address, option_name):
+      """
+      Remove an option of a fixed address (IP), range (start IP) or subnet (subnet address).
+      """
+      self.__check_open()
+      self.__set_value(self.__find_target(address), address, "option", option_name, None)
+
+   def set_policy(self, address, policy_name, policy_value):
+      """
+      Set a policy (value or list of values) of a fixed address (IP), range (start IP) or subnet (subnet address).
+      """
+      self.__check_open()
+      self.__set_value(self.__find_target(address), address, "policy", policy_name, policy_value)
+
+   def remove_policy(self, address, policy_name):
+      """
+      Remove a policy of a fixed address (IP), range (start IP) or subnet (subnet address).
+      """
+      self.__check_open()
+      self.__set_value(self.__find_target(address), address, "policy", policy_name, None)
+
+   def __get_mac_pool(self, mac_pool_type, subnet):
+      if mac_pool_type not in ("mac-pool", "x-mac-pool"):
+         raise ValueError("Invalid mac_pool_type '{}', must be 'mac-pool' or 'x-mac-pool'".format(mac_pool_type))
+      if subnet:
+         ip = ipaddress.ip_address(subnet)
+         if ip not in self.__subnet_addresses:
+            raise KeyError("DhcpdConfBatch : no subnet {}".format(subnet))
+         owner = self.__subnet_addresses[ip]["config"]
+      else:
+         owner = self.dhcpd_conf.get_config()
+      if (id(owner), mac_pool_type) not in self.__mac_pools:
+         self.__mac_pools[(id(owner), mac_pool_type)] = set(_hardware_key(mac) for mac in owner.get(mac_pool_type, []))
+      return (owner, self.__mac_pools[(id(owner), mac_pool_type)])
+
+   def __format_mac_pool_entry(self, mac):
+      # MACs are written like fixed address MACs, wildcard entries in lower case separated by "-"
+      if "*" in mac:
+         return mac.lower().replace(":", "-")
+      return self.__format_mac(mac)
+
+   def add_mac(self, mac, mac_pool_type="mac-pool", subnet=None):
+      """
+      Add a MAC (might contain wildcards "*") to the global MAC pool or the one of a subnet.
+
+      Raises
+      ------
+      ValueError
+         If the MAC already is in the MAC pool or is invalid.
+      """
+      self.__check_open()
+      (owner, macs) = self.__get_mac_pool(mac_pool_type, subnet)
+      mac = self.__format_mac_pool_entry(mac)
+      if _hardware_key(mac) in macs:
+         raise ValueError("DhcpdConfBatch : {} is already in {}".format(mac, mac_pool_type))
+      macs.add(_hardware_key(mac))
+      self.__stage("add", mac_pool_type, subnet or "global", lambda: owner.setdefault(mac_pool_type, []).append(mac), { "mac" : mac })
+
+   def remove_mac(self, mac, mac_pool_type="mac-pool", subnet=None):
+      """
+      Remove a MAC from the global MAC pool or the one of a subnet.
+
+      Raises
+      ------
+      KeyError
+         If the MAC is not in the MAC pool.
+      """
+      self.__check_open()
+      (owner, macs) = self.__get_mac_pool(mac_pool_type, subnet)
+      mac = self.__format_mac_pool_entry(mac)
+      key = _hardware_key(mac)
+      if key not in macs:
+         raise KeyError("DhcpdConfBatch : {} is not in {}".format(mac, mac_pool_type))
+      macs.discard(key)
+      def apply():
+         owner[mac_pool_type] = [ item for item in owner[mac_pool_type] if _hardware_key(item) != key ]
+      self.__stage("remove", mac_pool_type, subnet or "global", apply, { "mac" : mac })
+
+   ##
+   ## transaction
+   ##
+
+   def commit(self):
+      """
+      Apply all edits, update the counters and flag the configuration as changed (if there were edits).
+
+      Returns
+      -------
+      int
+         The number of edits applied.
+      """
+      self.__check_open()
+      config = self.dhcpd_conf.get_config()
+      counters = config.setdefault("counters", {})
+      range_types = config.setdefault("range_types", [])
+      for (apply, entry) in zip(self.__edits, self.__change_log):
+         apply()
+         logger.debug("DhcpdConfBatch : {action} {type} {target}".format(**entry))
+         if entry["type"] in ("fixed-address", "range") and entry["action"] in ("add", "remove"):
+            range_type = entry["details"]["range_type"]
+            counters[range_type] = counters.get(range_type, 0) + (1 if entry["action"] == "add" else -1)
+            if range_type not in range_types:
+               range_types.append(range_type)
+      self.__open = False
+      if self.__edits:
+         self.dhcpd_conf.get_change_log().extend(self.__change_log)
+         self.dhcpd_conf.conf_has_changed()
+      return len(self.__edits)
+
+   def rollback(self):
+      """
+      Discard all edits.
+      """
+      self.__check_open()
+      self.__open = False
+      self.__edits = []
+
+# statements in lease declarations, see `iter_leases`
+lease_start_regex = re.compile(r"^lease\s+([0-9.]+)\s*\{")
+lease_time_regex = re.compile(r"^(starts|ends)\s+(?:\d\s+(\d+)/(\d+)/(\d+)\s+(\d+):(\d+):(\d+)|never)\s*;")
+
+def iter_leases(lines):
+   """
+   Read a dhcpd lease file (dhcpd.leases) line by line in a single pass.
+
+   Yields one dict per lease declaration with "ip", "line" (line number of the declaration),
+   "starts" and "ends" (seconds since the epoch, `None` for "never"), "binding_state", "mac" and
+   "hostname" (`None` if not present). The lease file is a log : later declarations for the
+   same IP replace earlier ones.
+
+   Parameters
+   ----------
+   lines : iterable of str
+      The lines of the lease file, e.g. an open file.
+
+   Raises
+   ------
+   SyntaxError
+      If a lease declaration is not terminated.
+   """
+   lease = None
+   for (line_number, line) in enumerate(lines, start=1):
+      line = line.strip()
+      if lease is None:
+         match = lease_start_regex.match(line)
+         if match:
+            lease = { "ip": match.group(1), "line": line_number, "starts": None, "ends": None, "binding_state": None, "mac": None, "hostname": None }
+         continue
+      if line.startswith("}"):
+         yield lease
+         lease = None
+         continue
+      if line.startswith("lease "):
+         raise SyntaxError("Lease {} at line {} is not terminated".format(lease["ip"], lease["line"]))
+      match = lease_time_regex.match(line)
+      if match:
+         # times are UTC
+         lease[match.group(1)] = calendar.timegm(tuple(map(int, match.groups()[1:]))) if match.group(2) else None
+      elif line.startswith("binding state "):
+         lease["binding_state"] = line[14:].rstrip(";").strip()
+      elif line.startswith("hardware ethernet "):
+         lease["mac"] = line[18:].rstrip(";").strip().lower()
+      elif line.startswith("client-hostname "):
+         lease["hostname"] = line[16:].rstrip(";").strip().strip('"')
+   if lease is not None:
+      raise SyntaxError("Lease {} at line {} is not terminated".format(lease["ip"], lease["line"]))
+
+class LeaseUtilization():
+   """
+   Utilization (leased, expired, abandoned and free addresses) of the dynamic ranges of a
+   DHCP server, calculated from its lease file(s) in a single pass.
+
+   Leases are mapped to ranges by bisecting a sorted index of the integer range start addresses.
+   The state of each address is kept in one byte per address of the ranges, so memory only depends
+   on the size of the ranges, not on the number of lease declarations in the lease files.
+
+   Example
+   -------
+
+   use nnnn_toolkit as toolkit
+   dhcpd_conf = toolkit.DhcpdConf("/opt/qip/current/dhcp")
+   utilization = toolkit.LeaseUtilization(dhcpd_conf)
+   utilization.read_leases("/opt/qip/current/dhcp/dhcpd.leases")
+   print(utilization.get_json())
+   """
+
+   # address states
+   FREE = 0
+   LEASED = 1
+   EXPIRED = 2
+   ABANDONED = 3
+   states = ("free", "leased", "expired", "abandoned")
+
+   # range types with range_start / range_end
+   range_types = ("dynamic-dhcp", "automatic-dhcp", "automatic-bootp")
+
+   def __init__(self, dhcpd_conf, now=None):
+      """
+      Parameters
+      ----------
+      dhcpd_conf : DhcpdConf
+         The configuration of the DHCP server the leases belong to.
+      now : float, optional
+         Leases ending before `now` (seconds since the epoch) are expired, defaults to the current time.
+      """
+      self.now = now if now is not None else time.time()
+      self.unmatched = 0
+      self.ranges = []
+      config = dhcpd_conf.get_config()
+      owner_configs = dhcpd_conf.get_primaries() if config.get("is_failover") else [ config ]
+      for owner_config in owner_configs:
+         for shared_network in dhcpd_conf.get_shared_networks(owner_config):
+            for subnet in dhcpd_conf.get_subnets(owner_config=shared_network):
+               self.__add_ranges(dhcpd_conf, subnet, shared_network["shared_network_name"])
+         for subnet in dhcpd_conf.get_subnets(include_shared_networks=False, owner_config=owner_config):
+            self.__add_ranges(dhcpd_conf, subnet, None)
+      self.ranges.sort(key=lambda range_info: range_info["start"])
+      self.__starts = [ range_info["start"] for range_info in self.ranges ]
+
+   def __add_ranges(self, dhcpd_conf, subnet, shared_network):
+      for range_config in dhcpd_conf.get_ranges(subnet):
+         if range_config["range_type"] not in self.range_types:
+            continue
+         start = int(ipaddress.IPv4Address(range_config["range_start"]))
+         end = int(ipaddress.IPv4Address(range_config["range_end"]))
+         self.ranges.append({
+            "start": start,
+            "end": end,
+            "range_type": range_config["range_type"],
+            "range_start": range_config["range_start"],
+            "range_end": range_config["range_end"],
+            "subnet": str(ipaddress.IPv4Network((subnet["subnet"], subnet["netmask"]))),
+            "shared_network": shared_network,
+            "addresses": bytearray(end - start + 1)
+         })
+
+   def find_range(self, ip):
+      """
+      Get the range (see `ranges`) an IP address (str or int) belongs to or `None`.
+      """
+      if not isinstance(ip, int):
+         ip = int.from_bytes(socket.inet_aton(ip), "big")
+      index = bisect.bisect_right(self.__starts, ip) - 1
+      if index >= 0 and ip <= self.ranges[index]["end"]:
+         return self.ranges[index]
+      return None
+
+   def add_lease(self, lease):
+      """
+      Update the state of the leased address, `lease` as yielded by `iter_leases`.
+      """
+      ip = int.from_bytes(socket.inet_aton(lease["ip"]), "big")
+      range_info = self.find_range(ip)
+      if not range_info:
+         self.unmatched += 1
+         return
+      binding_state = lease["binding_state"]
+      if binding_state == "abandoned":
+         state = self.ABANDONED
+      elif binding_state in ("free", "released", "backup"):
+         state = self.FREE
+      elif binding_state == "expired" or (lease["ends"] is not None and lease["ends"] <= self.now):
+         state = self.EXPIRED
+      else:
+         state = self.LEASED
+      range_info["addresses"][ip - range_info["start"]] = state
+
+   def read_leases(self, lease_file):
+      """
+      Add all leases of a lease file, see `iter_leases`.
+
+      Raises
+      ------
+      OSError
+         If the lease file cannot be read.
+      SyntaxError
+         If a lease declaration is not terminated.
+      """
+      with open(lease_file) as lease_fh:
+         for lease in iter_leases(lease_fh):
+            self.add_lease(lease)
+
+   def __counts(self, range_info):
+      addresses = range_info["addresses"]
+      counts = { "size": len(addresses) }
+      for state in range(1, len(self.states)):
+         counts[self.states[state]] = addresses.count(state)
+      counts["free"] = counts["size"] - counts["leased"] - counts["expired"] - counts["abandoned"]
+      return counts
+
+   def get_report(self):
+      """
+      Get the utilization per range, subnet and shared network.
+
+      Returns
+      -------
+      dict
+         "ranges", "subnets" and "shared_networks" are lists of dicts with the address counts
+         ("size", "leased", "expired", "abandoned", "free") and the utilization in percent (leased
+         addresses), "unmatched" is the number of lease declarations not within any range.
+      """
+      report = { "ranges": [], "subnets": [], "shared_networks": [], "unmatched": self.unmatched }
+      subnets = {}
+      shared_networks = {}
+      for range_info in self.ranges:
+         counts = self.__counts(range_info)
+         report["ranges"].append(dict({ key: range_info[key] for key in ("range_start", "range_end", "range_type", "subnet", "shared_network") }, **counts))
+         subnet = subnets.setdefault(range_info["subnet"], { "subnet": range_info["subnet"], "shared_network": range_info["shared_network"] })
+         aggregates = [ subnet ]
+         if range_info["shared_network"]:
+            aggregates.append(shared_networks.setdefault(range_info["shared_network"], { "shared_network": range_info["shared_network"] }))
+         for aggregate in aggregates:
+            for (key, value) in counts.items():
+               aggregate[key] = aggregate.get(key, 0) + value
+      report["subnets"] = list(subnets.values())
+      report["shared_networks"] = list(shared_networks.values())
+      for item in report["ranges"] + report["subnets"] + report["shared_networks"]:
+         item["utilization"] = round(item["leased"] * 100 / item["size"], 2)
+      return report
+
+   def get_json(self):
+      """
+      Get the utilization report (see `get_report`) as JSON formatted string.
+      """
+      return to_json(self.get_report())
+
+   def write_csv(self, csv_fh, level="ranges"):
+      """
+      Write the utilization of each range, subnet or shared network as CSV.
+
+      Parameters
+      ----------
+      csv_fh : file object
+         Open file (text mode) to write to.
+      level : str, optional
+         "ranges" (default), "subnets" or "shared_networks".
+      """
+      rows = self.get_report()[level]
+      columns = { "ranges": [ "range_start", "range_end", "range_type", "subnet", "shared_network" ], "subnets": [ "subnet", "shared_network" ], "shared_networks": [ "shared_network" ] }[level]
+      columns += [ "size", "leased", "expired", "abandoned", "free", "utilization" ]
+      writer = csv.DictWriter(csv_fh, fieldnames=columns)
+      writer.writeheader()
+      writer.writerows(rows)
+
 class DomainHierarchy():
    """
    Represents DNS hierarchy and provides method to find best match in domain hierarchy
@@ -4317,6 +7772,304 @@ class DomainHierarchy():
 
       return domain_name
 
+##
+## Configuration history
+##
+
+class ConfigSnapshots():
+   """
+   Store of DhcpdConf / NamedConf snapshots to answer history queries (e.g. "when did the fixed address of
+   host X change") without reading old configuration files again.
+
+   Each configuration is flattened to keyed elements, a snapshot only stores the elements that were added /
+   changed ("set") or removed since the previous snapshot as one JSON line in <store_dir>/<kind>.snapshots
+   (kind is "dhcpd" or "named"). The flattened state of the last snapshot is kept in <store_dir>/<kind>.state
+   so adding a snapshot does not replay the deltas. History queries only decode the deltas that mention
+   the key.
+
+   Keys of kind "dhcpd" (prefixed with "primary <IP> " for the primaries of a failover configuration):
+      "global", "shared-network <ID>", "subnet <network>/<prefix length>", "range <start IP> <end IP>",
+      "fixed-address <IP>" and "mac <MAC / DUID>" (the IPs of the fixed addresses with that MAC / DUID)
+
+   Keys of kind "named":
+      "options", "acl <name>", "key <name>" (the secret is stored as SHA256 hash), "view <name>" and
+      "zone <view> <zone>"
+
+   Example
+   -------
+
+   use nnnn_toolkit as toolkit
+   snapshots = toolkit.ConfigSnapshots("/opt/qip/current/history")
+   snapshots.add(toolkit.DhcpdConf("/opt/qip/current/dhcp"))
+   for change in snapshots.history("fixed-address 10.1.0.50"):
+      print(change["timestamp"], change["action"], change["value"])
+   """
+
+   kinds = ("dhcpd", "named")
+
+   # elements of the DHCP configuration that are not part of "global"
+   dhcpd_skip = ("subnets", "shared-networks", "primary", "counters", "range_types", "has_changed", "file_name")
+
+   def __init__(self, store_dir):
+      """
+      Parameters
+      ----------
+      store_dir : str
+         The directory to keep the snapshots in, created if it does not exist.
+      """
+      self.store_dir = store_dir
+      # kind -> { "snapshot" : last snapshot number, "log_size" : size of the snapshot file, "state" : key -> JSON }
+      self.__states = {}
+
+   def __paths(self, kind):
+      if kind not in self.kinds:
+         raise ValueError("ConfigSnapshots : invalid kind '{}', must be one of {}".format(kind, self.kinds))
+      return (os.path.join(self.store_dir, kind + ".snapshots"), os.path.join(self.store_dir, kind + ".state"))
+
+   def __iter_records(self, kind, needle=None):
+      # decoded snapshot records, only the ones containing `needle` (JSON encoded) if specified
+      (log_path, state_path) = self.__paths(kind)
+      if not os.path.exists(log_path):
+         return
+      with open(log_path, encoding="utf-8") as fh:
+         for line in fh:
+            if needle and needle not in line:
+               continue
+            yield json.loads(line)
+
+   def __get_state(self, kind):
+      if kind in self.__states:
+         return self.__states[kind]
+      (log_path, state_path) = self.__paths(kind)
+      log_size = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+      state = None
+      try:
+         with open(state_path, encoding="utf-8") as fh:
+            state = json.load(fh)
+      except (OSError, ValueError):
+         pass
+      # the state is written after the snapshot, replay the deltas if it is missing or outdated
+      if not state or state.get("log_size") != log_size:
+         logger.debug("ConfigSnapshots : rebuilding {} state from {}".format(kind, log_path))
+         state = { "snapshot" : 0, "log_size" : log_size, "state" : {} }
+         for record in self.__iter_records(kind):
+            self.__apply(state["state"], record, encode=True)
+            state["snapshot"] = record["snapshot"]
+      self.__states[kind] = state
+      return state
+
+   def __apply(self, state, record, encode=False):
+      for (key, value) in record["set"].items():
+         state[key] = self.__encode(value) if encode else value
+      for key in record["removed"]:
+         state.pop(key, None)
+
+   def __encode(self, value):
+      # canonical JSON to compare element values
+      return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+   ##
+   ## flatten configurations
+   ##
+
+   def __canonical_key(self, key):
+      (element, separator, name) = key.partition(" ")
+      try:
+         if element == "primary":
+            (primary, separator, rest) = name.partition(" ")
+            return "primary {} {}".format(primary, self.__canonical_key(rest))
+         if element == "fixed-address":
+            name = str(ipaddress.ip_address(name))
+         elif element == "subnet":
+            name = str(ipaddress.ip_network(name, strict=False))
+         elif element == "range":
+            name = " ".join(str(ipaddress.ip_address(ip)) for ip in name.split())
+         elif element == "mac":
+            name = str(_hardware_key(name))
+      except ValueError:
+         pass
+      return element + separator + name
+
+   def __flatten_dhcpd(self, dhcpd_conf):
+      config = dhcpd_conf.get_config()
+      owners = [ (config, "") ]
+      if config.get("is_failover"):
+         for primary_conf in config.get("primary", []):
+            owners.append((primary_conf, "primary {} ".format(primary_conf.get("primary_server"))))
+      elements = {}
+      for (owner, prefix) in owners:
+         elements[prefix + "global"] = { key : value for (key, value) in owner.items() if key not in self.dhcpd_skip }
+         subnets = list(owner.get("subnets", []))
+         for shared_network in owner.get("shared-networks", []):
+            elements[prefix + "shared-network " + shared_network["shared_network_id"]] = { key : value for (key, value) in shared_network.items() if key != "subnets" }
+            subnets.extend(shared_network.get("subnets", []))
+         macs = {}
+         for subnet in subnets:
+            subnet_key = self.__canonical_key("subnet {}/{}".format(subnet["subnet"], subnet["netmask"]))
+            elements[prefix + subnet_key] = { key : value for (key, value) in subnet.items() if key != "ranges" }
+            for range_config in subnet.get("ranges", []):
+               if "ip" in range_config:
+                  fixed_key = self.__canonical_key("fixed-address " + range_config["ip"])
+                  elements[prefix + fixed_key] = range_config
+                  macs.setdefault(prefix + "mac " + str(_hardware_key(range_config["mac"])), []).append(fixed_key.partition(" ")[2])
+               else:
+                  elements[prefix + self.__canonical_key("range {} {}".format(range_config["range_start"], range_config["range_end"]))] = range_config
+         for (key, ips) in macs.items():
+            elements[key] = sorted(ips)
+      return elements
+
+   def __flatten_named(self, named_conf):
+      config = named_conf.get_config()
+      elements = { "options" : config.get("options", []) }
+      for acl in config.get("acls", []):
+         elements["acl " + acl["acl_name"]] = acl
+      for key_config in config.get("keys", []):
+         key_config = dict(key_config)
+         if "secret" in key_config:
+            key_config["secret"] = hashlib.sha256(key_config["secret"].encode()).hexdigest()
+         elements["key " + key_config["key_name"]] = key_config
+      for view in config.get("views", []):
+         elements["view " + view["view_name"]] = { key : value for (key, value) in view.items() if key != "zones" }
+         for zone in view.get("zones", []):
+            elements["zone {} {}".format(view["view_name"], zone["zone_name"])] = { key : value for (key, value) in zone.items() if key not in ("has_journal", "journal_file_path") }
+      return elements
+
+   ##
+   ## snapshots
+   ##
+
+   def add(self, conf, timestamp=None, label=None):
+      """
+      Add a snapshot of a configuration. Nothing is written if the configuration did not change since
+      the previous snapshot.
+
+      Parameters
+      ----------
+      conf : DhcpdConf or NamedConf
+         The configuration.
+      timestamp : int, optional
+         Time of the configuration (seconds since the epoch), e.g. the modification time of a backup,
+         defaults to now.
+      label : str, optional
+         Label to store with the snapshot, e.g. the path of the backup.
+
+      Returns
+      -------
+      int
+         The number of the snapshot (of the previous snapshot if nothing changed).
+
+      Raises
+      ------
+      OSError
+         If the snapshot cannot be written.
+      """
+      if isinstance(conf, DhcpdConf):
+         (kind, elements) = ("dhcpd", self.__flatten_dhcpd(conf))
+         file_name = conf.get_config().get("file_name")
+      elif isinstance(conf, NamedConf):
+         (kind, elements) = ("named", self.__flatten_named(conf))
+         file_name = None
+      else:
+         raise TypeError("ConfigSnapshots : cannot add {}".format(type(conf).__name__))
+
+      state = self.__get_state(kind)
+      previous = state["state"]
+      current = { key : self.__encode(value) for (key, value) in elements.items() }
+      changed = { key : elements[key] for (key, value) in current.items() if previous.get(key) != value }
+      removed = sorted(key for key in previous if key not in current)
+      if state["snapshot"] and not changed and not removed:
+         logger.debug("ConfigSnapshots : {} did not change since snapshot {}".format(kind, state["snapshot"]))
+         return state["snapshot"]
+
+      record = { "snapshot" : state["snapshot"] + 1, "timestamp" : int(timestamp if timestamp is not None else time.time()),
+                 "label" : label, "file_name" : file_name, "set" : changed, "removed" : removed }
+      (log_path, state_path) = self.__paths(kind)
+      os.makedirs(self.store_dir, exist_ok=True)
+      with open(log_path, "a", encoding="utf-8") as fh:
+         fh.write(json.dumps(record) + "\n")
+      state.update(snapshot=record["snapshot"], log_size=os.path.getsize(log_path), state=current)
+      with open(state_path + ".tmp", "w", encoding="utf-8") as fh:
+         json.dump(state, fh)
+      os.replace(state_path + ".tmp", state_path)
+      logger.debug("ConfigSnapshots : added {} snapshot {} ({} set, {} removed)".format(kind, record["snapshot"], len(changed), len(removed)))
+      return record["snapshot"]
+
+   def get_snapshots(self, kind="dhcpd"):
+      """
+      Get the snapshots of a kind.
+
+      Returns
+      -------
+      list of dict
+         "snapshot" (number), "timestamp", "label", "file_name" and the number of "set" / "removed" elements.
+      """
+      snapshots = []
+      for record in self.__iter_records(kind):
+         snapshots.append({ "snapshot" : record["snapshot"], "timestamp" : record["timestamp"], "label" : record["label"],
+                            "file_name" : record["file_name"], "set" : len(record["set"]), "removed" : len(record["removed"]) })
+      return snapshots
+
+   def get_state(self, snapshot=None, kind="dhcpd"):
+      """
+      Get the flattened configuration at a snapshot.
+
+      Parameters
+      ----------
+      snapshot : int, optional
+         The snapshot number, defaults to the last snapshot.
+      kind : str, optional
+         "dhcpd" (default) or "named".
+
+      Returns
+      -------
+      dict
+         The elements of the configuration by key (see class description).
+      """
+      if snapshot is None:
+         return { key : json.loads(value) for (key, value) in self.__get_state(kind)["state"].items() }
+      state = {}
+      for record in self.__iter_records(kind):
+         if record["snapshot"] > snapshot:
+            break
+         self.__apply(state, record)
+      return state
+
+   def history(self, key, kind=None):
+      """
+      Get the changes of an element by walking the deltas.
+
+      Parameters
+      ----------
+      key : str
+         The key of the element (see class description), e.g. "fixed-address 10.1.0.50",
+         "mac 00:11:22:33:44:55" or "zone internal example.com". IPs, networks and MACs are
+         normalized, so any notation can be used.
+      kind : str, optional
+         "dhcpd" or "named", derived from the key if not specified.
+
+      Returns
+      -------
+      list of dict
+         The changes in order, each with "snapshot", "timestamp", "label", "action" ("added", "changed"
+         or "removed") and "value" (the element after the change, `None` if removed).
+      """
+      key = self.__canonical_key(key)
+      if not kind:
+         kind = "named" if key.partition(" ")[0] in ("options", "acl", "key", "view", "zone") else "dhcpd"
+      changes = []
+      exists = False
+      for record in self.__iter_records(kind, needle=json.dumps(key)):
+         if key in record["set"]:
+            action = "changed" if exists else "added"
+            (exists, value) = (True, record["set"][key])
+         elif key in record["removed"]:
+            (action, exists, value) = ("removed", False, None)
+         else:
+            continue
+         changes.append({ "snapshot" : record["snapshot"], "timestamp" : record["timestamp"], "label" : record["label"],
+                          "action" : action, "value" : value })
+      return changes
+
 
 ###
 ### for testing